@@ -11,7 +11,13 @@ setup(
     long_description=open("README.rst").read(),
     author="Andrew Davison",
     author_email="andrew.davison@cnrs.fr",
-    packages=["sumatra_server", "sumatra_server.templatetags", "sumatra_server.migrations"],
+    packages=[
+        "sumatra_server",
+        "sumatra_server.templatetags",
+        "sumatra_server.migrations",
+        "sumatra_server.management",
+        "sumatra_server.management.commands",
+    ],
     package_data={"sumatra_server": ["templates/*.html", "fixtures/*.json"]},
     classifiers=[
         "Development Status :: 4 - Beta",
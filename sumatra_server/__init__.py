@@ -1 +1,3 @@
 __version__ = "0.3dev"
+
+default_app_config = "sumatra_server.apps.SumatraServerConfig"
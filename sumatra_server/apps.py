@@ -0,0 +1,20 @@
+"""
+Sumatra Server
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class SumatraServerConfig(AppConfig):
+    name = "sumatra_server"
+    verbose_name = "Sumatra Server"
+
+    def ready(self):
+        if getattr(settings, "SUMATRA_WARM_UP", False):
+            from .warmup import warm_up
+
+            warm_up()
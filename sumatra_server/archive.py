@@ -0,0 +1,145 @@
+"""
+Archiving of old records.
+
+Records which are no longer being worked on can be moved out of the record
+table, and the tables of parameters, data keys, etc. which it joins, into a
+table holding the JSON document of each record, compressed. This keeps the
+queries on the active records of a project fast, and the archived records
+take much less space.
+
+Archived records can still be read by label, through the same URLs as
+before, and are restored to the record table, unchanged, if they are
+modified or deleted, or by the ``restore_records`` command. They are not
+included in record lists, statistics, comparisons or facet counts.
+
+Moving a record to or from the archive does not change its content, so is
+not stored as a revision.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.db import transaction
+from django.db.models import Q
+
+from sumatra.recordstore.django_store.models import Record
+from tagging.utils import parse_tag_input
+from .models import ArchivedRecord, ArchivedDataKey, RevisionCounter
+from .ingest import create_record
+from .facets import record_facets, update_counts
+from .serializers import RecordSerializer, with_related
+
+# archived records are stored in the latest format, which includes every field
+archive_media_type = "application/vnd.sumatra.record-v4+json"
+
+
+def _with_tags(queryset, tags):
+    """
+    The records (or archived records) in `queryset` having any of the given
+    tags. The tags column is searched for each tag as a substring, then split
+    as django-tagging does, so that only whole tags match.
+    """
+    tags = set(tags)
+    query = Q()
+    for tag in tags:
+        query |= Q(tags__contains=tag)
+    candidates = queryset.filter(query).values_list("pk", "tags")
+    return queryset.filter(
+        pk__in=[pk for pk, column in candidates if tags.intersection(parse_tag_input(column))]
+    )
+
+
+def archivable_records(project_id, before=None, tags=None):
+    """
+    The records of a project created before the datetime `before`, and/or
+    having any of the given `tags`.
+    """
+    records = Record.objects.filter(project=project_id)
+    if before is not None:
+        records = records.filter(timestamp__lt=before)
+    if tags:
+        records = _with_tags(records, tags)
+    return records.order_by("timestamp")
+
+
+def archive_record(record):
+    """
+    Move a record from the record table to the archive. Returns False if the
+    record has been deleted since it was read.
+    """
+    with transaction.atomic():
+        # lock the row and read it again, so that an update made since it was
+        # read is archived rather than lost
+        records = Record.objects.filter(pk=record.pk)
+        if not list(records.select_for_update().values_list("pk", flat=True)):
+            return False
+        record = with_related(records).get()
+        document = RecordSerializer(archive_media_type).to_dict(record, record.project_id)
+        archived = ArchivedRecord.objects.create(
+            project_id=record.project_id,
+            label=record.label,
+            timestamp=record.timestamp,
+            tags=record.tags,
+            content=ArchivedRecord.compress(document),
+        )
+        ArchivedDataKey.objects.bulk_create(
+            ArchivedDataKey(record=archived, path=key["path"], digest=key["digest"])
+            for key in document["input_data"] + document["output_data"]
+        )
+        record.delete()
+        update_counts(record.project_id, old=record_facets(record))
+        RevisionCounter.archive_changed(record.project_id)
+    return True
+
+
+def archive_records(project_id, before=None, tags=None, batch_size=100, dry_run=False):
+    """
+    Archive the records selected by archivable_records(), `batch_size` at a
+    time. Returns the number of records archived (or which would be, for a
+    dry run).
+    """
+    records = archivable_records(project_id, before, tags)
+    if dry_run:
+        return records.count()
+    count = 0
+    while True:
+        # each batch is read afresh, since the previous one has been deleted
+        batch = list(records[:batch_size])
+        for record in batch:
+            count += archive_record(record)
+        if len(batch) < batch_size:
+            return count
+
+
+def restore_record(archived):
+    """Move a record from the archive back to the record table."""
+    with transaction.atomic():
+        record = create_record(archived.project, archived.label, archived.to_dict(), revision=False)
+        archived.delete()
+        RevisionCounter.archive_changed(archived.project_id)
+    return record
+
+
+def restore_if_archived(project_id, label):
+    """Restore the record with the given label, if it is in the archive."""
+    archived = ArchivedRecord.objects.filter(project=project_id, label=label).first()
+    if archived is not None:
+        restore_record(archived)
+    return archived is not None
+
+
+def restore_records(project_id, labels=None, tags=None):
+    """
+    Restore the archived records of a project with the given labels and/or
+    any of the given tags, or all of them. Returns the number restored.
+    """
+    archived = ArchivedRecord.objects.filter(project=project_id).select_related("project")
+    if labels:
+        archived = archived.filter(label__in=labels)
+    if tags:
+        archived = _with_tags(archived, tags)
+    count = 0
+    for entry in archived.iterator():
+        restore_record(entry)
+        count += 1
+    return count
@@ -0,0 +1,151 @@
+"""
+Content-addressed storage of the files produced by records.
+
+Files are stored under ``SUMATRA_BLOB_ROOT``, named by the SHA-1 digest
+which Sumatra already records for each data key, in subdirectories given
+by the first characters of the digest, so that a file shared by several
+records, or several projects, is only stored once. Content is read and
+written in chunks and never held in memory in full.
+
+Large files may be uploaded in several parts. The parts are appended to a
+file in the "uploads" directory, which is moved into place, once complete,
+if its content matches the digest.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+
+
+chunk_size = 64 * 1024
+
+
+class BlobError(ValueError):
+    """Raised for uploaded content which cannot be stored."""
+
+    def __init__(self, message, status=400, received=None):
+        super(BlobError, self).__init__(message)
+        self.status = status
+        self.received = received
+
+
+def _copy(stream, fp, hasher=None):
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return size
+        fp.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        size += len(chunk)
+
+
+class BlobStore(object):
+    """Files stored in a directory on the local filesystem, named by their SHA-1 digest."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def upload_path(self, digest):
+        return os.path.join(self.root, "uploads", digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    def iter_range(self, digest, start, end):
+        """Yield the bytes from `start` to `end` inclusive, in chunks."""
+        with self.open(digest) as fp:
+            fp.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = fp.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def _move_into_place(self, tmp_path, digest):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)  # atomic, so readers never see part of a file
+
+    def write(self, digest, stream):
+        """
+        Store the content read from `stream`. Returns False, without reading
+        the stream, if the content is already stored.
+        """
+        if self.exists(digest):
+            return False
+        uploads = os.path.dirname(self.upload_path(digest))
+        os.makedirs(uploads, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=uploads)
+        hasher = hashlib.sha1()
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                _copy(stream, fp, hasher)
+            if hasher.hexdigest() != digest:
+                raise BlobError("Content does not match the digest %s" % digest)
+            self._move_into_place(tmp_path, digest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True
+
+    def received(self, digest):
+        """The number of bytes received so far in a partial upload."""
+        try:
+            return os.path.getsize(self.upload_path(digest))
+        except OSError:
+            return 0
+
+    def append(self, digest, stream, offset, end):
+        """
+        Add a part, holding the bytes from `offset` to `end` inclusive, to a
+        partial upload. Returns the number of bytes received so far. A part of
+        the wrong length is discarded.
+        """
+        received = self.received(digest)
+        if offset != received:
+            raise BlobError(
+                "Expected a part starting at byte %d" % received, status=409, received=received
+            )
+        path = self.upload_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as fp:
+            size = _copy(stream, fp)
+            if size != end - offset + 1:
+                fp.truncate(received)
+                raise BlobError("Part does not match its Content-Range", received=received)
+        return received + size
+
+    def complete(self, digest):
+        """Check the content of a partial upload, and store it."""
+        path = self.upload_path(digest)
+        hasher = hashlib.sha1()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b""):
+                hasher.update(chunk)
+        if hasher.hexdigest() != digest:
+            os.remove(path)
+            raise BlobError("Content does not match the digest %s" % digest)
+        self._move_into_place(path, digest)
+
+
+def get_blob_store():
+    """The blob store, or None if SUMATRA_BLOB_ROOT is not set."""
+    root = getattr(settings, "SUMATRA_BLOB_ROOT", None)
+    return root and BlobStore(root) or None
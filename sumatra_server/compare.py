@@ -0,0 +1,124 @@
+"""
+Comparison of several records, reporting only the attributes which differ.
+
+Records are compared using the values stored in the database, rather than by
+converting each one to a Sumatra record, so that a comparison needs only the
+queries made to load the records and their related objects.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+
+from sumatra.recordstore.django_store.models import Record, Tag
+
+
+simple_fields = (
+    "reason",
+    "outcome",
+    "duration",
+    "main_file",
+    "version",
+    "diff",
+    "user",
+    "script_arguments",
+    "stdout_stderr",
+    "repeats",
+    "timestamp",
+)
+
+
+def _flatten(dct, prefix=""):
+    flat = {}
+    for key, value in dct.items():
+        name = "%s%s" % (prefix, key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def _parameters(record):
+    """The parameters of a record as a flat dict with dotted names."""
+    ps = record.parameters.to_sumatra()  # parses the stored content, no query
+    if hasattr(ps, "as_dict"):
+        return _flatten(ps.as_dict())
+    elif isinstance(ps, dict):
+        return _flatten(ps)
+    else:
+        return {"": ps}
+
+
+def _summary(record, tags):
+    data = dict((name, getattr(record, name)) for name in simple_fields)
+    ex = record.executable
+    data["executable"] = ex and {"name": ex.name, "path": ex.path, "version": ex.version}
+    repos = record.repository
+    data["repository"] = repos and {"type": repos.type, "url": repos.url}
+    data["launch_mode"] = {
+        "type": record.launch_mode.type,
+        "parameters": record.launch_mode.parameters,
+    }
+    data["datastore"] = {"type": record.datastore.type, "parameters": record.datastore.parameters}
+    data["input_datastore"] = {
+        "type": record.input_datastore.type,
+        "parameters": record.input_datastore.parameters,
+    }
+    data["input_data"] = sorted((key.path, key.digest) for key in record.input_data.all())
+    data["output_data"] = sorted((key.path, key.digest) for key in record.output_data.all())
+    data["platforms"] = [
+        dict((name, getattr(pi, name)) for name in pi.field_names())
+        for pi in record.platforms.all()
+    ]
+    data["tags"] = sorted(tags)
+    return data
+
+
+def _differing(values_by_label):
+    """Keep only the keys for which not all labels have the same value."""
+    keys = set()
+    for values in values_by_label.values():
+        keys.update(values)
+    differences = {}
+    for key in sorted(keys):
+        values = dict((label, values.get(key)) for label, values in values_by_label.items())
+        if len(set(repr(v) for v in values.values())) > 1:
+            differences[key] = values
+    return differences
+
+
+def tags_by_record(records):
+    """The tags of several records, loaded with a single query."""
+    tags = dict((record.pk, []) for record in records)
+    items = Tag.objects.filter(
+        items__content_type=ContentType.objects.get_for_model(Record),
+        items__object_id__in=list(tags),
+    ).values_list("items__object_id", "name")
+    for pk, name in items:
+        tags[pk].append(name)
+    return tags
+
+
+def compare_records(records):
+    """
+    Compare a sequence of records. Returns a dict with the attributes that
+    differ between them ("fields"), and parameter-level and
+    dependency-level differences ("parameters", "dependencies"). Each
+    difference maps record labels to values, with None where a record does
+    not have the parameter or dependency.
+    """
+    tags = tags_by_record(records)
+    summaries = dict((record.label, _summary(record, tags[record.pk])) for record in records)
+    parameters = dict((record.label, _parameters(record)) for record in records)
+    dependencies = dict(
+        (record.label, dict((dep.name, dep.version) for dep in record.dependencies.all()))
+        for record in records
+    )
+    return {
+        "labels": [record.label for record in records],
+        "fields": _differing(summaries),
+        "parameters": _differing(parameters),
+        "dependencies": _differing(dependencies),
+    }
@@ -0,0 +1,141 @@
+"""
+Facet counts: the number of records in a project with each tag, executable,
+main file, outcome and version, for building tag clouds and filter menus.
+
+The counts are stored in the FacetCount table and updated, in the same
+transaction, whenever a record is created, updated, deleted or archived
+(see ingest.py and archive.py), so reading them costs one query however
+many records a project has. ``rebuild_facets()`` recounts a project from
+its records, e.g. for records stored before the counts were introduced
+(see migration 0007).
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from collections import Counter
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from sumatra.recordstore.django_store.models import Record
+from tagging.utils import parse_tag_input
+from .models import FacetCount
+
+
+facet_names = ("tags", "executable", "main_file", "outcome", "version")
+max_values = 100  # largest number of values returned for each facet
+max_value_length = FacetCount._meta.get_field("value").max_length
+
+
+class FacetError(ValueError):
+    """Raised for a ``facets`` parameter naming an unknown facet."""
+
+    pass
+
+
+def parse_facets(value):
+    """
+    Parse the comma-separated list of facet names in `value`. An empty
+    value, or "all", gives every facet.
+    """
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    if not names or names == ["all"]:
+        return list(facet_names)
+    for name in names:
+        if name not in facet_names:
+            raise FacetError(
+                "Unknown facet '%s'. Available facets are: %s" % (name, ", ".join(facet_names))
+            )
+    return names
+
+
+# the columns read by rebuild_facets(), in the order of the arguments of _facets()
+_columns = ("executable__name", "executable__version", "main_file", "version", "outcome", "tags")
+
+
+def _facets(executable_name, executable_version, main_file, version, outcome, tags):
+    executable = " ".join(v for v in (executable_name, executable_version) if v)
+    values = [
+        ("executable", executable),
+        ("main_file", main_file),
+        ("version", version),
+        ("outcome", outcome),
+    ]
+    values.extend(("tags", tag) for tag in set(parse_tag_input(tags)))
+    return [(facet, value[:max_value_length]) for facet, value in values if value]
+
+
+def record_facets(record):
+    """
+    The (facet, value) pairs of a record. The tags are read from the tags
+    column, in the same way as django-tagging does when storing them.
+    """
+    executable = record.executable
+    return _facets(
+        executable and executable.name,
+        executable and executable.version,
+        record.main_file,
+        record.version,
+        record.outcome,
+        record.tags,
+    )
+
+
+def _change(project_id, facet, value, delta):
+    rows = FacetCount.objects.filter(project=project_id, facet=facet, value=value)
+    if delta < 0:
+        # a value which no longer has any records is removed
+        if not rows.filter(count__gt=-delta).update(count=F("count") + delta):
+            rows.delete()
+        return
+    if not rows.update(count=F("count") + delta):
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(
+                    project_id=project_id, facet=facet, value=value, count=delta
+                )
+        except IntegrityError:
+            # created by a concurrent request in the meantime
+            _change(project_id, facet, value, delta)
+
+
+def update_counts(project_id, old=(), new=()):
+    """
+    Replace the (facet, value) pairs `old` of a record with `new`, e.g. when
+    the record is updated. `old` is empty for a new record, `new` for a
+    deleted one.
+    """
+    delta = Counter(new)
+    delta.subtract(Counter(old))
+    for (facet, value), change in sorted(delta.items()):
+        if change:
+            _change(project_id, facet, value, change)
+
+
+def rebuild_facets(project_id):
+    """Recount the facets of a project from its records."""
+    counts = Counter()
+    rows = Record.objects.filter(project=project_id).values_list(*_columns)
+    for row in rows.iterator():
+        counts.update(_facets(*row))
+    with transaction.atomic():
+        FacetCount.objects.filter(project=project_id).delete()
+        FacetCount.objects.bulk_create(
+            FacetCount(project_id=project_id, facet=facet, value=value, count=count)
+            for (facet, value), count in counts.items()
+        )
+
+
+def project_facets(project_id, names=facet_names):
+    """
+    The values of each facet in `names`, with the number of records having
+    each value, most frequent first.
+    """
+    facets = dict((name, []) for name in names)
+    counts = FacetCount.objects.filter(project=project_id, facet__in=names).order_by(
+        "facet", "-count", "value"
+    )
+    for facet, value, count in counts.values_list("facet", "value", "count"):
+        if len(facets[facet]) < max_values:
+            facets[facet].append({"value": value, "count": count})
+    return facets
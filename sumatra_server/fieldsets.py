@@ -0,0 +1,117 @@
+"""
+Sparse fieldsets: lightweight summaries of records containing only the
+fields named in the ``fields`` query parameter.
+
+Summaries are read with a single ``values()`` query on the record table,
+joined to the executable and repository tables only if those fields are
+requested, rather than by converting each record to a Sumatra record.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from tagging.utils import parse_tag_input
+
+# the format used by sumatra.formatting.record2dict(); naive timestamps have no offset
+timestamp_format = "%Y-%m-%d %H:%M:%S%z"
+
+# fields stored in a column of the record table
+column_fields = (
+    "label",
+    "timestamp",
+    "reason",
+    "outcome",
+    "duration",
+    "main_file",
+    "version",
+    "user",
+    "script_arguments",
+    "stdout_stderr",
+    "repeats",
+    "diff",
+    "tags",
+)
+# fields stored in a related table, with the columns which make them up
+related_fields = {
+    "executable": ("path", "name", "version", "options"),
+    "repository": ("type", "url", "upstream"),
+}
+available_fields = column_fields + tuple(sorted(related_fields))
+
+
+class FieldsetError(ValueError):
+    """Raised for a ``fields`` parameter naming an unknown field."""
+
+    pass
+
+
+def parse_fields(value):
+    """
+    Parse the comma-separated list of field names in `value`. The label is
+    always included, since it identifies the record.
+    """
+    fields = ["label"]
+    for name in value.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in available_fields:
+            raise FieldsetError(
+                "Unknown field '%s'. Available fields are: %s" % (name, ", ".join(available_fields))
+            )
+        if name not in fields:
+            fields.append(name)
+    return fields
+
+
+def _columns(fields):
+    columns = []
+    for name in fields:
+        if name in related_fields:
+            columns.extend("%s__%s" % (name, column) for column in related_fields[name])
+        else:
+            columns.append(name)
+    return columns
+
+
+def _summary(row, fields):
+    data = {}
+    for name in fields:
+        if name in related_fields:
+            values = dict(
+                (column, row["%s__%s" % (name, column)]) for column in related_fields[name]
+            )
+            # a null foreign key gives None for every column
+            data[name] = values if any(v is not None for v in values.values()) else None
+        elif name == "timestamp":
+            data[name] = row[name].strftime(timestamp_format)
+        elif name == "tags":
+            # split as django-tagging does, and as for the full record
+            data[name] = sorted(set(parse_tag_input(row[name])))
+        else:
+            data[name] = row[name]
+    return data
+
+
+def record_summaries(records, fields):
+    """
+    Return a list containing, for each record in the queryset `records`,
+    a dict with the values of the fields listed in `fields`.
+    """
+    return [_summary(row, fields) for row in records.values(*_columns(fields))]
+
+
+def document_summary(document, fields):
+    """
+    As record_summaries(), for a single record given as its JSON document,
+    e.g. an archived record.
+    """
+    data = {}
+    for name in fields:
+        value = document.get(name)
+        if name in related_fields and value is not None:
+            value = dict((column, value.get(column)) for column in related_fields[name])
+        elif name == "tags":
+            value = sorted(set(value or []))
+        data[name] = value
+    return data
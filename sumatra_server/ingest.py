@@ -0,0 +1,155 @@
+"""
+Creation, update and deletion of records, shared by the HTTP API and the
+replication tools. Each change is stored as a RecordRevision.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import hashlib
+import json
+from django.db import transaction, IntegrityError
+from django.db.models import ForeignKey
+
+from sumatra.recordstore.django_store.models import Record
+from .models import RecordRevision, SharedObjectKey
+from .facets import record_facets, update_counts
+
+
+# fields which may be modified after a record has been created
+updatable_fields = ("reason", "outcome")
+
+
+def keys2str(D):
+    """Keywords cannot be unicode."""  # unnecessary for Python 3?
+    E = {}
+    for k, v in D.items():
+        E[str(k)] = v
+    return E
+
+
+def updatable_state(record, attrs=None):
+    """
+    The values of the fields which may change after a record is created,
+    either as stored in `record` or as given in the request data `attrs`.
+    """
+    if attrs is None:
+        tags = [tag.name for tag in record.tag_objects()]
+    else:
+        tags = attrs["tags"]
+    return {
+        "reason": record.reason,
+        "outcome": record.outcome,
+        "tags": sorted(set(tags)),
+    }
+
+
+def _lookup_shared(model, digest):
+    key = SharedObjectKey.objects.filter(model=model._meta.label_lower, digest=digest).first()
+    if key is None:
+        return None
+    obj = model.objects.filter(pk=key.object_id).first()
+    if obj is None:
+        key.delete()  # the object has been deleted
+    return obj
+
+
+def get_or_create_shared(model, attrs):
+    """
+    Like ``get_or_create()`` for the executables, repositories, etc. shared
+    between records. These tables have no unique constraints, so the object
+    for each set of attributes is recorded in SharedObjectKey, whose unique
+    constraint makes concurrent writers wait for, and then use, the object
+    created by the first of them. Duplicates stored before this table was
+    introduced are tolerated: the oldest matching row is used.
+    """
+    digest = hashlib.sha1(
+        json.dumps(attrs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    obj = _lookup_shared(model, digest)
+    if obj is None:
+        try:
+            with transaction.atomic():
+                obj = model.objects.filter(**attrs).order_by("pk").first()
+                if obj is None:
+                    obj = model.objects.create(**attrs)
+                SharedObjectKey.objects.create(
+                    model=model._meta.label_lower, digest=digest, object_id=obj.pk
+                )
+        except IntegrityError:
+            # created by a concurrent writer since the lookup above
+            obj = _lookup_shared(model, digest)
+    return obj
+
+
+def create_record(project, label, attrs, revision=True):
+    """
+    Create a new record in `project` from the decoded JSON document `attrs`.
+    Raises IntegrityError if a record with this label was created concurrently.
+    With `revision` False, no revision is stored, e.g. when a record is
+    restored from the archive.
+    """
+    with transaction.atomic():
+        inst = Record(project=project, label=label)
+        fields = [
+            field
+            for field in Record._meta.fields
+            if field.name not in ("project", "label", "db_id", "tags")
+        ]
+        for field in fields:
+            if isinstance(field, ForeignKey):
+                fk_model = field.remote_field.model
+                obj_attrs = keys2str(attrs[field.name])
+                setattr(inst, field.name, get_or_create_shared(fk_model, obj_attrs))
+            else:
+                setattr(inst, field.name, attrs[field.name])
+        inst.tags = ",".join(attrs["tags"])
+        inst.save()
+        for field in Record._meta.many_to_many:
+            for obj_attrs in attrs[field.name]:
+                getattr(inst, field.name).get_or_create(**keys2str(obj_attrs))
+        for obj_attrs in attrs["output_data"]:
+            inst.output_data.get_or_create(**keys2str(obj_attrs))
+        inst.save()
+        update_counts(project.id, new=record_facets(inst))
+        if revision:
+            RecordRevision.objects.add(
+                project.id,
+                label,
+                RecordRevision.CREATE,
+                RecordRevision.diff({}, updatable_state(inst, attrs)),
+            )
+    return inst
+
+
+def update_record(inst, attrs):
+    """
+    Apply the updatable fields in `attrs` to an existing record. Returns
+    True if anything changed.
+    """
+    old_state = updatable_state(inst)
+    old_facets = record_facets(inst)
+    with transaction.atomic():
+        for field_name in updatable_fields:
+            setattr(inst, field_name, attrs[field_name])
+        inst.tags = ",".join(attrs["tags"])
+        inst.save()
+        update_counts(inst.project_id, old_facets, record_facets(inst))
+        delta = RecordRevision.diff(old_state, updatable_state(inst, attrs))
+        if delta:
+            RecordRevision.objects.add(inst.project_id, inst.label, RecordRevision.UPDATE, delta)
+    return bool(delta)
+
+
+def delete_record(inst):
+    old_state = updatable_state(inst)
+    old_facets = record_facets(inst)
+    with transaction.atomic():
+        inst.delete()
+        update_counts(inst.project_id, old=old_facets)
+        RecordRevision.objects.add(
+            inst.project_id,
+            inst.label,
+            RecordRevision.DELETE,
+            RecordRevision.diff(old_state, {}),
+        )
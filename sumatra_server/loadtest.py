@@ -0,0 +1,339 @@
+"""
+Load testing: a fleet of simulated Sumatra clients, each making the requests
+which ``HttpRecordStore`` makes, in a given mix, against a Sumatra server.
+
+Each client runs in its own thread, and creates, updates, reads and deletes
+records with labels of its own in a single project. The latency and status
+of every request are recorded, together with the number of database queries
+it needed, if the server reports it (see middleware.py).
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import json
+import math
+import random
+import socket
+import threading
+import time
+from base64 import b64encode
+from datetime import datetime
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+
+from .fieldsets import timestamp_format
+
+# the requests made by HttpRecordStore for each operation
+operations = {
+    "create": ("PUT", "record"),  # save() of a new record
+    "update": ("PUT", "record"),  # save() of an existing record, e.g. after "smt comment"
+    "get": ("GET", "record"),  # get()
+    "list": ("GET", "project"),  # list() and labels()
+    "projects": ("GET", "project-list"),  # list_projects()
+    "delete": ("DELETE", "record"),  # delete()
+}
+default_mix = {"create": 3, "update": 2, "get": 8, "list": 2, "projects": 1, "delete": 1}
+percentiles = (50, 90, 99)
+
+
+def parse_mix(value):
+    """Parse a mix given as e.g. "create=3,get=8", into a dict of weights."""
+    mix = {}
+    for item in value.split(","):
+        name, sep, weight = item.partition("=")
+        name = name.strip()
+        if name not in operations:
+            raise ValueError(
+                "Unknown operation '%s'. Operations are: %s" % (name, ", ".join(sorted(operations)))
+            )
+        try:
+            mix[name] = float(weight) if sep else 1.0
+        except ValueError:
+            raise ValueError("Invalid weight '%s' for '%s'" % (weight, name))
+    if not any(mix.values()):
+        raise ValueError("At least one operation must have a non-zero weight")
+    return mix
+
+
+def percentile(values, p):
+    """The p-th percentile of a list of numbers, by the nearest-rank method."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def record_document(label, project_id, user, rng):
+    """A record, as sent by HttpRecordStore, of a typical size."""
+    n_outputs = rng.randint(1, 5)
+    return {
+        "label": label,
+        "timestamp": datetime.now().strftime(timestamp_format),
+        "reason": "load test",
+        "duration": rng.uniform(0.1, 1000.0),
+        "executable": {
+            "path": "/usr/bin/python",
+            "version": "3.8.5",
+            "name": "Python",
+            "options": "",
+        },
+        "repository": {"url": "/home/%s/model" % user, "type": "GitRepository", "upstream": None},
+        "main_file": "main.py",
+        "version": "%040x" % rng.getrandbits(160),
+        "parameters": {
+            "content": "\n".join("p%d = %f" % (i, rng.random()) for i in range(20)),
+            "type": "SimpleParameterSet",
+        },
+        "input_data": [],
+        "script_arguments": "<parameters>",
+        "launch_mode": {
+            "type": "SerialLaunchMode",
+            "parameters": {"working_directory": "/home/%s/model" % user, "options": None},
+        },
+        "datastore": {"type": "FileSystemDataStore", "parameters": {"root": "Data"}},
+        "input_datastore": {"type": "FileSystemDataStore", "parameters": {"root": "/"}},
+        "outcome": "",
+        "stdout_stderr": "",
+        "output_data": [
+            {
+                "path": "%s/output%d.dat" % (label, i),
+                "digest": "%040x" % rng.getrandbits(160),
+                "metadata": {"mimetype": None, "size": rng.randint(1, 10**6), "encoding": None},
+                "creation": None,
+            }
+            for i in range(n_outputs)
+        ],
+        "tags": rng.sample(["baseline", "sweep", "calibration", "test"], rng.randint(0, 2)),
+        "diff": "",
+        "user": user,
+        "dependencies": [
+            {
+                "path": "/usr/lib/python3/site-packages/%s" % name,
+                "version": "1.%d" % rng.randint(0, 20),
+                "name": name,
+                "module": "python",
+                "diff": "",
+                "source": None,
+            }
+            for name in ("numpy", "scipy", "matplotlib")
+        ],
+        "platforms": [
+            {
+                "system_name": "Linux",
+                "ip_addr": "127.0.0.1",
+                "architecture_bits": "64bit",
+                "machine": "x86_64",
+                "architecture_linkage": "ELF",
+                "version": "#1 SMP",
+                "release": "5.4.0",
+                "network_name": "workstation",
+                "processor": "x86_64",
+            }
+        ],
+        "repeats": None,
+        "project_id": project_id,
+    }
+
+
+class Result(object):
+    def __init__(self, operation, status, latency, queries=None):
+        self.operation = operation
+        self.status = status  # None if no response was received
+        self.latency = latency
+        self.queries = queries
+
+    @property
+    def error(self):
+        return self.status is None or self.status >= 400
+
+
+class SimulatedClient(object):
+    """One Sumatra client, making requests in the given mix until told to stop."""
+
+    accept = {
+        "record": "application/vnd.sumatra.record-v4+json",
+        "project": "application/vnd.sumatra.project-v4+json",
+        "project-list": "application/vnd.sumatra.project-list-v4+json",
+    }
+
+    def __init__(self, name, server_url, project_id, mix, username, password, seed=0, timeout=60):
+        self.name = name
+        self.server_url = server_url
+        self.project_id = project_id
+        self.username = username
+        self.rng = random.Random("%s-%s" % (seed, name))
+        self.names = sorted(mix)
+        self.weights = [mix[op] for op in self.names]
+        credentials = ("%s:%s" % (username, password)).encode("utf-8")
+        self.authorization = "Basic %s" % b64encode(credentials).decode("ascii")
+        self.timeout = timeout
+        self.labels = []  # records created by this client, and not yet deleted
+        self.count = 0
+        self.results = []
+
+    def url(self, resource, label=None):
+        if resource == "project-list":
+            return self.server_url
+        url = urljoin(self.server_url, "%s/" % self.project_id)
+        if resource == "record":
+            url = urljoin(url, "%s/" % label)
+        return url
+
+    def request(self, method, url, accept, data=None):
+        """Make a request, returning (status, database queries)."""
+        headers = {"Accept": accept, "Authorization": self.authorization}
+        if data is not None:
+            data = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = Request(url, data=data, headers=headers, method=method)
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                status, queries = response.status, response.headers.get("X-Query-Count")
+        except HTTPError as err:
+            status, queries = err.code, err.headers.get("X-Query-Count")
+        except (URLError, socket.timeout, ConnectionError):
+            status, queries = None, None
+        return status, int(queries) if queries is not None else None
+
+    def choose(self):
+        operation = self.rng.choices(self.names, self.weights)[0]
+        if operations[operation][1] == "record" and operation != "create" and not self.labels:
+            operation = "create"  # nothing to read, update or delete yet
+        return operation
+
+    def step(self):
+        operation = self.choose()
+        method, resource = operations[operation]
+        data = None
+        if operation == "create":
+            self.count += 1
+            label = "%s-%d-%04x" % (self.name, self.count, self.rng.getrandbits(16))
+            data = record_document(label, self.project_id, self.username, self.rng)
+        elif resource == "record":
+            label = self.rng.choice(self.labels)
+            if operation == "update":
+                data = record_document(label, self.project_id, self.username, self.rng)
+                data["reason"] = "load test, updated"
+        else:
+            label = None
+        start = time.perf_counter()
+        status, queries = self.request(
+            method, self.url(resource, label), self.accept[resource], data
+        )
+        result = Result(operation, status, time.perf_counter() - start, queries)
+        self.results.append(result)
+        if not result.error:
+            if operation == "create":
+                self.labels.append(label)
+            elif operation == "delete":
+                self.labels.remove(label)
+        return result
+
+    def run(self, deadline, max_requests=None):
+        while time.perf_counter() < deadline:
+            if max_requests is not None and len(self.results) >= max_requests:
+                break
+            self.step()
+
+
+def summarize(results, elapsed):
+    """Throughput, latency percentiles, error rates and query counts, per operation."""
+
+    def stats(results):
+        latencies = [r.latency for r in results]
+        queries = [r.queries for r in results if r.queries is not None]
+        errors = sum(1 for r in results if r.error)
+        data = {
+            "requests": len(results),
+            "throughput": len(results) / elapsed if elapsed else None,
+            "errors": errors,
+            "error_rate": errors / float(len(results)) if results else 0.0,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": max(latencies) if latencies else None,
+            "queries": sum(queries) / float(len(queries)) if queries else None,
+            "max_queries": max(queries) if queries else None,
+            "statuses": {},
+        }
+        for p in percentiles:
+            data["p%d" % p] = percentile(latencies, p)
+        for r in results:
+            key = "%s" % r.status if r.status is not None else "no response"
+            data["statuses"][key] = data["statuses"].get(key, 0) + 1
+        return data
+
+    by_operation = {}
+    for r in results:
+        by_operation.setdefault(r.operation, []).append(r)
+    return {
+        "elapsed": elapsed,
+        "total": stats(results),
+        "operations": dict((op, stats(items)) for op, items in sorted(by_operation.items())),
+    }
+
+
+class LoadTest(object):
+    """
+    Run `clients` simulated clients against the server whose project list is
+    at `server_url`, for `duration` seconds or until each client has made
+    `requests` requests.
+    """
+
+    def __init__(
+        self,
+        server_url,
+        project_id,
+        username,
+        password,
+        clients=10,
+        mix=None,
+        duration=30,
+        requests=None,
+        seed=0,
+    ):
+        if not server_url.endswith("/"):
+            server_url += "/"
+        self.clients = [
+            SimulatedClient(
+                "c%d" % i, server_url, project_id, mix or default_mix, username, password, seed
+            )
+            for i in range(clients)
+        ]
+        self.duration = duration
+        self.requests = requests
+
+    def create_project(self):
+        """Create the project, if necessary, giving the user access to it."""
+        client = self.clients[0]
+        status, queries = client.request("PUT", client.url("project"), "application/json", {})
+        return status
+
+    def run(self):
+        start = time.perf_counter()
+        deadline = start + self.duration
+        threads = [
+            threading.Thread(target=client.run, args=(deadline, self.requests))
+            for client in self.clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return summarize([r for client in self.clients for r in client.results], elapsed)
+
+    def clean_up(self):
+        """Delete the records created by the clients. Returns the number deleted."""
+        count = 0
+        for client in self.clients:
+            for label in list(client.labels):
+                status, queries = client.request(
+                    "DELETE", client.url("record", label), client.accept["record"]
+                )
+                if status == 204:
+                    client.labels.remove(label)
+                    count += 1
+        return count
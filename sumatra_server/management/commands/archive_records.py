@@ -0,0 +1,62 @@
+"""
+Move old records of a project to the archive.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+
+from sumatra.recordstore.django_store.models import Project
+from sumatra_server.archive import archive_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the records of a project created before a given date, or having any of "
+        "the given tags, into the archive. Archived records can still be read through "
+        "the API, and are restored with the restore_records command."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", help="ID of the project")
+        parser.add_argument(
+            "--before", help="archive records created before this date (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            "--older-than", type=int, help="archive records created more than this many days ago"
+        )
+        parser.add_argument(
+            "--tags", help="archive records with any of these (comma-separated) tags"
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="count the records, without archiving them"
+        )
+
+    def handle(self, *args, **options):
+        if not Project.objects.filter(id=options["project"]).exists():
+            raise CommandError("Project '%s' does not exist" % options["project"])
+        before = None
+        if options["before"]:
+            try:
+                before = datetime.strptime(options["before"], "%Y-%m-%d")
+            except ValueError:
+                raise CommandError("--before must be a date, YYYY-MM-DD")
+        elif options["older_than"] is not None:
+            before = datetime.now() - timedelta(days=options["older_than"])
+        tags = [tag.strip() for tag in (options["tags"] or "").split(",") if tag.strip()]
+        if before is None and not tags:
+            raise CommandError("Give at least one of --before, --older-than or --tags")
+        count = archive_records(
+            options["project"],
+            before=before,
+            tags=tags,
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        self.stdout.write(
+            "%s: %d records %s"
+            % (options["project"], count, options["dry_run"] and "to archive" or "archived")
+        )
@@ -0,0 +1,155 @@
+"""
+Simulate many Sumatra clients using a server at once, and report the
+throughput, latencies, error rates and database queries of their requests.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import json
+import threading
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.urls import reverse
+
+from sumatra_server.loadtest import LoadTest, default_mix, parse_mix, percentiles
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_local_server():
+    """
+    Serve the application, with the current settings, from a thread of this
+    process, reporting the number of queries made for each request. Returns
+    the server and the URL of the project list.
+    """
+    middleware = "sumatra_server.middleware.QueryCountMiddleware"
+    if middleware not in settings.MIDDLEWARE:
+        settings.MIDDLEWARE = list(settings.MIDDLEWARE) + [middleware]
+    server = ThreadedWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+    server.set_app(WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, "http://%s:%d%s" % (host, port, reverse("sumatra-project-list"))
+
+
+def _ms(seconds):
+    return "%9.1f" % (seconds * 1e3) if seconds is not None else "%9s" % "-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a fleet of simulated Sumatra clients against a server, each creating, "
+        "updating, reading, listing and deleting records in a mix of requests like "
+        "that of HttpRecordStore, and report throughput, latency percentiles, error "
+        "rates and database queries per request. Without --url, the server is run in "
+        "this process, with the current settings and database. Records are written to "
+        "the given project, which should not be one in real use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="URL of the project list of a running server, e.g. http://localhost:8000/records/",
+        )
+        parser.add_argument("--username", required=True, help="user to authenticate as")
+        parser.add_argument("--password", default="")
+        parser.add_argument(
+            "--project", default="loadtest", help="project to use (default: loadtest)"
+        )
+        parser.add_argument("--clients", type=int, default=10, help="number of simulated clients")
+        parser.add_argument(
+            "--duration", type=float, default=30, help="length of the test, in seconds"
+        )
+        parser.add_argument(
+            "--requests", type=int, help="stop each client after this many requests"
+        )
+        parser.add_argument(
+            "--mix",
+            help="relative frequency of each operation, e.g. create=3,get=8 (default: %s)"
+            % ",".join("%s=%d" % item for item in sorted(default_mix.items())),
+        )
+        parser.add_argument("--seed", type=int, default=0, help="seed for the random choices")
+        parser.add_argument(
+            "--clean-up", action="store_true", help="delete the records created, afterwards"
+        )
+        parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            mix = options["mix"] and parse_mix(options["mix"]) or default_mix
+        except ValueError as err:
+            raise CommandError(str(err))
+        server = None
+        url = options["url"]
+        if not url:
+            server, url = start_local_server()
+        try:
+            test = LoadTest(
+                url,
+                options["project"],
+                options["username"],
+                options["password"],
+                clients=options["clients"],
+                mix=mix,
+                duration=options["duration"],
+                requests=options["requests"],
+                seed=options["seed"],
+            )
+            status = test.create_project()
+            if status not in (200, 201):
+                raise CommandError(
+                    "Unable to create or access project '%s' (status %s)"
+                    % (options["project"], status)
+                )
+            results = test.run()
+            if options["clean_up"]:
+                test.clean_up()
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=4))
+        else:
+            self.report(results, options["clients"])
+
+    def report(self, results, clients):
+        total = results["total"]
+        self.stdout.write(
+            "%d requests from %d clients in %.1f s: %.1f requests/s, %d errors (%.1f%%)\n"
+            % (
+                total["requests"],
+                clients,
+                results["elapsed"],
+                total["throughput"],
+                total["errors"],
+                total["error_rate"] * 100,
+            )
+        )
+        columns = ["requests", "req/s", "errors"] + ["p%d ms" % p for p in percentiles]
+        columns += ["max ms", "queries", "max q."]
+        self.stdout.write("%-10s" % "" + "".join("%9s" % c for c in columns))
+        rows = sorted(results["operations"].items()) + [("total", total)]
+        for operation, stats in rows:
+            line = "%-10s%9d%9.1f%9d" % (
+                operation,
+                stats["requests"],
+                stats["throughput"],
+                stats["errors"],
+            )
+            line += "".join(_ms(stats["p%d" % p]) for p in percentiles) + _ms(stats["max"])
+            if stats["queries"] is not None:
+                line += "%9.1f%9d" % (stats["queries"], stats["max_queries"])
+            else:
+                line += "%9s%9s" % ("-", "-")
+            self.stdout.write(line)
+        statuses = total["statuses"]
+        self.stdout.write(
+            "\nResponses: %s" % ", ".join("%s: %d" % item for item in sorted(statuses.items()))
+        )
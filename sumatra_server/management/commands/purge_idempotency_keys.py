@@ -0,0 +1,21 @@
+"""
+Delete the stored responses of requests with expired Idempotency-Keys.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.core.management.base import BaseCommand
+
+from sumatra_server.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete Idempotency-Keys older than SUMATRA_IDEMPOTENCY_KEY_EXPIRY, and those of "
+        "requests abandoned while in progress."
+    )
+
+    def handle(self, *args, **options):
+        count, deleted = IdempotencyKey.objects.expired().delete()
+        self.stdout.write("%d expired keys deleted" % count)
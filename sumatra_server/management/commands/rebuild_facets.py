@@ -0,0 +1,28 @@
+"""
+Recount the facet counts of projects from their records.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.core.management.base import BaseCommand
+
+from sumatra.recordstore.django_store.models import Project
+from sumatra_server.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the tags, executables, main files, outcomes and versions of the records "
+        "of the given projects, or of every project, e.g. after records have been changed "
+        "directly in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("projects", nargs="*", help="IDs of the projects (default: all)")
+
+    def handle(self, *args, **options):
+        projects = options["projects"] or Project.objects.values_list("id", flat=True)
+        for project_id in projects:
+            rebuild_facets(project_id)
+            self.stdout.write("%s: facets rebuilt" % project_id)
@@ -0,0 +1,32 @@
+"""
+Move archived records of a project back to the record table.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sumatra_server.archive import restore_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore archived records of a project, given by label or by tag, or all of "
+        "them with --all."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", help="ID of the project")
+        parser.add_argument("labels", nargs="*", help="labels of the records to restore")
+        parser.add_argument(
+            "--tags", help="restore records with any of these (comma-separated) tags"
+        )
+        parser.add_argument("--all", action="store_true", help="restore every archived record")
+
+    def handle(self, *args, **options):
+        tags = [tag.strip() for tag in (options["tags"] or "").split(",") if tag.strip()]
+        if not (options["labels"] or tags or options["all"]):
+            raise CommandError("Give the labels of the records to restore, --tags, or --all")
+        count = restore_records(options["project"], labels=options["labels"], tags=tags)
+        self.stdout.write("%s: %d records restored" % (options["project"], count))
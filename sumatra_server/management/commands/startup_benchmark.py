@@ -0,0 +1,146 @@
+"""
+Measure how long a fresh server process takes to start and to answer its
+first requests, and which modules take the longest to import.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+from base64 import b64encode
+from django.core.management.base import BaseCommand, CommandError
+
+
+# run in a new interpreter, so that nothing has been imported beforehand. Markers
+# written to stderr separate the imports made in each phase.
+script = """
+import json, sys, time
+def phase(label):
+    sys.stderr.write("%(marker)s%%s\\n" %% label)
+    sys.stderr.flush()
+    return time.perf_counter()
+t0 = phase("django.setup()")
+import django
+django.setup()
+t1 = phase("URLconf")
+from django.urls import get_resolver
+get_resolver().url_patterns  # imports the URLconf and the views
+t2 = phase("test client")  # not timed
+from django.test import Client
+client = Client(HTTP_HOST=%(host)r, **%(headers)r)
+timings = [["django.setup()", t1 - t0], ["URLconf", t2 - t1]]
+for url in %(urls)r:
+    for label in ("first", "second"):
+        t = phase("%%s GET %%s" %% (label, url))
+        response = client.get(url)
+        timings.append(["%%s GET %%s" %% (label, url), time.perf_counter() - t])
+        if response.status_code != 200:
+            timings[-1][0] += " (%%d)" %% response.status_code
+sys.stdout.write(json.dumps(timings))
+"""
+marker = "### phase: "
+
+importtime_pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def parse_importtime(lines):
+    """
+    Return (module, self time, cumulative time, phase) tuples, with times
+    in seconds, from the output of ``python -X importtime``.
+    """
+    modules = []
+    phase = None
+    for line in lines:
+        if line.startswith(marker):
+            phase = line[len(marker) :]
+            continue
+        match = importtime_pattern.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own) / 1e6, int(cumulative) / 1e6, phase))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Start a new Python process with the current settings, and report the time "
+        "taken by django.setup(), by loading the URLconf, and by the first requests "
+        "to the given URLs, together with the modules which took longest to import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="*", help="paths to request, e.g. /records/MyProject/")
+        parser.add_argument("--host", default="localhost", help="value of the Host header")
+        parser.add_argument("--username", help="user name, for HTTP Basic authentication")
+        parser.add_argument("--password", default="")
+        parser.add_argument("--accept", default="application/json", help="Accept header")
+        parser.add_argument("--top", type=int, default=20, help="number of modules to list")
+        parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+    def handle(self, *args, **options):
+        headers = {"HTTP_ACCEPT": options["accept"]}
+        if options["username"]:
+            credentials = "%s:%s" % (options["username"], options["password"])
+            headers["HTTP_AUTHORIZATION"] = "Basic %s" % b64encode(
+                credentials.encode("utf-8")
+            ).decode("ascii")
+        code = script % {
+            "host": options["host"],
+            "headers": headers,
+            "urls": options["urls"],
+            "marker": marker,
+        }
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env,
+        )
+        if process.returncode != 0:
+            raise CommandError(process.stderr[-2000:])
+        timings = json.loads(process.stdout)
+        modules = parse_importtime(process.stderr.splitlines())
+        imports, packages = {}, {}
+        for name, own, cumulative, phase in modules:
+            imports[phase] = imports.get(phase, 0) + own
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + own
+        results = {
+            "phases": [
+                {
+                    "phase": label,
+                    "time": seconds,
+                    "import_time": imports.get(label.split(" (")[0], 0),
+                }
+                for label, seconds in timings
+            ],
+            "packages": sorted(packages.items(), key=lambda p: -p[1])[: options["top"]],
+            "modules": [
+                {"module": name, "self": own, "cumulative": cumulative, "phase": phase}
+                for name, own, cumulative, phase in sorted(modules, key=lambda m: -m[1])
+            ][: options["top"]],
+        }
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=4))
+            return
+        self.stdout.write("%-60s %9s %9s" % ("Phase (ms)", "total", "imports"))
+        for phase in results["phases"]:
+            self.stdout.write(
+                "%-60s %9.1f %9.1f"
+                % (phase["phase"], phase["time"] * 1e3, phase["import_time"] * 1e3)
+            )
+        self.stdout.write("\n%-60s %9s" % ("Import time by package (ms)", "self"))
+        for package, seconds in results["packages"]:
+            self.stdout.write("%-60s %9.1f" % (package, seconds * 1e3))
+        self.stdout.write("\n%-60s %9s %9s" % ("Slowest modules (ms)", "self", "cumul."))
+        for module in results["modules"]:
+            self.stdout.write(
+                "%-60s %9.1f %9.1f"
+                % (module["module"], module["self"] * 1e3, module["cumulative"] * 1e3)
+            )
@@ -0,0 +1,51 @@
+"""
+Copy a project from another Sumatra server, or bring an earlier copy up to date.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from urllib.error import URLError
+from django.core.management.base import BaseCommand, CommandError
+
+from sumatra_server.replication import RemoteProject, ProjectReplicator
+
+
+class Command(BaseCommand):
+    help = (
+        "Synchronize a local project with a project on another Sumatra server, "
+        "transferring only the changes made since the last synchronization."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "url", help="URL of the remote project, e.g. http://example.com/records/MyProject/"
+        )
+        parser.add_argument(
+            "--project", help="ID of the local project (defaults to the remote project ID)"
+        )
+        parser.add_argument("--username", help="user name on the remote server")
+        parser.add_argument("--password", help="password on the remote server")
+        parser.add_argument("--owner", help="local user to be given access to the project")
+        parser.add_argument("--batch-size", type=int, default=ProjectReplicator.batch_size)
+
+    def handle(self, *args, **options):
+        remote = RemoteProject(options["url"], options["username"], options["password"])
+        project_id = options["project"] or remote.url.rstrip("/").rsplit("/", 1)[-1]
+        replicator = ProjectReplicator(remote, project_id, owner=options["owner"])
+        replicator.batch_size = options["batch_size"]
+        try:
+            stats = replicator.sync()
+        except URLError as err:
+            raise CommandError("Unable to access %s: %s" % (remote.url, err))
+        self.stdout.write(
+            "%s: %d created, %d updated, %d deleted (%d records fetched in %d requests)"
+            % (
+                project_id,
+                stats["created"],
+                stats["updated"],
+                stats["deleted"],
+                stats["fetched"],
+                remote.requests,
+            )
+        )
@@ -0,0 +1,23 @@
+"""
+Show how many write requests have been admitted and refused by the rate limits.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.core.management.base import BaseCommand
+
+from sumatra_server.throttling import counter_names, throttle_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the counters of the write request rate limiter. The counters are kept "
+        "in the Django cache, so a shared cache backend is needed for this to show the "
+        "counts of the server processes."
+    )
+
+    def handle(self, *args, **options):
+        counters = throttle_counters()
+        for name in counter_names:
+            self.stdout.write("%s: %d" % (name, counters[name]))
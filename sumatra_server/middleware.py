@@ -0,0 +1,34 @@
+"""
+Middleware reporting the number of database queries made for each request,
+in the ``X-Query-Count`` response header, for use by the load_test command.
+Add ``"sumatra_server.middleware.QueryCountMiddleware"`` to ``MIDDLEWARE``
+in the settings of a development or staging server to enable it.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.db import connection
+
+
+class QueryCounter(object):
+    """Database execute wrapper which counts the queries run through it."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryCountMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        response["X-Query-Count"] = "%d" % counter.count
+        return response
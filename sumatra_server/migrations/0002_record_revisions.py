@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_store", "__first__"),
+        ("sumatra_server", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevisionCounter",
+            fields=[
+                (
+                    "project",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="django_store.Project",
+                    ),
+                ),
+                ("revision", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="RecordRevision",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("label", models.CharField(max_length=100)),
+                ("revision", models.PositiveIntegerField()),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("create", "create"), ("update", "update"), ("delete", "delete")],
+                        max_length=6,
+                    ),
+                ),
+                ("delta", models.TextField()),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="django_store.Project"
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("project", "revision"),
+                "unique_together": {("project", "revision")},
+                "index_together": {("project", "label")},
+            },
+        ),
+    ]
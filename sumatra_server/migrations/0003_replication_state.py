@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_store", "__first__"),
+        ("sumatra_server", "0002_record_revisions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReplicationState",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("source", models.URLField(max_length=500)),
+                ("revision", models.PositiveIntegerField(blank=True, null=True)),
+                ("last_synced", models.DateTimeField(auto_now=True)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="django_store.Project"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("project", "source")},
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:22
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def relabel_duplicates(apps, schema_editor):
+    """
+    Give a new label to all but the first of any records with the same label
+    in the same project, which earlier versions could store when a record was
+    PUT by several clients at once, so that the unique index can be created.
+    """
+    Record = apps.get_model("django_store", "Record")
+    duplicates = (
+        Record.objects.values("project_id", "label")
+        .annotate(n=Count("db_id"))
+        .filter(n__gt=1)
+        .values_list("project_id", "label")
+    )
+    for project_id, label in list(duplicates):
+        records = Record.objects.filter(project_id=project_id, label=label).order_by("db_id")
+        for record in records[1:]:
+            suffix = "-duplicate-%d" % record.db_id
+            record.label = label[: 100 - len(suffix)] + suffix
+            record.save(update_fields=["label"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_store", "__first__"),
+        ("sumatra_server", "0003_replication_state"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("key", models.CharField(max_length=255)),
+                ("username", models.CharField(max_length=150)),
+                ("fingerprint", models.CharField(max_length=40)),
+                ("status", models.PositiveSmallIntegerField(blank=True, null=True)),
+                ("content", models.BinaryField(blank=True)),
+                ("created", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                "unique_together": {("username", "key")},
+            },
+        ),
+        # The Record model belongs to Sumatra, which does not make labels
+        # unique within a project, so the constraint is added here, after
+        # relabelling any duplicate records.
+        migrations.RunPython(relabel_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX sumatra_server_record_project_label "
+            "ON django_store_record (project_id, label)",
+            "DROP INDEX sumatra_server_record_project_label",
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_store", "__first__"),
+        ("sumatra_server", "0004_concurrent_ingest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedRecord",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("label", models.CharField(max_length=100)),
+                ("timestamp", models.DateTimeField()),
+                ("tags", models.TextField(blank=True)),
+                ("content", models.BinaryField()),
+                ("archived", models.DateTimeField(auto_now_add=True)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="django_store.Project"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("project", "label")},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "__first__"),
+        ("django_store", "__first__"),
+        ("sumatra_server", "0005_archived_records"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProjectGroupPermission",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "group",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="auth.Group"),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="django_store.Project"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("project", "group")},
+            },
+        ),
+    ]
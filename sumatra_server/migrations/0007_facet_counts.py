@@ -0,0 +1,72 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:01
+
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+from tagging.utils import parse_tag_input
+
+
+def record_facets(executable_name, executable_version, main_file, version, outcome, tags):
+    """The (facet, value) pairs of a record, as counted when this migration was written."""
+    executable = " ".join(v for v in (executable_name, executable_version) if v)
+    values = [
+        ("executable", executable),
+        ("main_file", main_file),
+        ("version", version),
+        ("outcome", outcome),
+    ]
+    values.extend(("tags", tag) for tag in set(parse_tag_input(tags)))
+    return [(facet, value[:255]) for facet, value in values if value]
+
+
+def count_facets(apps, schema_editor):
+    Record = apps.get_model("django_store", "Record")
+    FacetCount = apps.get_model("sumatra_server", "FacetCount")
+    counts = Counter()
+    columns = ("executable__name", "executable__version", "main_file", "version", "outcome")
+    rows = Record.objects.values_list("project", *columns, "tags")
+    for row in rows.iterator():
+        counts.update((row[0], facet, value) for facet, value in record_facets(*row[1:]))
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create(
+        FacetCount(project_id=project_id, facet=facet, value=value, count=count)
+        for (project_id, facet, value), count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_store", "__first__"),
+        ("sumatra_server", "0006_group_permissions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacetCount",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("facet", models.CharField(max_length=20)),
+                ("value", models.CharField(max_length=255)),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="django_store.Project"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("project", "facet", "value")},
+            },
+        ),
+        # the counts are updated incrementally from now on, so they must be
+        # complete for the records already stored
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sumatra_server", "0007_facet_counts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SharedObjectKey",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("model", models.CharField(max_length=100)),
+                ("digest", models.CharField(max_length=40)),
+                ("object_id", models.PositiveIntegerField()),
+            ],
+            options={
+                "unique_together": {("model", "digest")},
+            },
+        ),
+    ]
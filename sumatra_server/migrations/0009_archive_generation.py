@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sumatra_server", "0008_shared_object_keys"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="revisioncounter",
+            name="archive_generation",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:31
+
+import json
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_data_keys(apps, schema_editor):
+    """Record the data files of the records archived before this migration."""
+    ArchivedRecord = apps.get_model("sumatra_server", "ArchivedRecord")
+    ArchivedDataKey = apps.get_model("sumatra_server", "ArchivedDataKey")
+    for archived in ArchivedRecord.objects.iterator():
+        document = json.loads(zlib.decompress(bytes(archived.content)).decode("utf-8"))
+        ArchivedDataKey.objects.bulk_create(
+            ArchivedDataKey(record=archived, path=key["path"], digest=key["digest"])
+            for key in document["input_data"] + document["output_data"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sumatra_server", "0009_archive_generation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedDataKey",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("path", models.CharField(max_length=200)),
+                ("digest", models.CharField(db_index=True, max_length=40)),
+                (
+                    "record",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="data_keys",
+                        to="sumatra_server.ArchivedRecord",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(index_data_keys, migrations.RunPython.noop),
+    ]
@@ -5,9 +5,18 @@ Sumatra Server
 :license: BSD 2-clause, see COPYING for details.
 """
 
-from django.db import models
-from django.contrib.auth.models import User
+import json
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.contrib.auth.models import User, Group
 from sumatra.recordstore.django_store.models import Project
+from .projectcache import invalidate_projects
 
 
 class ProjectPermission(models.Model):
@@ -16,3 +25,288 @@ class ProjectPermission(models.Model):
 
     def __unicode__(self):
         return u"Permission: %s can access %s" % (self.user, self.project)
+
+
+class ProjectGroupPermission(models.Model):
+    """Access to a project for every member of a group."""
+
+    group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+
+    class Meta(object):
+        unique_together = (("project", "group"),)
+
+    def __unicode__(self):
+        return u"Permission: members of %s can access %s" % (self.group, self.project)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=ProjectPermission)
+@receiver(post_delete, sender=ProjectPermission)
+@receiver(post_save, sender=ProjectGroupPermission)
+@receiver(post_delete, sender=ProjectGroupPermission)
+@receiver(post_delete, sender=Group)
+@receiver(m2m_changed, sender=User.groups.through)
+def project_changed(sender, **kwargs):
+    invalidate_projects()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def name_changed(sender, created, update_fields, **kwargs):
+    # access is listed by user and group name; a login only updates last_login
+    if not created and (update_fields is None or update_fields & {"username", "name"}):
+        invalidate_projects()
+
+
+class RevisionCounter(models.Model):
+    """
+    The most recent revision number handed out for a project, and the number
+    of times records have been moved to or from its archive, which does not
+    create revisions.
+    """
+
+    project = models.OneToOneField(Project, primary_key=True, on_delete=models.CASCADE)
+    revision = models.PositiveIntegerField(default=0)
+    archive_generation = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def _increment(cls, project_id, field):
+        # the UPDATE takes a row lock, so concurrent writers are serialized here
+        if not cls.objects.filter(project_id=project_id).update(**{field: F(field) + 1}):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(project_id=project_id, **{field: 1})
+            except IntegrityError:
+                # created by a concurrent request in the meantime
+                cls._increment(project_id, field)
+
+    @classmethod
+    def next_revision(cls, project_id):
+        with transaction.atomic():
+            cls._increment(project_id, "revision")
+            counter = cls.objects.filter(project_id=project_id)
+            return counter.values_list("revision", flat=True).get()
+
+    @classmethod
+    def archive_changed(cls, project_id):
+        cls._increment(project_id, "archive_generation")
+
+    @classmethod
+    def current_revision(cls, project_id):
+        counter = cls.objects.filter(project_id=project_id)
+        return counter.values_list("revision", flat=True).first() or 0
+
+
+class RecordRevisionManager(models.Manager):
+    def add(self, project_id, label, action, delta):
+        with transaction.atomic():
+            return self.create(
+                project_id=project_id,
+                label=label,
+                revision=RevisionCounter.next_revision(project_id),
+                action=action,
+                delta=json.dumps(delta, sort_keys=True),
+            )
+
+    def latest_for_record(self, project_id, label):
+        return (
+            self.filter(project_id=project_id, label=label)
+            .order_by("-revision")
+            .values_list("revision", flat=True)
+            .first()
+        )
+
+
+class RecordRevision(models.Model):
+    """
+    A change to one of the records in a project: its creation, deletion or
+    an update of the fields which may be modified after creation.
+
+    Only the fields that changed are stored, as a JSON object mapping each
+    field name to an [old value, new value] pair. Revision numbers increase
+    monotonically within a project.
+    """
+
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+    updatable_fields = ("reason", "outcome", "tags")
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    label = models.CharField(max_length=100)
+    revision = models.PositiveIntegerField()
+    action = models.CharField(
+        max_length=6, choices=((CREATE, "create"), (UPDATE, "update"), (DELETE, "delete"))
+    )
+    delta = models.TextField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = RecordRevisionManager()
+
+    class Meta(object):
+        unique_together = (("project", "revision"),)
+        index_together = (("project", "label"),)
+        ordering = ("project", "revision")
+
+    def __unicode__(self):
+        return u"Revision %d of %s: %s %s" % (
+            self.revision,
+            self.project_id,
+            self.action,
+            self.label,
+        )
+
+    @staticmethod
+    def diff(old, new):
+        """Return the [old, new] pairs for the keys whose values differ."""
+        return dict(
+            (name, [old.get(name), new.get(name)])
+            for name in set(old).union(new)
+            if old.get(name) != new.get(name)
+        )
+
+    def to_dict(self):
+        return {
+            "revision": self.revision,
+            "label": self.label,
+            "action": self.action,
+            "delta": json.loads(self.delta),
+            "timestamp": self.timestamp,
+        }
+
+
+class ReplicationState(models.Model):
+    """
+    How far a local project has been brought up to date with a project on
+    another Sumatra server. `revision` is None until the first full copy
+    has been made.
+    """
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    source = models.URLField(max_length=500)
+    revision = models.PositiveIntegerField(null=True, blank=True)
+    last_synced = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        unique_together = (("project", "source"),)
+
+    def __unicode__(self):
+        return u"%s from %s at revision %s" % (self.project_id, self.source, self.revision)
+
+
+class IdempotencyKeyManager(models.Manager):
+    def expired(self):
+        """
+        Keys stored more than SUMATRA_IDEMPOTENCY_KEY_EXPIRY seconds ago, and
+        requests still in progress after SUMATRA_IDEMPOTENCY_KEY_TIMEOUT
+        seconds, which were abandoned, e.g. by a worker which died.
+        """
+        now = timezone.now()
+        expiry = getattr(settings, "SUMATRA_IDEMPOTENCY_KEY_EXPIRY", 24 * 3600)
+        timeout = getattr(settings, "SUMATRA_IDEMPOTENCY_KEY_TIMEOUT", 600)
+        return self.filter(
+            Q(created__lt=now - timedelta(seconds=expiry))
+            | Q(status__isnull=True, created__lt=now - timedelta(seconds=timeout))
+        )
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a request sent with an Idempotency-Key header, replayed if
+    the client retries the request with the same key. `status` is None while
+    the original request is still being processed.
+    """
+
+    objects = IdempotencyKeyManager()
+
+    key = models.CharField(max_length=255)
+    username = models.CharField(max_length=150)
+    fingerprint = models.CharField(max_length=40)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.BinaryField(blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta(object):
+        unique_together = (("username", "key"),)
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.username, self.key)
+
+
+class SharedObjectKey(models.Model):
+    """
+    The executable, repository, parameter set, etc. used by records with a
+    given set of attributes, identified by a SHA-1 hash of the attributes.
+    The Sumatra tables have no unique constraints, so this table ensures that
+    concurrent writers use one object rather than each creating their own.
+    """
+
+    model = models.CharField(max_length=100)
+    digest = models.CharField(max_length=40)
+    object_id = models.PositiveIntegerField()
+
+    class Meta(object):
+        unique_together = (("model", "digest"),)
+
+    def __unicode__(self):
+        return u"%s %s" % (self.model, self.digest)
+
+
+class ArchivedRecord(models.Model):
+    """
+    A record moved out of the main record table, to keep that table small.
+    `content` is the JSON document of the record, as returned by the API,
+    compressed with zlib.
+    """
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    label = models.CharField(max_length=100)
+    timestamp = models.DateTimeField()
+    tags = models.TextField(blank=True)
+    content = models.BinaryField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        unique_together = (("project", "label"),)
+
+    def __unicode__(self):
+        return u"%s (archived)" % self.label
+
+    @staticmethod
+    def compress(document):
+        return zlib.compress(json.dumps(document).encode("utf-8"))
+
+    def to_dict(self):
+        return json.loads(zlib.decompress(bytes(self.content)).decode("utf-8"))
+
+
+class ArchivedDataKey(models.Model):
+    """
+    A data file used or produced by an archived record, so that its content
+    can still be found by digest once the record's data keys are deleted.
+    """
+
+    record = models.ForeignKey(ArchivedRecord, on_delete=models.CASCADE, related_name="data_keys")
+    path = models.CharField(max_length=200)
+    digest = models.CharField(max_length=40, db_index=True)
+
+
+class FacetCount(models.Model):
+    """
+    The number of records in a project with a given value of a facet (a tag,
+    executable, main file, outcome or version), maintained as records are
+    created, updated and deleted (see facets.py).
+    """
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta(object):
+        unique_together = (("project", "facet", "value"),)
+
+    def __unicode__(self):
+        return u"%s %s=%s: %d" % (self.project_id, self.facet, self.value, self.count)
@@ -0,0 +1,107 @@
+"""
+Content negotiation based on the HTTP Accept header (RFC 7231, section 5.3.2).
+
+Parsed headers and negotiation results are memoized, since in practice a
+server sees the same few Accept headers over and over again.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from functools import lru_cache
+
+CACHE_SIZE = 256
+
+media_type_abbreviations = {
+    "html": "text/html",
+    "json": "application/json",
+    "record-v3+json": "application/vnd.sumatra.record-v3+json",
+    "project-v3+json": "application/vnd.sumatra.project-v3+json",
+    "project-list-v3+json": "application/vnd.sumatra.project-list-v3+json",
+    "record-v4+json": "application/vnd.sumatra.record-v4+json",
+    "project-v4+json": "application/vnd.sumatra.project-v4+json",
+    "project-list-v4+json": "application/vnd.sumatra.project-list-v4+json",
+    "record-batch-v3+json": "application/vnd.sumatra.record-batch-v3+json",
+    "record-batch-v4+json": "application/vnd.sumatra.record-batch-v4+json",
+}
+
+
+class NegotiationError(ValueError):
+    """Raised for a malformed Accept header or an unknown ``format`` value."""
+
+    pass
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_media_ranges(accept):
+    """
+    Parse an Accept header into a tuple of (type, subtype, quality, position)
+    tuples, sorted by decreasing quality. Ranges with equal quality keep the
+    order in which they appear in the header.
+    """
+    ranges = []
+    for position, element in enumerate((accept or "").split(",")):
+        parts = element.split(";")
+        media_range = parts[0].strip().lower()
+        if not media_range:
+            continue  # empty list elements are allowed (RFC 7230, section 7)
+        type_, sep, subtype = media_range.partition("/")
+        if not (type_ and subtype) or "/" in subtype or (type_ == "*" and subtype != "*"):
+            raise NegotiationError("Invalid media range '%s'" % media_range)
+        quality = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = None
+                if quality is None or not 0 <= quality <= 1:
+                    raise NegotiationError("Invalid quality value '%s'" % value.strip())
+                break  # any later parameters are accept-extensions
+        ranges.append((type_, subtype.strip(), quality, position))
+    ranges.sort(key=lambda r: -r[2])
+    return tuple(ranges)
+
+
+def parse_accept_header(accept):
+    """Return the media ranges in an Accept header, most preferred first."""
+    return ["%s/%s" % r[:2] for r in parse_media_ranges(accept)]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def negotiate(accept, available):
+    """
+    Choose the media type from `available` (a tuple, in order of server
+    preference) which best satisfies the Accept header `accept`.
+
+    Each available type takes its quality from the most specific matching
+    media range, so that e.g. "application/*;q=0.5, application/json" gives
+    JSON a quality of 1. Ties go to the range listed first by the client,
+    then to the server's preference. Returns None if nothing is acceptable.
+    """
+    ranges = parse_media_ranges(accept)
+    if not ranges:
+        # no Accept header means that all media types are acceptable
+        return available[0] if available else None
+    best, best_key = None, None
+    for preference, media_type in enumerate(available):
+        type_, subtype = media_type.split("/")
+        match = None
+        for range_type, range_subtype, quality, position in ranges:
+            if range_type == type_ and range_subtype == subtype:
+                specificity = 2
+            elif range_type == type_ and range_subtype == "*":
+                specificity = 1
+            elif range_type == "*":
+                specificity = 0
+            else:
+                continue
+            if match is None or specificity > match[0]:
+                match = (specificity, quality, position)
+        if match is None or match[1] == 0:
+            continue
+        key = (-match[1], match[2], preference)
+        if best_key is None or key < best_key:
+            best, best_key = media_type, key
+    return best
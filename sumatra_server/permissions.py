@@ -0,0 +1,111 @@
+"""
+Granting and revoking access to a project, for users and for groups of
+users, several at a time.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+
+from .models import ProjectPermission, ProjectGroupPermission
+from .projectcache import invalidate_projects
+
+
+class AccessChangeError(ValueError):
+    """
+    Raised for a request to change access which cannot be applied. `errors`
+    is a list of dicts giving the path to each invalid value and a message,
+    as for RecordValidationError.
+    """
+
+    def __init__(self, errors, status=400):
+        super(AccessChangeError, self).__init__("; ".join(e["message"] for e in errors))
+        self.errors = errors
+        self.status = status
+
+
+def _names(changes, action, kind, errors):
+    names = changes.get(action, {}).get(kind, [])
+    if not (isinstance(names, list) and all(isinstance(name, str) for name in names)):
+        errors.append({"field": "%s.%s" % (action, kind), "message": "Expected a list of names"})
+        return []
+    return names
+
+
+def _lookup(model, field, names, path, errors):
+    """Map each name to an instance of `model`, with one query, noting unknown names."""
+    found = dict(
+        (getattr(obj, field), obj) for obj in model.objects.filter(**{field + "__in": names})
+    )
+    for name in names:
+        if name not in found:
+            errors.append(
+                {"field": path, "message": "Unknown %s '%s'" % (model.__name__.lower(), name)}
+            )
+    return found
+
+
+def change_access(project, changes):
+    """
+    Apply a set of changes, given as a dict of the form::
+
+        {"grant": {"users": [...], "groups": [...]},
+         "revoke": {"users": [...], "groups": [...]}}
+
+    where each part is optional. Either every change is made, or, if any
+    user or group is unknown, or no user (other than anonymous) would be left
+    with direct access to the project, none is, and AccessChangeError is raised.
+    """
+    if not isinstance(changes, dict) or not all(
+        isinstance(changes.get(action, {}), dict) for action in ("grant", "revoke")
+    ):
+        raise AccessChangeError([{"field": None, "message": "Expected a JSON object"}])
+    errors = []
+    names = dict(
+        ((action, kind), _names(changes, action, kind, errors))
+        for action in ("grant", "revoke")
+        for kind in ("users", "groups")
+    )
+    users = _lookup(
+        User, "username", names["grant", "users"] + names["revoke", "users"], "users", errors
+    )
+    groups = _lookup(
+        Group, "name", names["grant", "groups"] + names["revoke", "groups"], "groups", errors
+    )
+    if errors:
+        raise AccessChangeError(errors)
+    with transaction.atomic():
+        ProjectPermission.objects.filter(
+            project=project, user__username__in=names["revoke", "users"]
+        ).delete()
+        ProjectGroupPermission.objects.filter(
+            project=project, group__name__in=names["revoke", "groups"]
+        ).delete()
+        existing = set(
+            ProjectPermission.objects.filter(
+                project=project, user__username__in=names["grant", "users"]
+            ).values_list("user__username", flat=True)
+        )
+        ProjectPermission.objects.bulk_create(
+            ProjectPermission(project=project, user=users[name])
+            for name in sorted(set(names["grant", "users"]) - existing)
+        )
+        existing = set(
+            ProjectGroupPermission.objects.filter(
+                project=project, group__name__in=names["grant", "groups"]
+            ).values_list("group__name", flat=True)
+        )
+        ProjectGroupPermission.objects.bulk_create(
+            ProjectGroupPermission(project=project, group=groups[name])
+            for name in sorted(set(names["grant", "groups"]) - existing)
+        )
+        remaining = ProjectPermission.objects.filter(project=project).exclude(
+            user__username="anonymous"
+        )
+        if not remaining.exists():
+            raise AccessChangeError(
+                [{"field": "revoke.users", "message": "At least one user must keep access"}]
+            )
+        invalidate_projects()  # bulk_create() does not send post_save
@@ -0,0 +1,158 @@
+"""
+Read-through cache of project metadata: the name, description and list of
+users with access to each project, either directly or as members of a group.
+
+Projects and permissions change rarely, while almost every request needs
+them, so the metadata of all projects is kept as a single entry in the
+Django cache, with a copy in the memory of each process which is reused
+for ``SUMATRA_PROJECT_CACHE_LOCAL_TIMEOUT`` seconds. The cache is
+invalidated whenever a project, a permission, the membership of a group or
+the name of a user or group changes (see models.py); other processes see the
+change once their local copy expires. If the Django cache is local to each
+process, invalidation cannot reach the other processes at all, so entries in
+it are also kept only for ``SUMATRA_PROJECT_CACHE_LOCAL_TIMEOUT`` seconds.
+
+The entry is keyed by a generation number, which invalidation increments,
+so that metadata read by a request before a change was committed, and
+stored after it, is stored under an old key, and never used.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import time
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from sumatra.recordstore.django_store.models import Project
+
+
+cache_key = "sumatra-projects"
+generation_key = "sumatra-projects-generation"
+_local = {}
+
+
+class ProjectMetadata(object):
+    """
+    The cached attributes of a project. `access` lists every user who may
+    access the project: those given access directly, listed in `users`,
+    followed by the members of the groups listed in `groups`. Anonymous
+    access makes it public.
+    """
+
+    def __init__(self, id, name, description, users=None, groups=None, access=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.users = users or []
+        self.groups = groups or []
+        self.access = access or list(self.users)
+
+    def get_name(self):
+        return self.name or self.id
+
+    @property
+    def public(self):
+        return "anonymous" in self.access
+
+    def __repr__(self):
+        return "<ProjectMetadata: %s>" % self.id
+
+
+def load_projects():
+    """
+    Read the metadata of all projects from the database, with three queries,
+    the last of which finds the groups with access and their members.
+    """
+    projects = dict(
+        (row["id"], ProjectMetadata(**row))
+        for row in Project.objects.values("id", "name", "description")
+    )
+    access = (
+        Project.objects.filter(projectpermission__isnull=False)
+        .order_by("projectpermission__pk")
+        .values_list("id", "projectpermission__user__username")
+    )
+    for project_id, username in access:
+        projects[project_id].users.append(username)
+        projects[project_id].access.append(username)
+    group_access = (
+        Project.objects.filter(projectgrouppermission__isnull=False)
+        .order_by("projectgrouppermission__pk", "projectgrouppermission__group__user__username")
+        .values_list(
+            "id",
+            "projectgrouppermission__group__name",
+            "projectgrouppermission__group__user__username",
+        )
+    )
+    for project_id, group, username in group_access:
+        project = projects[project_id]
+        if group not in project.groups:
+            project.groups.append(group)
+        if username is not None and username not in project.access:
+            project.access.append(username)
+    return projects
+
+
+def _generation():
+    generation = cache.get(generation_key)
+    if generation is None:
+        # start from the time, rather than 0, in case the counter was evicted
+        # while entries for earlier generations remain in the cache
+        cache.add(generation_key, int(time.time() * 1000), None)
+        generation = cache.get(generation_key)
+    return generation
+
+
+def cache_timeout():
+    """
+    How long the metadata is kept in the Django cache: only as long as in the
+    memory of each process, unless the cache is shared between processes.
+    """
+    if isinstance(caches["default"], LocMemCache):
+        return getattr(settings, "SUMATRA_PROJECT_CACHE_LOCAL_TIMEOUT", 5)
+    return getattr(settings, "SUMATRA_PROJECT_CACHE_TIMEOUT", 3600)
+
+
+def project_index():
+    """A dict containing the metadata of every project, keyed by project id."""
+    now = time.time()
+    entry = _local.get(cache_key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    # the generation must be read before the metadata is loaded
+    key = "%s-%s" % (cache_key, _generation())
+    projects = cache.get(key)
+    if projects is None:
+        projects = load_projects()
+        cache.set(key, projects, cache_timeout())
+    _local[cache_key] = (
+        now + getattr(settings, "SUMATRA_PROJECT_CACHE_LOCAL_TIMEOUT", 5),
+        projects,
+    )
+    return projects
+
+
+def get_project(project_id):
+    """The metadata of a project, or None if it does not exist."""
+    return project_index().get(project_id)
+
+
+def _clear():
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        pass  # the counter was evicted, so a new generation is started anyway
+    _local.clear()
+
+
+def invalidate_projects():
+    """
+    Discard the cached metadata, by starting a new generation. This is done
+    again when the current transaction is committed, since another request
+    may have read and cached the old metadata in the meantime.
+    """
+    _clear()
+    transaction.on_commit(_clear)
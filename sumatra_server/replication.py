@@ -0,0 +1,189 @@
+"""
+Pull-based replication of a project from another Sumatra server.
+
+The first synchronization copies every record, including archived records,
+which are stored as active records. After that, only the changes
+made since the last synchronized revision are requested: updates are applied
+from the deltas in the change list and only newly created records are
+fetched in full, in batches. The revision reached is stored after each page
+of changes, in the same transaction, so an interrupted synchronization can
+simply be run again.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import json
+from base64 import b64encode
+from urllib.parse import urlencode, urljoin
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from sumatra.recordstore.django_store.models import Project, Record
+from .ingest import create_record, update_record, delete_record, updatable_state
+from .archive import restore_if_archived
+from .models import RecordRevision, ReplicationState
+
+
+class RemoteProject(object):
+    """A project on another Sumatra server, accessed through its JSON API."""
+
+    def __init__(self, url, username=None, password=None, timeout=60):
+        if not url.endswith("/"):
+            url += "/"
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Accept": "application/json"}
+        if username:
+            credentials = ("%s:%s" % (username, password or "")).encode("utf-8")
+            self.headers["Authorization"] = "Basic %s" % b64encode(credentials).decode("ascii")
+        self.requests = 0
+
+    def get(self, path="", params=None):
+        url = urljoin(self.url, path)
+        if params:
+            url += "?" + urlencode(params)
+        self.requests += 1
+        with urlopen(Request(url, headers=self.headers), timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def info(self):
+        return self.get()
+
+    def labels(self):
+        """The labels of all records, including archived ones."""
+        info = self.get("", {"archived": 1})
+        uris = info["records"] + info.get("archived", [])  # not listed by older servers
+        return [uri.rstrip("/").rsplit("/", 1)[-1] for uri in uris]
+
+    def changes(self, since, limit=None):
+        params = {"since": since}
+        if limit is not None:
+            params["limit"] = limit
+        return self.get("changes/", params)
+
+    def records(self, labels):
+        return self.get("batch/", {"labels": ",".join(labels)})
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class ProjectReplicator(object):
+    """Bring a local project up to date with a `RemoteProject`."""
+
+    batch_size = 100
+
+    def __init__(self, remote, project_id, owner=None):
+        self.remote = remote
+        self.project_id = project_id
+        self.owner = owner
+        self.stats = {"created": 0, "updated": 0, "deleted": 0, "fetched": 0}
+
+    def get_project(self):
+        if not Project.objects.filter(id=self.project_id).exists():
+            info = self.remote.info()
+            Project.objects.get_or_create(
+                id=self.project_id,
+                defaults={
+                    "name": info.get("name") or "",
+                    "description": info.get("description") or "",
+                },
+            )
+        project = Project.objects.get(id=self.project_id)
+        permissions = project.projectpermission_set
+        if self.owner and not permissions.filter(user__username=self.owner).exists():
+            permissions.create(user=User.objects.get(username=self.owner))
+        return project
+
+    def sync(self):
+        # network requests are made outside of database transactions, so that
+        # a slow remote server does not hold locks on the local database
+        project = self.get_project()
+        state, created = ReplicationState.objects.get_or_create(
+            project=project, source=self.remote.url
+        )
+        if state.revision is None:
+            # read the revision before the records, so that no change made
+            # while copying can be missed by the next synchronization
+            latest = self.remote.changes(0, limit=0)["latest"]
+            for chunk in _chunks(self.remote.labels(), self.batch_size):
+                documents = self.fetch(chunk)
+                with transaction.atomic():
+                    self.store(project, documents)
+            state.revision = latest
+            state.save()
+        while True:
+            page = self.remote.changes(state.revision)
+            documents = []
+            for chunk in _chunks(self.to_fetch(project, page["changes"]), self.batch_size):
+                documents.extend(self.fetch(chunk))
+            with transaction.atomic():
+                self.apply(project, page["changes"], documents)
+                state.revision = page["revision"]
+                state.save()
+            if not page["more"]:
+                break
+        return self.stats
+
+    def to_fetch(self, project, changes):
+        """
+        The labels of records which must be fetched in full: new records, and
+        updated records which are not yet present locally.
+        """
+        labels = []
+        local = set(
+            Record.objects.filter(
+                project=project, label__in=set(change["label"] for change in changes)
+            ).values_list("label", flat=True)
+        )
+        for change in changes:
+            label = change["label"]
+            if change["action"] == RecordRevision.DELETE:
+                local.discard(label)
+                if label in labels:
+                    labels.remove(label)
+            elif change["action"] == RecordRevision.CREATE or label not in local:
+                if label not in labels:
+                    labels.append(label)
+        return labels
+
+    def fetch(self, labels):
+        # records deleted on the remote in the meantime are listed as
+        # missing, and their deletion will come with the next changes
+        documents = self.remote.records(labels)["records"]
+        self.stats["fetched"] += len(documents)
+        return documents
+
+    def apply(self, project, changes, documents):
+        fetched = set(attrs["label"] for attrs in documents)
+        for change in changes:
+            label = change["label"]
+            # records archived locally are changed in the same way as other records
+            restore_if_archived(project.id, label)
+            if change["action"] == RecordRevision.DELETE:
+                for record in Record.objects.filter(project=project, label=label):
+                    delete_record(record)
+                    self.stats["deleted"] += 1
+            elif change["action"] == RecordRevision.UPDATE and label not in fetched:
+                record = Record.objects.filter(project=project, label=label).first()
+                if record is not None:
+                    attrs = updatable_state(record)
+                    attrs.update((name, new) for name, (old, new) in change["delta"].items())
+                    if update_record(record, attrs):
+                        self.stats["updated"] += 1
+        self.store(project, documents)
+
+    def store(self, project, documents):
+        for attrs in documents:
+            restore_if_archived(project.id, attrs["label"])
+            record = Record.objects.filter(project=project, label=attrs["label"]).first()
+            if record is None:
+                create_record(project, attrs["label"], attrs)
+                self.stats["created"] += 1
+            elif update_record(record, attrs):
+                self.stats["updated"] += 1
@@ -6,10 +6,96 @@ Sumatra Server
 """
 
 import json
+from datetime import datetime
 from django.core.serializers.json import DjangoJSONEncoder
 from django.urls import reverse
 from django.shortcuts import render
+from sumatra.records import Record as SumatraRecord
 from sumatra.recordstore import serialization
+from tagging.utils import parse_tag_input
+from .fieldsets import record_summaries
+
+
+# relations followed by Record.to_sumatra(), loaded up-front so that
+# serializing a record costs a fixed number of queries
+record_select_related = (
+    "executable",
+    "repository",
+    "parameters",
+    "launch_mode",
+    "datastore",
+    "input_datastore",
+)
+record_prefetch_related = ("input_data", "output_data", "dependencies", "platforms")
+
+
+def with_related(records):
+    return records.select_related(*record_select_related).prefetch_related(
+        *record_prefetch_related
+    )
+
+
+class StoredRepository(object):
+    """
+    Stand-in for the Sumatra repository object of a stored record. Creating
+    the real object runs the version control tool on the server (e.g.
+    "hg status", to look for the upstream repository), which is slow and
+    meaningless for a repository on the client's machine.
+    """
+
+    def __init__(self, url, upstream=None):
+        self.url = url
+        self.upstream = upstream
+
+    def __str__(self):
+        return "%s at %s" % (self.__class__.__name__, self.url)
+
+
+_repository_classes = {}
+
+
+def stored_repository(repository):
+    # the type of a repository is serialized as the name of its class
+    cls = _repository_classes.get(repository.type)
+    if cls is None:
+        cls = _repository_classes[repository.type] = type(
+            str(repository.type), (StoredRepository,), {}
+        )
+    return cls(repository.url, repository.upstream)
+
+
+def to_sumatra(record):
+    """
+    As record.to_sumatra(), but without creating a version control repository
+    object, and taking the tags from the record's tags column, from which the
+    tag tables are updated, rather than querying the tag tables for each record.
+    """
+    sumatra_record = SumatraRecord(
+        record.executable.to_sumatra(),
+        record.repository and stored_repository(record.repository),
+        record.main_file,
+        record.version,
+        record.launch_mode.to_sumatra(),
+        record.datastore.to_sumatra(),
+        record.parameters.to_sumatra(),
+        [key.to_sumatra() for key in record.input_data.all()],
+        record.script_arguments,
+        record.label,
+        record.reason,
+        record.diff,
+        record.user,
+        input_datastore=record.input_datastore.to_sumatra(),
+        timestamp=record.timestamp,
+    )
+    sumatra_record.stdout_stderr = record.stdout_stderr
+    sumatra_record.duration = record.duration
+    sumatra_record.outcome = record.outcome
+    sumatra_record.tags = set(parse_tag_input(record.tags))
+    sumatra_record.output_data = [key.to_sumatra() for key in record.output_data.all()]
+    sumatra_record.dependencies = [dep.to_sumatra() for dep in record.dependencies.all()]
+    sumatra_record.platforms = [pi.to_sumatra() for pi in record.platforms.all()]
+    sumatra_record.repeats = record.repeats
+    return sumatra_record
 
 
 class RecordSerializer(object):
@@ -18,6 +104,18 @@ class RecordSerializer(object):
     def __init__(self, media_type):
         self.media_type = media_type
 
+    def to_dict(self, record, project):
+        data = serialization.record2dict(to_sumatra(record))
+        data["project_id"] = project
+        return self.convert(data)
+
+    def convert(self, data):
+        """Adapt a record document in the latest format to this media type."""
+        if self.media_type == "application/vnd.sumatra.record-v3+json":
+            for entry in data["output_data"]:
+                entry.pop("creation", None)
+        return data
+
     def encode(self, record, project, request=None):
         if self.media_type in (
             "application/vnd.sumatra.record-v3+json",
@@ -25,18 +123,35 @@ class RecordSerializer(object):
             "application/json",
         ):
             # later can add support for multiple versions
-            data = serialization.record2dict(record.to_sumatra())
-            data["project_id"] = project
-            if self.media_type == "application/vnd.sumatra.record-v3+json":
-                for entry in data["output_data"]:
-                    entry.pop("creation")
-            return json.dumps(data, indent=4)
+            return json.dumps(self.to_dict(record, project), indent=4)
         elif self.media_type == "text/html":
-            context = {"data": record.to_sumatra()}
+            context = {"data": to_sumatra(record)}
             return render(request, self.template, context)
         else:
             raise ValueError("Unsupported media type")
 
+    def encode_document(self, document):
+        """Encode a record document, e.g. of an archived record, as returned by to_dict()."""
+        if self.media_type in (
+            "application/vnd.sumatra.record-v3+json",
+            "application/vnd.sumatra.record-v4+json",
+            "application/json",
+        ):
+            return json.dumps(self.convert(document), indent=4)
+        else:
+            raise ValueError("Unsupported media type")
+
+    def encode_summary(self, summary, project):
+        """Encode a sparse fieldset, as returned by fieldsets.record_summaries()."""
+        if self.media_type in (
+            "application/vnd.sumatra.record-v3+json",
+            "application/vnd.sumatra.record-v4+json",
+            "application/json",
+        ):
+            return json.dumps(dict(summary, project_id=project), indent=4)
+        else:
+            raise ValueError("Unsupported media type")
+
     def decode(self, content):
         # content is a JSON string
         return serialization.decode_record(content)
@@ -49,24 +164,35 @@ class ProjectSerializer(object):
         self.media_type = media_type
         self._encoder = DjangoJSONEncoder(ensure_ascii=False, indent=4)
 
-    def encode(self, project, records, tags, request):
+    def encode(self, project, records, tags, request, fields=None, facets=None, archived=None):
         protocol = request.is_secure() and "https" or "http"
         project_uri = "%s://%s%s" % (
             protocol,
             request.get_host(),
             reverse("sumatra-project", args=[project.id]),
         )
+        if fields:
+            # a summary of each record, in place of its URI
+            records = record_summaries(records, fields)
+        else:
+            records = [
+                "%s%s/" % (project_uri, label) for label in records.values_list("label", flat=True)
+            ]
         data = {
             "id": project.id,
             "name": project.get_name(),
             "description": project.description,
-            "records": ["%s%s/" % (project_uri, rec.label) for rec in records],
+            "records": records,
             "tags": tags,
             "user": request.user.username,
         }
+        if facets is not None:
+            data["facets"] = facets
+        if archived is not None:
+            data["archived"] = ["%s%s/" % (project_uri, label) for label in archived]
         if request.user.username != "anonymous":
             # avoid non logged-in users harvesting usernames
-            data["access"] = [perm.user.username for perm in project.projectpermission_set.all()]
+            data["access"] = list(project.access)
         if self.media_type in (
             "application/vnd.sumatra.project-v3+json",
             "application/vnd.sumatra.project-v4+json",
@@ -88,7 +214,7 @@ class ProjectListSerializer(object):
         self.media_type = media_type
         self._encoder = DjangoJSONEncoder(ensure_ascii=False)
 
-    def encode(self, projects, request):
+    def encode(self, projects, last_updated, request):
         protocol = request.is_secure() and "https" or "http"
         data = [
             {
@@ -97,7 +223,7 @@ class ProjectListSerializer(object):
                 "description": project.description,
                 "uri": "%s://%s%s"
                 % (protocol, request.get_host(), reverse("sumatra-project", args=[project.id])),
-                "last_updated": project.last_updated(),
+                "last_updated": last_updated.get(project.id) or datetime(1970, 1, 1, 0, 0, 0),
             }
             for project in projects
         ]
@@ -126,7 +252,9 @@ class PermissionListSerializer(object):
         data = {
             "id": project.id,
             "name": project.get_name(),
-            "access": [perm.user for perm in project.projectpermission_set.all()],
+            "access": list(project.access),
+            "users": list(project.users),
+            "groups": list(project.groups),
         }
         if self.media_type == "application/json":
             return self._encoder.encode(data)
@@ -135,3 +263,79 @@ class PermissionListSerializer(object):
             return render(request, self.template, context)
         else:
             raise ValueError("Unsupported media type")
+
+
+class RevisionListSerializer(object):
+    def __init__(self, media_type):
+        self.media_type = media_type
+        self._encoder = DjangoJSONEncoder(ensure_ascii=False, indent=4)
+
+    def encode(self, project_id, revision, latest, revisions, more, request=None):
+        data = {
+            "project_id": project_id,
+            "revision": revision,
+            "latest": latest,
+            "changes": [rev.to_dict() for rev in revisions],
+            "more": more,
+        }
+        if self.media_type == "application/json":
+            return self._encoder.encode(data)
+        else:
+            raise ValueError("Unsupported media type")
+
+
+class RecordBatchSerializer(object):
+    # the format of the records in each version of the batch format
+    record_media_types = {
+        "application/vnd.sumatra.record-batch-v3+json": "application/vnd.sumatra.record-v3+json",
+        "application/vnd.sumatra.record-batch-v4+json": "application/vnd.sumatra.record-v4+json",
+        "application/json": "application/json",
+    }
+
+    def __init__(self, media_type):
+        self.media_type = media_type
+
+    def encode(self, records, missing, project, request=None, sparse=False):
+        if self.media_type in self.record_media_types:
+            if not sparse:
+                record_serializer = RecordSerializer(self.record_media_types[self.media_type])
+                records = [
+                    record_serializer.convert(record)
+                    if isinstance(record, dict)  # the document of an archived record
+                    else record_serializer.to_dict(record, project)
+                    for record in records
+                ]
+            data = {
+                "project_id": project,
+                "records": records,
+                "missing": missing,
+            }
+            return json.dumps(data, indent=4)
+        else:
+            raise ValueError("Unsupported media type")
+
+
+class ProjectStatsSerializer(object):
+    def __init__(self, media_type):
+        self.media_type = media_type
+        self._encoder = DjangoJSONEncoder(ensure_ascii=False, indent=4)
+
+    def encode(self, project_id, statistics, filters, request=None):
+        data = dict(statistics, project_id=project_id, filters=filters)
+        if self.media_type == "application/json":
+            return self._encoder.encode(data)
+        else:
+            raise ValueError("Unsupported media type")
+
+
+class RecordComparisonSerializer(object):
+    def __init__(self, media_type):
+        self.media_type = media_type
+        self._encoder = DjangoJSONEncoder(ensure_ascii=False, indent=4)
+
+    def encode(self, project_id, comparison, missing, request=None):
+        data = dict(comparison, project_id=project_id, missing=missing)
+        if self.media_type == "application/json":
+            return self._encoder.encode(data)
+        else:
+            raise ValueError("Unsupported media type")
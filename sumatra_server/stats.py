@@ -0,0 +1,110 @@
+"""
+Summary statistics for the records of a project, computed in the database
+with aggregate queries rather than by loading each record.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, FloatField, Max, Min, Sum, Value
+from django.db.models.functions import Cast, Floor, Least, TruncDate
+
+from .models import RevisionCounter
+
+
+default_bins = 10
+max_bins = 100
+max_groups = 50  # largest number of distinct outcomes/versions returned
+
+
+def _grouped(records, *fields):
+    counts = records.values(*fields).annotate(count=Count("pk")).order_by("-count", *fields)
+    return list(counts[:max_groups])
+
+
+def _histogram(records, minimum, maximum, bins):
+    if minimum is None:
+        return []
+    width = (maximum - minimum) / bins or 1.0
+    # the longest records belong to the last bin rather than one of their own
+    bin_index = Least(
+        Floor((Cast("duration", FloatField()) - Value(minimum)) / Value(width)), Value(bins - 1)
+    )
+    counts = dict(
+        records.filter(duration__isnull=False)
+        .annotate(bin=bin_index)
+        .values("bin")
+        .annotate(count=Count("pk"))
+        .values_list("bin", "count")
+    )
+    return [
+        {
+            "min": minimum + i * width,
+            "max": minimum + (i + 1) * width,
+            "count": counts.get(i, 0),
+        }
+        for i in range(bins)
+    ]
+
+
+def project_statistics(records, bins=default_bins):
+    """Compute summary statistics for the records in the queryset `records`."""
+    records = records.order_by()  # the default ordering would break the grouping
+    summary = records.aggregate(
+        count=Count("pk"),
+        duration_min=Min("duration"),
+        duration_max=Max("duration"),
+        duration_mean=Avg("duration"),
+        duration_total=Sum("duration"),
+        first=Min("timestamp"),
+        last=Max("timestamp"),
+    )
+    return {
+        "count": summary["count"],
+        "first": summary["first"],
+        "last": summary["last"],
+        "duration": {
+            "min": summary["duration_min"],
+            "max": summary["duration_max"],
+            "mean": summary["duration_mean"],
+            "total": summary["duration_total"],
+            "histogram": _histogram(
+                records, summary["duration_min"], summary["duration_max"], bins
+            ),
+        },
+        "outcomes": _grouped(records, "outcome"),
+        "per_day": list(
+            records.annotate(date=TruncDate("timestamp"))
+            .values("date")
+            .annotate(count=Count("pk"))
+            .order_by("date")
+        ),
+        "per_version": _grouped(records, "version"),
+        "executables": _grouped(records, "executable__name", "executable__version"),
+    }
+
+
+def cached_project_statistics(project_id, records, filters, bins=default_bins):
+    """
+    As project_statistics(), caching the result. The cache key includes the
+    project's current revision, so any change to its records invalidates it,
+    and its archive generation, since archiving is not a revision.
+    """
+    revision, archive_generation = RevisionCounter.objects.filter(
+        project_id=project_id
+    ).values_list("revision", "archive_generation").first() or (0, 0)
+    parameters = "%s|%d|%d" % (sorted(filters.items()), bins, archive_generation)
+    key = "sumatra-stats:%s:%d:%s" % (
+        project_id,
+        revision,
+        hashlib.sha1(parameters.encode("utf-8")).hexdigest(),
+    )
+    data = cache.get(key)
+    if data is None:
+        data = project_statistics(records, bins)
+        data["revision"] = revision
+        cache.set(key, data, getattr(settings, "SUMATRA_STATS_CACHE_TIMEOUT", 3600))
+    return data
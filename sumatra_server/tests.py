@@ -5,10 +5,36 @@ Sumatra Server unit tests
 :license: BSD 2-clause, see COPYING for details.
 """
 
+import hashlib
+import os
+import shutil
+import tempfile
+import time
 from base64 import b64encode
-from django.test import TestCase
+from importlib import import_module
+from collections import Counter
+from datetime import timedelta
+from django.test import (
+    TestCase,
+    LiveServerTestCase,
+    skipUnlessDBFeature,
+    override_settings,
+    modify_settings,
+)
 from django.urls import reverse
 from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction, IntegrityError
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.query import QuerySet
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from io import StringIO
+from unittest import mock
+from multiprocessing import Pool
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
 
 try:
     import json
@@ -16,14 +42,67 @@ except ImportError:
     import django.utils.simplejson as json
 import base64
 
-from sumatra_server.views import parse_accept_header
+from sumatra.recordstore.django_store.models import (
+    Project,
+    Record,
+    ParameterSet,
+    Executable,
+    DataKey,
+    Repository,
+)
+from sumatra_server.models import (
+    ReplicationState,
+    RecordRevision,
+    RevisionCounter,
+    ArchivedRecord,
+    ProjectPermission,
+    ProjectGroupPermission,
+    FacetCount,
+    IdempotencyKey,
+    SharedObjectKey,
+)
+from sumatra_server import projectcache
+from sumatra_server.projectcache import invalidate_projects
+from sumatra_server.throttling import (
+    throttle_counters,
+    acquire_write_slot,
+    release_write_slot,
+    Throttled,
+)
+from sumatra_server.serializers import RecordSerializer
+from sumatra_server.ingest import get_or_create_shared
+from sumatra_server.archive import archive_record
+from sumatra_server.validation import validate_record, RecordValidationError
+from sumatra_server.replication import RemoteProject, ProjectReplicator
+from sumatra_server.facets import facet_names, project_facets, rebuild_facets
+from sumatra_server.loadtest import LoadTest, parse_mix, percentile
+from sumatra_server.warmup import warm_up
+from sumatra_server.management.commands.startup_benchmark import parse_importtime, marker
+from sumatra_server.negotiation import (
+    NegotiationError,
+    negotiate,
+    parse_accept_header,
+)
 
 
 OK = 200
 CREATED = 201
 UNAUTHORIZED = 401
 NOT_FOUND = 404
+METHOD_NOT_ALLOWED = 405
 NO_CONTENT = 204
+NOT_MODIFIED = 304
+BAD_REQUEST = 400
+NOT_ACCEPTABLE = 406
+CONFLICT = 409
+TOO_MANY_REQUESTS = 429
+SERVICE_UNAVAILABLE = 503
+PRECONDITION_FAILED = 412
+REQUEST_ENTITY_TOO_LARGE = 413
+PARTIAL_CONTENT = 206
+PERMANENT_REDIRECT = 308
+RANGE_NOT_SATISFIABLE = 416
+UNPROCESSABLE_ENTITY = 422
 
 
 class BaseTestCase(TestCase):
@@ -39,6 +118,8 @@ class BaseTestCase(TestCase):
         self.extra = {
             "HTTP_AUTHORIZATION": auth,
         }
+        # changes made by earlier tests are rolled back without invalidating the cache
+        invalidate_projects()
 
     def assertMimeType(self, response, desired_mimetype):
         mimetype, charset = response["Content-Type"].split(";")
@@ -80,6 +161,27 @@ class ProjectListHandlerTest(BaseTestCase):
         self.failUnlessEqual(response.status_code, OK)
         self.assertMimeType(response, "text/html")
 
+    def test_GET_format_unknown(self):
+        prj_list_uri = reverse("sumatra-project-list")
+        response = self.client.get(prj_list_uri, {"format": "yaml"}, **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_GET_Accept_not_acceptable(self):
+        prj_list_uri = reverse("sumatra-project-list")
+        response = self.client.get(prj_list_uri, {}, HTTP_ACCEPT="image/png", **self.extra)
+        self.assertEqual(response.status_code, NOT_ACCEPTABLE)
+
+    def test_GET_Accept_malformed(self):
+        prj_list_uri = reverse("sumatra-project-list")
+        response = self.client.get(prj_list_uri, {}, HTTP_ACCEPT="text/html;q=x", **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_GET_Accept_partial_wildcard(self):
+        prj_list_uri = reverse("sumatra-project-list")
+        response = self.client.get(prj_list_uri, {}, HTTP_ACCEPT="application/*", **self.extra)
+        self.assertEqual(response.status_code, OK)
+        self.assertMimeType(response, "application/vnd.sumatra.project-list-v4+json")
+
 
 class ProjectHandlerTest(BaseTestCase):
     def test_GET_private_authenticated(self):
@@ -152,8 +254,11 @@ class RecordHandlerTest(BaseTestCase):
         assert isinstance(data, dict)
         self.assertEqual(data["label"], label)
         from django.contrib.contenttypes.models import ContentType
+        from tagging.models import TaggedItem
 
-        self.assertEqual(ContentType.objects.filter(model="record")[0].pk, 18)
+        self.assertEqual(
+            TaggedItem.objects.get(pk=1).content_type, ContentType.objects.get_for_model(Record)
+        )
         self.assertEqual(
             set(data.keys()),
             set(
@@ -355,6 +460,1436 @@ class RecordHandlerTest(BaseTestCase):
         self.assertEqual(response.status_code, NOT_FOUND)
 
 
+class RecordValidationTest(BaseTestCase):
+    def setUp(self):
+        super(RecordValidationTest, self).setUp()
+        self.rec_uri = reverse(
+            "sumatra-record", kwargs={"project": "TestProject", "label": "validation"}
+        )
+        haggling_uri = reverse(
+            "sumatra-record", kwargs={"project": "TestProject", "label": "haggling"}
+        )
+        self.record = json.loads(self.client.get(haggling_uri, **self.extra).content)
+        self.record["label"] = "validation"
+
+    def put(self, data):
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return self.client.put(
+            self.rec_uri, data=data, content_type="application/json", **self.extra
+        )
+
+    def assertInvalid(self, response, fields, status=BAD_REQUEST):
+        self.assertEqual(response.status_code, status)
+        errors = json.loads(response.content)["errors"]
+        self.assertEqual([error["field"] for error in errors], fields)
+        self.assertFalse(Record.objects.filter(label="validation").exists())
+
+    def test_valid(self):
+        self.assertEqual(self.put(self.record).status_code, CREATED)
+
+    def test_malformed_json(self):
+        self.assertInvalid(self.put('{"label": "validation",'), [None])
+
+    def test_invalid_values(self):
+        n_executables = Executable.objects.count()
+        self.record["duration"] = "a long time"
+        self.record["executable"]["name"] = "x" * 51
+        self.record["dependencies"][1]["colour"] = "blue"
+        self.record["tags"] = "not a list"
+        del self.record["main_file"]
+        self.assertInvalid(
+            self.put(self.record),
+            ["duration", "executable.name", "main_file", "dependencies[1].colour", "tags"],
+        )
+        self.assertEqual(Executable.objects.count(), n_executables)
+
+    def test_tags_too_long(self):
+        self.record["tags"] = ["x" * 51, "ok"]
+        self.assertInvalid(self.put(self.record), ["tags[0]"])
+        self.record["tags"] = ["tag%02d" % i for i in range(60)]
+        self.assertInvalid(self.put(self.record), ["tags"])
+
+    def test_incomplete_objects(self):
+        n_records = Record.objects.count()
+        self.record["launch_mode"] = {"parameters": {"foo": 1}}
+        self.record["executable"] = {}
+        del self.record["dependencies"][0]["name"]
+        del self.record["repository"]["upstream"]  # may be null
+        self.assertInvalid(
+            self.put(self.record),
+            ["executable", "launch_mode.type", "dependencies[0].name"],
+        )
+        self.assertEqual(Record.objects.count(), n_records)
+
+    def test_label_mismatch(self):
+        self.record["label"] = "something_else"
+        self.assertInvalid(self.put(self.record), ["label"])
+
+    def test_reserved_label(self):
+        stats_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "stats"})
+        self.record["label"] = "stats"
+        response = self.client.put(
+            stats_uri, data=json.dumps(self.record), content_type="application/json", **self.extra
+        )
+        self.assertEqual(response.status_code, METHOD_NOT_ALLOWED)
+        with self.assertRaises(RecordValidationError) as context:
+            validate_record(self.record, "stats")
+        self.assertEqual([error["field"] for error in context.exception.errors], ["label"])
+
+    def test_invalid_update(self):
+        haggling_uri = reverse(
+            "sumatra-record", kwargs={"project": "TestProject", "label": "haggling"}
+        )
+        response = self.client.put(
+            haggling_uri,
+            data=json.dumps({"reason": "no outcome or tags"}),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, BAD_REQUEST)
+        self.assertEqual(len(json.loads(response.content)["errors"]), 2)
+
+    @override_settings(SUMATRA_MAX_RECORD_SIZE=1000)
+    def test_too_large(self):
+        self.assertInvalid(self.put(self.record), [None], status=REQUEST_ENTITY_TOO_LARGE)
+
+
+class RecordBatchTest(BaseTestCase):
+    labels = ["haggling", "20111013-172503", "20111013-172514", "haggling_repeat"]
+
+    def setUp(self):
+        super(RecordBatchTest, self).setUp()
+        self.batch_uri = reverse("sumatra-record-batch", kwargs={"project": "TestProject"})
+
+    def test_GET(self):
+        response = self.client.get(
+            self.batch_uri, {"labels": "haggling,nonexistent,haggling"}, **self.extra
+        )
+        self.assertEqual(response.status_code, OK)
+        self.assertMimeType(response, "application/vnd.sumatra.record-batch-v4+json")
+        data = json.loads(response.content)
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        full = json.loads(self.client.get(rec_uri, **self.extra).content)
+        self.assertEqual(data["records"], [full])
+        self.assertEqual(data["missing"], ["nonexistent"])
+
+    def test_GET_v3(self):
+        response = self.client.get(
+            self.batch_uri,
+            {"labels": "haggling", "format": "record-batch-v3+json"},
+            **self.extra
+        )
+        self.assertMimeType(response, "application/vnd.sumatra.record-batch-v3+json")
+        output_data = json.loads(response.content)["records"][0]["output_data"]
+        self.assertTrue(output_data)
+        self.assertFalse(any("creation" in entry for entry in output_data))
+
+    def test_POST(self):
+        response = self.client.post(
+            self.batch_uri,
+            data=json.dumps({"labels": self.labels + ["nonexistent"]}),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, OK)
+        data = json.loads(response.content)
+        self.assertEqual([record["label"] for record in data["records"]], self.labels)
+        self.assertEqual(data["missing"], ["nonexistent"])
+        response = self.client.post(
+            self.batch_uri,
+            data=json.dumps(["haggling"]),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_not_authenticated(self):
+        response = self.client.get(self.batch_uri, {"labels": "haggling"})
+        self.assertEqual(response.status_code, UNAUTHORIZED)
+
+    @override_settings(SUMATRA_MAX_BATCH_SIZE=3)
+    def test_too_many_labels(self):
+        response = self.client.get(self.batch_uri, {"labels": ",".join(self.labels)}, **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_query_count(self):
+        def count_queries(labels):
+            self.client.get(self.batch_uri, {"labels": "haggling"}, **self.extra)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.batch_uri, {"labels": labels}, **self.extra)
+            self.assertEqual(response.status_code, OK)
+            return len(context.captured_queries)
+
+        # the number of queries does not depend on the number of records
+        self.assertEqual(count_queries("haggling"), count_queries(",".join(self.labels)))
+
+
+class ProjectStatsTest(BaseTestCase):
+    def setUp(self):
+        super(ProjectStatsTest, self).setUp()
+        cache.clear()  # revision numbers are reused once each test is rolled back
+
+    def get_stats(self, project="TestProject", **params):
+        stats_uri = reverse("sumatra-project-stats", kwargs={"project": project})
+        response = self.client.get(stats_uri, params, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        return json.loads(response.content)
+
+    def test_GET(self):
+        records = Record.objects.filter(project="TestProject")
+        data = self.get_stats(bins=4)
+        self.assertEqual(data["count"], records.count())
+        self.assertEqual(len(data["duration"]["histogram"]), 4)
+        self.assertEqual(
+            sum(b["count"] for b in data["duration"]["histogram"]),
+            records.filter(duration__isnull=False).count(),
+        )
+        self.assertAlmostEqual(
+            data["duration"]["max"], max(r.duration for r in records if r.duration is not None)
+        )
+        self.assertEqual(sum(o["count"] for o in data["outcomes"]), records.count())
+        self.assertEqual(sum(d["count"] for d in data["per_day"]), records.count())
+        self.assertEqual(sum(v["count"] for v in data["per_version"]), records.count())
+        self.assertEqual(data["executables"][0]["executable__name"], "Python")
+
+    def test_GET_filtered(self):
+        data = self.get_stats(tags="foobar")
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(data["filters"], {"tags": "foobar"})
+
+    def test_cache_invalidated(self):
+        self.assertEqual(self.get_stats()["count"], 4)
+        with CaptureQueriesContext(connection) as context:
+            self.get_stats()
+        self.assertFalse(
+            any("GROUP BY" in query["sql"] for query in context.captured_queries),
+            "statistics were recomputed",
+        )
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        self.client.delete(rec_uri, **self.extra)
+        self.assertEqual(self.get_stats()["count"], 3)
+
+    def test_cache_invalidated_by_archiving(self):
+        def archive(tag):
+            call_command("archive_records", "TestProject", "--tags=%s" % tag, stdout=StringIO())
+
+        def outcomes():
+            return dict((o["outcome"], o["count"]) for o in self.get_stats()["outcomes"])
+
+        Record.objects.filter(label="haggling_repeat").update(tags="other")
+        archive("foobar")
+        without_haggling = outcomes()
+        call_command("restore_records", "TestProject", "--all", stdout=StringIO())
+        # the same number of records are archived as before, but not the same ones
+        archive("other")
+        expected = Counter(
+            Record.objects.filter(project="TestProject").values_list("outcome", flat=True)
+        )
+        self.assertEqual(outcomes(), expected)
+        self.assertNotEqual(outcomes(), without_haggling)
+
+    def test_GET_bad_bins(self):
+        stats_uri = reverse("sumatra-project-stats", kwargs={"project": "TestProject"})
+        response = self.client.get(stats_uri, {"bins": 0}, **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+
+class RecordComparisonTest(BaseTestCase):
+    def compare(self, labels):
+        compare_uri = reverse("sumatra-record-comparison", kwargs={"project": "TestProject"})
+        return self.client.get(compare_uri, {"labels": ",".join(labels)}, **self.extra)
+
+    def test_GET(self):
+        labels = ["haggling", "haggling_repeat", "20111013-172503"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.compare(labels)
+        self.assertEqual(response.status_code, OK)
+        data = json.loads(response.content)
+        self.assertEqual(data["labels"], labels)
+        self.assertEqual(data["missing"], [])
+        self.assertIn("timestamp", data["fields"])
+        self.assertNotIn("main_file", data["fields"])
+        self.assertEqual(set(data["fields"]["timestamp"].keys()), set(labels))
+        self.assertEqual(data["fields"]["tags"]["haggling"], ["foobar"])
+        # loading the records, their related objects and tags, plus authentication
+        self.assertLessEqual(len(context.captured_queries), 10)
+
+    def test_parameter_diff(self):
+        haggling = Record.objects.get(label="haggling")
+        other = Record.objects.get(label="haggling_repeat")
+        other.parameters = ParameterSet.objects.create(
+            type=haggling.parameters.type,
+            content=haggling.parameters.content.replace("seed", "seed2", 1),
+        )
+        other.save()
+        data = json.loads(self.compare(["haggling", "haggling_repeat"]).content)
+        self.assertIn("seed", data["parameters"])
+        self.assertIsNone(data["parameters"]["seed"]["haggling_repeat"])
+
+    def test_GET_missing(self):
+        data = json.loads(self.compare(["haggling", "nonexistent"]).content)
+        self.assertEqual(data["missing"], ["nonexistent"])
+
+    def test_GET_too_few_labels(self):
+        self.assertEqual(self.compare(["haggling"]).status_code, BAD_REQUEST)
+
+
+class SparseFieldsetTest(BaseTestCase):
+    def test_GET_record(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                rec_uri, {"fields": "timestamp,outcome,duration,tags,executable"}, **self.extra
+            )
+        self.assertEqual(response.status_code, OK)
+        self.assertMimeType(response, "application/vnd.sumatra.record-v4+json")
+        data = json.loads(response.content)
+        full = json.loads(self.client.get(rec_uri, **self.extra).content)
+        self.assertEqual(
+            set(data),
+            set(["label", "timestamp", "outcome", "duration", "tags", "executable", "project_id"]),
+        )
+        for name in ("label", "timestamp", "outcome", "duration"):
+            self.assertEqual(data[name], full[name])
+        self.assertEqual(data["tags"], sorted(full["tags"]))
+        self.assertEqual(data["executable"], full["executable"])
+        # the parameters, data keys, etc. are not loaded
+        self.assertFalse(any("parameterset" in query["sql"] for query in context.captured_queries))
+
+    def test_GET_record_tags_and_timestamp(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        Record.objects.filter(label="haggling").update(tags='foo bar,"with space"')
+        for use_tz in (False, True):
+            with self.settings(USE_TZ=use_tz):
+                full = json.loads(self.client.get(rec_uri, **self.extra).content)
+                data = json.loads(
+                    self.client.get(rec_uri, {"fields": "timestamp,tags"}, **self.extra).content
+                )
+                self.assertEqual(data["timestamp"], full["timestamp"])
+                self.assertEqual(data["tags"], sorted(full["tags"]))
+
+    def test_GET_project(self):
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        response = self.client.get(prj_uri, {"fields": "outcome", "tags": "foobar"}, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        data = json.loads(response.content)
+        outcome = Record.objects.get(label="haggling").outcome
+        self.assertEqual(data["records"], [{"label": "haggling", "outcome": outcome}])
+
+    def test_GET_batch(self):
+        batch_uri = reverse("sumatra-record-batch", kwargs={"project": "TestProject"})
+        response = self.client.get(
+            batch_uri, {"labels": "haggling,nonexistent", "fields": "reason"}, **self.extra
+        )
+        data = json.loads(response.content)
+        self.assertEqual(list(data["records"][0]), ["label", "reason"])
+        self.assertEqual(data["missing"], ["nonexistent"])
+
+    def test_GET_unknown_field(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        response = self.client.get(rec_uri, {"fields": "label,parameters"}, **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_GET_html_not_acceptable(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        response = self.client.get(rec_uri, {"fields": "label", "format": "html"}, **self.extra)
+        self.assertEqual(response.status_code, NOT_ACCEPTABLE)
+
+
+class ArchiveTest(BaseTestCase):
+    def record_uri(self, label):
+        return reverse("sumatra-record", kwargs={"project": "TestProject", "label": label})
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command("archive_records", "TestProject", *args, stdout=out)
+        return out.getvalue()
+
+    def test_archive_by_date(self):
+        self.assertIn("4 records to archive", self.archive("--before=2011-10-14", "--dry-run"))
+        self.assertEqual(ArchivedRecord.objects.count(), 0)
+        self.assertIn("0 records archived", self.archive("--before=2011-10-13"))
+        self.assertIn("4 records archived", self.archive("--before=2011-10-14", "--batch-size=3"))
+        self.assertEqual(ArchivedRecord.objects.filter(project="TestProject").count(), 4)
+        self.assertFalse(Record.objects.filter(project="TestProject").exists())
+        self.assertTrue(Record.objects.filter(project="TestProject2").exists())
+
+    def test_GET_archived(self):
+        full = self.client.get(self.record_uri("haggling"), **self.extra).content
+        v3 = self.client.get(
+            self.record_uri("haggling"),
+            HTTP_ACCEPT="application/vnd.sumatra.record-v3+json",
+            **self.extra
+        ).content
+        sparse = self.client.get(
+            self.record_uri("haggling"), {"fields": "tags,executable"}, **self.extra
+        ).content
+        self.archive("--tags=foobar")
+        self.assertEqual(list(ArchivedRecord.objects.values_list("label", flat=True)), ["haggling"])
+        self.assertFalse(Record.objects.filter(label="haggling").exists())
+        response = self.client.get(self.record_uri("haggling"), **self.extra)
+        self.assertEqual(response.status_code, OK)
+        self.assertEqual(json.loads(response.content), json.loads(full))
+        response = self.client.get(
+            self.record_uri("haggling"),
+            HTTP_ACCEPT="application/vnd.sumatra.record-v3+json",
+            **self.extra
+        )
+        self.assertEqual(json.loads(response.content), json.loads(v3))
+        response = self.client.get(
+            self.record_uri("haggling"), {"fields": "tags,executable"}, **self.extra
+        )
+        self.assertEqual(json.loads(response.content), json.loads(sparse))
+        response = self.client.get(self.record_uri("haggling"), {"format": "html"}, **self.extra)
+        self.assertEqual(response.status_code, NOT_ACCEPTABLE)
+        # archived records are not listed
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        records = json.loads(self.client.get(prj_uri, **self.extra).content)["records"]
+        self.assertEqual(len(records), 3)
+        data = json.loads(self.client.get(prj_uri, {"archived": 1}, **self.extra).content)
+        self.assertEqual(len(data["records"]), 3)
+        self.assertEqual(data["archived"], ["http://testserver%shaggling/" % prj_uri])
+        # but can be fetched in a batch
+        batch_uri = reverse("sumatra-record-batch", kwargs={"project": "TestProject"})
+        response = self.client.get(batch_uri, {"labels": "haggling,haggling_repeat"}, **self.extra)
+        data = json.loads(response.content)
+        self.assertEqual([r["label"] for r in data["records"]], ["haggling", "haggling_repeat"])
+        self.assertEqual(data["records"][0], json.loads(full))
+        self.assertEqual(data["missing"], [])
+
+    def test_restore(self):
+        full = self.client.get(self.record_uri("haggling"), **self.extra).content
+        self.archive("--before=2011-10-14")
+        out = StringIO()
+        call_command("restore_records", "TestProject", "haggling", stdout=out)
+        self.assertIn("1 records restored", out.getvalue())
+        self.assertEqual(ArchivedRecord.objects.count(), 3)
+        response = self.client.get(self.record_uri("haggling"), **self.extra)
+        self.assertEqual(json.loads(response.content), json.loads(full))
+        call_command("restore_records", "TestProject", "--all", stdout=out)
+        self.assertEqual(ArchivedRecord.objects.count(), 0)
+        self.assertEqual(Record.objects.filter(project="TestProject").count(), 4)
+        # moving records to and from the archive does not create revisions
+        self.assertFalse(RecordRevision.objects.exists())
+
+    def test_PUT_and_DELETE_archived(self):
+        self.archive("--before=2011-10-14")
+        outcome = json.loads(self.client.get(self.record_uri("haggling"), **self.extra).content)
+        update = {"reason": "new reason", "outcome": outcome["outcome"], "tags": ["foobar"]}
+        response = self.client.put(
+            self.record_uri("haggling"),
+            data=json.dumps(update),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, OK)
+        self.assertEqual(Record.objects.get(label="haggling").reason, "new reason")
+        self.assertFalse(ArchivedRecord.objects.filter(label="haggling").exists())
+        response = self.client.delete(self.record_uri("haggling_repeat"), **self.extra)
+        self.assertEqual(response.status_code, NO_CONTENT)
+        self.assertFalse(ArchivedRecord.objects.filter(label="haggling_repeat").exists())
+        self.assertFalse(Record.objects.filter(label="haggling_repeat").exists())
+        response = self.client.get(self.record_uri("haggling_repeat"), **self.extra)
+        self.assertEqual(response.status_code, NOT_FOUND)
+
+    def test_invalid_PUT_archived(self):
+        update = {"reason": "", "outcome": "", "tags": ["foobar"]}
+        self.client.put(
+            self.record_uri("haggling"),
+            data=json.dumps(update),
+            content_type="application/json",
+            **self.extra
+        )  # giving the record a revision, and so an ETag
+        self.archive("--tags=foobar")
+        response = self.client.put(
+            self.record_uri("haggling"),
+            data=json.dumps({"reason": 5}),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, BAD_REQUEST)
+        # the record was not restored
+        self.assertTrue(ArchivedRecord.objects.filter(label="haggling").exists())
+        self.assertFalse(Record.objects.filter(label="haggling").exists())
+        response = self.client.put(
+            self.record_uri("haggling"),
+            data=json.dumps(update),
+            content_type="application/json",
+            HTTP_IF_MATCH='"1000"',
+            **self.extra
+        )
+        self.assertEqual(response.status_code, PRECONDITION_FAILED)
+        self.assertTrue(ArchivedRecord.objects.filter(label="haggling").exists())
+
+    def test_archive_stale_record(self):
+        record = Record.objects.get(project="TestProject", label="haggling")
+        Record.objects.filter(pk=record.pk).update(outcome="changed since it was read")
+        self.assertTrue(archive_record(record))
+        archived = ArchivedRecord.objects.get(label="haggling")
+        self.assertEqual(archived.to_dict()["outcome"], "changed since it was read")
+        # a record deleted since it was read is not archived
+        record = Record.objects.get(project="TestProject", label="haggling_repeat")
+        Record.objects.filter(pk=record.pk).delete()
+        self.assertFalse(archive_record(record))
+        self.assertFalse(ArchivedRecord.objects.filter(label="haggling_repeat").exists())
+
+    def test_archive_by_whole_tag(self):
+        Record.objects.filter(label="haggling_repeat").update(tags="testing,other")
+        Record.objects.filter(label="20111013-172514").update(tags='"a test",test')
+        self.assertIn("1 records archived", self.archive("--tags=test"))
+        self.assertEqual(
+            list(ArchivedRecord.objects.values_list("label", flat=True)), ["20111013-172514"]
+        )
+        self.archive("--tags=testing")
+        out = StringIO()
+        call_command("restore_records", "TestProject", "--tags=test", stdout=out)
+        self.assertIn("1 records restored", out.getvalue())
+        self.assertEqual(
+            list(ArchivedRecord.objects.values_list("label", flat=True)), ["haggling_repeat"]
+        )
+
+    def test_no_criteria(self):
+        self.assertRaises(CommandError, self.archive)
+        self.assertRaises(
+            CommandError, call_command, "restore_records", "TestProject", stdout=StringIO()
+        )
+
+
+class FacetTest(BaseTestCase):
+    def setUp(self):
+        super(FacetTest, self).setUp()
+        call_command("rebuild_facets", stdout=StringIO())
+        self.prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+
+    def record_uri(self, label):
+        return reverse("sumatra-record", kwargs={"project": "TestProject", "label": label})
+
+    def get_facets(self, names=""):
+        response = self.client.get(self.prj_uri, {"facets": names}, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        return json.loads(response.content)["facets"]
+
+    def assertCountsCorrect(self):
+        facets = project_facets("TestProject")
+        rebuild_facets("TestProject")
+        self.assertEqual(facets, project_facets("TestProject"))
+
+    def test_GET(self):
+        facets = self.get_facets()
+        self.assertEqual(sorted(facets), sorted(facet_names))
+        tags = dict((item["value"], item["count"]) for item in facets["tags"])
+        self.assertEqual(tags["foobar"], 1)
+        self.assertEqual(sum(item["count"] for item in facets["main_file"]), 4)
+        self.assertEqual(list(self.get_facets("tags,outcome")), ["tags", "outcome"])
+        response = self.client.get(self.prj_uri, **self.extra)
+        self.assertNotIn("facets", json.loads(response.content))
+        response = self.client.get(self.prj_uri, {"facets": "tags,colour"}, **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_incremental_updates(self):
+        record = json.loads(self.client.get(self.record_uri("haggling"), **self.extra).content)
+        record["label"] = "facet-test"
+        record["tags"] = ["foobar", "new-tag"]
+        response = self.client.put(
+            self.record_uri("facet-test"),
+            data=json.dumps(record),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, CREATED)
+        tags = dict((item["value"], item["count"]) for item in self.get_facets("tags")["tags"])
+        self.assertEqual((tags["foobar"], tags["new-tag"]), (2, 1))
+        self.assertCountsCorrect()
+        update = {"reason": record["reason"], "outcome": "better", "tags": ["foobar"]}
+        response = self.client.put(
+            self.record_uri("facet-test"),
+            data=json.dumps(update),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, OK)
+        facets = self.get_facets("tags,outcome")
+        self.assertNotIn("new-tag", [item["value"] for item in facets["tags"]])
+        self.assertIn({"value": "better", "count": 1}, facets["outcome"])
+        self.assertCountsCorrect()
+        response = self.client.delete(self.record_uri("facet-test"), **self.extra)
+        self.assertEqual(response.status_code, NO_CONTENT)
+        self.assertNotIn({"value": "better", "count": 1}, self.get_facets("outcome")["outcome"])
+        self.assertCountsCorrect()
+
+    def test_archive_and_restore(self):
+        before = project_facets("TestProject")
+        call_command("archive_records", "TestProject", "--tags=foobar", stdout=StringIO())
+        self.assertNotIn("foobar", [item["value"] for item in self.get_facets("tags")["tags"]])
+        self.assertCountsCorrect()
+        call_command("restore_records", "TestProject", "--all", stdout=StringIO())
+        self.assertEqual(project_facets("TestProject"), before)
+
+    def test_rebuild_in_migration(self):
+        projects = ("TestProject", "TestProject2")
+        expected = dict((project, project_facets(project)) for project in projects)
+        FacetCount.objects.all().delete()
+        loader = MigrationExecutor(connection).loader
+        apps = loader.project_state(("sumatra_server", "0007_facet_counts")).apps
+        migration = import_module("sumatra_server.migrations.0007_facet_counts")
+        migration.count_facets(apps, None)
+        for project, facets in expected.items():
+            self.assertEqual(project_facets(project), facets)
+
+    def test_counts_out_of_date(self):
+        FacetCount.objects.filter(project="TestProject").delete()
+        response = self.client.delete(self.record_uri("haggling"), **self.extra)
+        self.assertEqual(response.status_code, NO_CONTENT)
+        self.assertFalse(FacetCount.objects.filter(project="TestProject").exists())
+
+
+class PermissionTest(BaseTestCase):
+    def setUp(self):
+        super(PermissionTest, self).setUp()
+        self.perm_uri = reverse("sumatra-project-permissions", kwargs={"project": "TestProject"})
+        self.prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        self.members = [User.objects.create_user("member%d" % i, password="m") for i in range(3)]
+        self.group = Group.objects.create(name="lab")
+        self.group.user_set.add(*self.members[:2])
+
+    def change(self, changes):
+        return self.client.post(
+            self.perm_uri, data=json.dumps(changes), content_type="application/json", **self.extra
+        )
+
+    def as_user(self, username):
+        credentials = b64encode(("%s:m" % username).encode("utf-8")).decode("ascii")
+        return {"HTTP_AUTHORIZATION": "Basic %s" % credentials}
+
+    def test_grant_and_revoke(self):
+        response = self.change({"grant": {"users": ["member2"], "groups": ["lab"]}})
+        self.assertEqual(response.status_code, OK)
+        data = json.loads(response.content)
+        self.assertEqual(data["users"], ["testuser", "member2"])
+        self.assertEqual(data["groups"], ["lab"])
+        self.assertEqual(data["access"], ["testuser", "member2", "member0", "member1"])
+        for member in ("member0", "member1", "member2"):
+            response = self.client.get(self.prj_uri, **self.as_user(member))
+            self.assertEqual(response.status_code, OK)
+        # granting again is harmless
+        self.assertEqual(self.change({"grant": {"groups": ["lab"]}}).status_code, OK)
+        self.assertEqual(ProjectGroupPermission.objects.count(), 1)
+        response = self.change({"revoke": {"users": ["member2"], "groups": ["lab"]}})
+        self.assertEqual(json.loads(response.content)["access"], ["testuser"])
+        response = self.client.get(self.prj_uri, **self.as_user("member0"))
+        self.assertEqual(response.status_code, 403)
+
+    def test_group_membership_change(self):
+        self.change({"grant": {"groups": ["lab"]}})
+        extra = self.as_user("member2")
+        self.assertEqual(self.client.get(self.prj_uri, **extra).status_code, 403)
+        self.group.user_set.add(self.members[2])
+        self.assertEqual(self.client.get(self.prj_uri, **extra).status_code, OK)
+        self.members[2].groups.clear()
+        self.assertEqual(self.client.get(self.prj_uri, **extra).status_code, 403)
+
+    def test_unknown_names(self):
+        response = self.change({"grant": {"users": ["member0", "nobody"], "groups": ["nogroup"]}})
+        self.assertEqual(response.status_code, BAD_REQUEST)
+        errors = json.loads(response.content)["errors"]
+        self.assertEqual([e["field"] for e in errors], ["users", "groups"])
+        # nothing is changed
+        self.assertEqual(ProjectPermission.objects.filter(user__username="member0").count(), 0)
+        response = self.change({"grant": {"users": "member0"}})
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+    def test_anonymous_change_refused(self):
+        public_uri = reverse("sumatra-project-permissions", kwargs={"project": "TestProject2"})
+        before = list(ProjectPermission.objects.filter(project="TestProject2").values_list("pk"))
+        self.assertTrue(before)
+        response = self.client.post(
+            public_uri,
+            data=json.dumps({"revoke": {"users": ["testuser", "anonymous"]}}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, UNAUTHORIZED)
+        response = self.client.post(public_uri, {"user": self.members[2].pk})
+        self.assertEqual(response.status_code, UNAUTHORIZED)
+        after = list(ProjectPermission.objects.filter(project="TestProject2").values_list("pk"))
+        self.assertEqual(after, before)
+        # a user without access to a public project may read it, but not change access
+        response = self.client.post(
+            public_uri,
+            data=json.dumps({"grant": {"users": ["member0"]}}),
+            content_type="application/json",
+            **self.as_user("member0")
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_last_user_not_revoked(self):
+        self.change({"grant": {"groups": ["lab"]}})
+        response = self.change({"revoke": {"users": ["testuser"]}})
+        self.assertEqual(response.status_code, BAD_REQUEST)
+        self.assertEqual(json.loads(response.content)["errors"][0]["field"], "revoke.users")
+        self.assertTrue(ProjectPermission.objects.filter(project="TestProject").exists())
+        self.assertEqual(ProjectGroupPermission.objects.count(), 1)
+
+    def test_access_check_queries(self):
+        self.change({"grant": {"groups": ["lab"]}})
+        extra = self.as_user("member0")
+        self.client.get(self.perm_uri, **extra)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.perm_uri, **extra)
+        self.assertEqual(response.status_code, OK)
+        # only the query authenticating the user
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_form_post(self):
+        response = self.client.post(self.perm_uri, {"user": self.members[2].pk}, **self.extra)
+        self.assertEqual(response.status_code, 302)
+        data = json.loads(self.client.get(self.perm_uri, **self.extra).content)
+        self.assertEqual(data["users"], ["testuser", "member2"])
+
+
+class RevisionTest(BaseTestCase):
+    def put_record(self, label, data):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": label})
+        return self.client.put(
+            rec_uri, data=json.dumps(data), content_type="application/json", **self.extra
+        )
+
+    def get_changes(self, since=0, **params):
+        changes_uri = reverse("sumatra-project-changes", kwargs={"project": "TestProject"})
+        params["since"] = since
+        response = self.client.get(changes_uri, params, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        return json.loads(response.content)
+
+    def test_update_creates_delta(self):
+        outcome = Record.objects.get(label="haggling").outcome
+        update = {"reason": "new reason", "outcome": outcome, "tags": ["foobar", "tagB"]}
+        self.assertEqual(self.put_record("haggling", update).status_code, OK)
+        data = self.get_changes()
+        self.assertEqual(data["revision"], 1)
+        self.assertEqual(len(data["changes"]), 1)
+        change = data["changes"][0]
+        self.assertEqual(change["action"], "update")
+        self.assertEqual(change["label"], "haggling")
+        # unchanged fields are not stored
+        self.assertEqual(set(change["delta"].keys()), {"reason", "tags"})
+        self.assertEqual(change["delta"]["tags"], [["foobar"], ["foobar", "tagB"]])
+        self.assertEqual(change["delta"]["reason"][1], "new reason")
+
+        # repeating the same update does not create a new revision
+        self.put_record("haggling", update)
+        self.assertEqual(self.get_changes()["revision"], 1)
+
+    def test_changes_since(self):
+        for i in range(3):
+            self.put_record("haggling", {"reason": "reason %d" % i, "outcome": "", "tags": []})
+        rec_uri = reverse(
+            "sumatra-record", kwargs={"project": "TestProject", "label": "20111013-172503"}
+        )
+        self.client.delete(rec_uri, **self.extra)
+        data = self.get_changes(since=2)
+        self.assertEqual(data["revision"], 4)
+        self.assertEqual([c["revision"] for c in data["changes"]], [3, 4])
+        self.assertEqual(data["changes"][1]["action"], "delete")
+        self.assertEqual(self.get_changes(since=4)["changes"], [])
+
+        data = self.get_changes(since=0, limit=2)
+        self.assertEqual(data["revision"], 2)
+        self.assertTrue(data["more"])
+
+        history_uri = reverse(
+            "sumatra-record-history", kwargs={"project": "TestProject", "label": "haggling"}
+        )
+        data = json.loads(self.client.get(history_uri, {}, **self.extra).content)
+        self.assertEqual([c["revision"] for c in data["changes"]], [1, 2, 3])
+
+    def test_conditional_requests(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        self.put_record("haggling", {"reason": "a", "outcome": "", "tags": []})
+        response = self.client.get(rec_uri, {}, **self.extra)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('"1-'))
+        response = self.client.get(rec_uri, {}, HTTP_IF_NONE_MATCH=etag, **self.extra)
+        self.assertEqual(response.status_code, NOT_MODIFIED)
+        # each representation of the record has its own entity tag
+        for params, headers in (
+            ({"fields": "label"}, {}),
+            ({}, {"HTTP_ACCEPT": "application/vnd.sumatra.record-v3+json"}),
+        ):
+            response = self.client.get(rec_uri, params, **headers, **self.extra)
+            self.assertTrue(response["ETag"].startswith('"1-'))
+            self.assertNotEqual(response["ETag"], etag)
+            other = response["ETag"]
+            response = self.client.get(rec_uri, {}, HTTP_IF_NONE_MATCH=other, **self.extra)
+            self.assertEqual(response.status_code, OK)
+
+        response = self.client.put(
+            rec_uri,
+            data=json.dumps({"reason": "b", "outcome": "", "tags": []}),
+            content_type="application/json",
+            HTTP_IF_MATCH='"999"',
+            **self.extra
+        )
+        self.assertEqual(response.status_code, PRECONDITION_FAILED)
+        response = self.client.put(
+            rec_uri,
+            data=json.dumps({"reason": "b", "outcome": "", "tags": []}),
+            content_type="application/json",
+            HTTP_IF_MATCH=etag,
+            **self.extra
+        )
+        self.assertEqual(response.status_code, OK)
+        response = self.client.get(rec_uri, {}, HTTP_IF_NONE_MATCH=etag, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        self.assertTrue(response["ETag"].startswith('"2-'))
+
+    def test_counter_created_concurrently(self):
+        RevisionCounter.objects.create(project_id="TestProject", revision=5)
+        update = QuerySet.update
+        calls = []
+
+        def update_after_create(queryset, **kwargs):
+            # the first UPDATE runs before a concurrent request creates the row
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", update_after_create):
+            self.assertEqual(RevisionCounter.next_revision("TestProject"), 6)
+        self.assertEqual(len(calls), 2)
+
+    def test_conditional_create(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "new"})
+        data = json.dumps({"reason": "a", "outcome": "", "tags": []})
+        response = self.client.put(
+            rec_uri, data=data, content_type="application/json", HTTP_IF_MATCH='"999"', **self.extra
+        )
+        self.assertEqual(response.status_code, PRECONDITION_FAILED)
+        self.assertFalse(Record.objects.filter(label="new").exists())
+
+    def test_conditional_PUT_without_revisions(self):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        update = json.dumps({"reason": "b", "outcome": "", "tags": []})
+        for if_match, status in (('"1"', PRECONDITION_FAILED), ("*", OK)):
+            response = self.client.put(
+                rec_uri,
+                data=update,
+                content_type="application/json",
+                HTTP_IF_MATCH=if_match,
+                **self.extra
+            )
+            self.assertEqual(response.status_code, status)
+
+    def test_changes_bad_since(self):
+        changes_uri = reverse("sumatra-project-changes", kwargs={"project": "TestProject"})
+        response = self.client.get(changes_uri, {"since": "yesterday"}, **self.extra)
+        self.assertEqual(response.status_code, BAD_REQUEST)
+
+
+class ReplicationTest(LiveServerTestCase):
+    fixtures = ["haggling", "permissions"]
+
+    def setUp(self):
+        user_and_passwd = b64encode(b"testuser:abc123").decode("ascii")
+        self.extra = {"HTTP_AUTHORIZATION": "Basic %s" % user_and_passwd}
+
+    def remote(self, project="TestProject"):
+        url = self.live_server_url + reverse("sumatra-project", kwargs={"project": project})
+        return RemoteProject(url, "testuser", "abc123")
+
+    def sync(self):
+        return ProjectReplicator(self.remote(), "Mirror", owner="testuser").sync()
+
+    def labels(self, project):
+        return set(Record.objects.filter(project=project).values_list("label", flat=True))
+
+    def test_sync(self):
+        # archived records are copied too
+        archive_record(Record.objects.get(project="TestProject", label="20111013-172503"))
+        stats = self.sync()
+        self.assertEqual(stats["created"], 4)
+        self.assertEqual(
+            self.labels("Mirror"), self.labels("TestProject") | set(["20111013-172503"])
+        )
+        mirror = Project.objects.get(id="Mirror")
+        self.assertEqual(mirror.projectpermission_set.get().user.username, "testuser")
+
+        # change the source project
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        update = {"reason": "synchronized reason", "outcome": "", "tags": ["synced"]}
+        self.client.put(
+            rec_uri, data=json.dumps(update), content_type="application/json", **self.extra
+        )
+        rec_uri = reverse(
+            "sumatra-record", kwargs={"project": "TestProject", "label": "20111013-172503"}
+        )
+        self.client.delete(rec_uri, **self.extra)
+        record = Record.objects.get(project="TestProject", label="20111013-172514")
+        new_record = RecordSerializer("application/json").to_dict(record, "TestProject")
+        new_record["label"] = "synced-record"
+        rec_uri = reverse(
+            "sumatra-record", kwargs={"project": "TestProject", "label": "synced-record"}
+        )
+        self.client.put(
+            rec_uri, data=json.dumps(new_record), content_type="application/json", **self.extra
+        )
+
+        # only the new record is transferred in full
+        stats = self.sync()
+        self.assertEqual(
+            stats, {"created": 1, "updated": 1, "deleted": 1, "fetched": 1},
+        )
+        self.assertEqual(self.labels("Mirror"), self.labels("TestProject"))
+        record = Record.objects.get(project="Mirror", label="haggling")
+        self.assertEqual(record.reason, "synchronized reason")
+        self.assertEqual([tag.name for tag in record.tag_objects()], ["synced"])
+
+        # synchronizing again changes nothing
+        stats = self.sync()
+        self.assertEqual(stats, {"created": 0, "updated": 0, "deleted": 0, "fetched": 0})
+
+        # the same through the management command. This is not a separate test
+        # since the fixtures cannot be reloaded after a flush on SQLite.
+        out = StringIO()
+        call_command(
+            "sync_project",
+            self.remote("TestProject2").url,
+            username="testuser",
+            password="abc123",
+            stdout=out,
+        )
+        self.assertIn("TestProject2: 0 created", out.getvalue())
+        self.assertEqual(
+            ReplicationState.objects.get(project="TestProject2").revision, 0,
+        )
+
+
+@modify_settings(MIDDLEWARE={"append": "sumatra_server.middleware.QueryCountMiddleware"})
+class SimulatedLoadTest(LiveServerTestCase):
+    # named to run after ReplicationTest: the tags created here would stop its
+    # fixtures from loading, since SQLite does not reuse primary keys after a flush
+
+    def test_run(self):
+        User.objects.create_user("loadtester", password="abc123")
+        url = self.live_server_url + reverse("sumatra-project-list")
+        mix = parse_mix("create=2,update,get=2,list,projects,delete")
+        test = LoadTest(url, "LoadTest", "loadtester", "abc123", clients=1, mix=mix, requests=20)
+        self.assertEqual(test.create_project(), CREATED)
+        results = test.run()
+        self.assertEqual(results["total"]["requests"], 20)
+        self.assertEqual(results["total"]["errors"], 0, results["total"]["statuses"])
+        self.assertEqual(set(results["operations"]), set(mix))
+        self.assertEqual(results["operations"]["projects"]["max_queries"], 2)
+        created = Record.objects.filter(project="LoadTest").count()
+        self.assertEqual(created, len(test.clients[0].labels))
+        self.assertEqual(test.clean_up(), created)
+        self.assertFalse(Record.objects.filter(project="LoadTest").exists())
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("create=3, get"), {"create": 3.0, "get": 1.0})
+        self.assertRaises(ValueError, parse_mix, "create=3,fetch=1")
+        self.assertRaises(ValueError, parse_mix, "create=x")
+        self.assertRaises(ValueError, parse_mix, "create=0")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3.0], 90), 3.0)
+        self.assertEqual(percentile([], 50), None)
+
+
+class IdempotentPutTest(BaseTestCase):
+    def put(self, label, data, key):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": label})
+        return self.client.put(
+            rec_uri,
+            data=json.dumps(data),
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=key,
+            **self.extra
+        )
+
+    def new_record(self, label):
+        record = Record.objects.get(project="TestProject", label="20111013-172514")
+        data = RecordSerializer("application/json").to_dict(record, "TestProject")
+        data["label"] = label
+        return data
+
+    def test_retry_is_replayed(self):
+        data = self.new_record("retried")
+        response = self.put("retried", data, "abc")
+        self.assertEqual(response.status_code, CREATED)
+        response = self.put("retried", data, "abc")
+        self.assertEqual(response.status_code, CREATED)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(RecordRevision.objects.filter(label="retried").count(), 1)
+
+    def test_key_reused_for_different_request(self):
+        self.put("retried", self.new_record("retried"), "abc")
+        response = self.put("retried2", self.new_record("retried2"), "abc")
+        self.assertEqual(response.status_code, UNPROCESSABLE_ENTITY)
+        self.assertFalse(Record.objects.filter(label="retried2").exists())
+
+    def test_duplicate_shared_objects(self):
+        # duplicates which may have been created by concurrent writers in the past
+        executable = Record.objects.get(project="TestProject", label="20111013-172514").executable
+        executable.pk = None
+        executable.save()
+        response = self.put("with-duplicates", self.new_record("with-duplicates"), "def")
+        self.assertEqual(response.status_code, CREATED)
+
+    def test_new_shared_objects(self):
+        for label in ("new-executable", "new-executable2"):
+            data = self.new_record(label)
+            data["executable"]["version"] = "9.9.9"
+            self.assertEqual(self.put(label, data, label).status_code, CREATED)
+        self.assertEqual(Executable.objects.filter(version="9.9.9").count(), 1)
+        self.assertEqual(SharedObjectKey.objects.filter(model="django_store.executable").count(), 1)
+
+    def test_shared_object_created_concurrently(self):
+        attrs = {"path": "/usr/bin/python9", "version": "9.0", "name": "Python", "options": ""}
+        # another writer creates the object after the lookup by this one
+        other = get_or_create_shared(Executable, attrs)
+        with mock.patch("sumatra_server.ingest._lookup_shared", side_effect=[None, other]):
+            obj = get_or_create_shared(Executable, attrs)
+        self.assertEqual(obj, other)
+        self.assertEqual(Executable.objects.filter(path="/usr/bin/python9").count(), 1)
+
+    @override_settings(SUMATRA_IDEMPOTENCY_KEY_TIMEOUT=60)
+    def test_abandoned_request(self):
+        data = self.new_record("abandoned")
+        body = json.dumps(data).encode("utf-8")
+        path = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "abandoned"})
+        entry = IdempotencyKey.objects.create(
+            key="abc",
+            username="testuser",
+            fingerprint=hashlib.sha1(b"PUT" + path.encode("utf-8") + body).hexdigest(),
+        )
+        self.assertEqual(self.put("abandoned", data, "abc").status_code, CONFLICT)
+        IdempotencyKey.objects.filter(pk=entry.pk).update(
+            created=entry.created - timedelta(seconds=61)
+        )
+        self.assertEqual(self.put("abandoned", data, "abc").status_code, CREATED)
+        self.assertEqual(IdempotencyKey.objects.get(key="abc").status, CREATED)
+
+    @override_settings(SUMATRA_IDEMPOTENCY_KEY_EXPIRY=3600)
+    def test_expired_keys(self):
+        self.put("retried", self.new_record("retried"), "abc")
+        self.put("retried2", self.new_record("retried2"), "def")
+        IdempotencyKey.objects.filter(key="abc").update(
+            created=IdempotencyKey.objects.get(key="abc").created - timedelta(hours=2)
+        )
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("1 expired keys deleted", out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["def"])
+
+    def test_labels_unique_within_project(self):
+        record = Record.objects.get(project="TestProject", label="haggling")
+        record.pk = None
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            record.save()
+
+
+def _put(args):
+    """PUT a record from a separate client process; returns the status code."""
+    url, data, idempotency_key = args
+    headers = {
+        "Authorization": "Basic %s" % b64encode(b"testuser:abc123").decode("ascii"),
+        "Content-Type": "application/json",
+    }
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    request = Request(url, data=data.encode("utf-8"), headers=headers, method="PUT")
+    try:
+        with urlopen(request, timeout=60) as response:
+            return response.status
+    except HTTPError as err:
+        return err.code
+
+
+@skipUnlessDBFeature("has_select_for_update")  # SQLite does not support concurrent writers
+class ConcurrentIngestTest(LiveServerTestCase):
+    fixtures = ["haggling", "permissions"]
+    n_clients = 8
+
+    def test_parallel_PUT(self):
+        record = Record.objects.get(project="TestProject", label="20111013-172514")
+        data = RecordSerializer("application/json").to_dict(record, "TestProject")
+        # an executable and repository not yet in the database, created by the first writer
+        data["executable"]["version"] = "9.9.9"
+        data["repository"]["url"] = "/path/to/new/repository"
+        requests = []
+        for label in ("contested", "contested2"):
+            data["label"] = label
+            url = self.live_server_url + reverse(
+                "sumatra-record", kwargs={"project": "TestProject", "label": label}
+            )
+            body = json.dumps(data)
+            for i in range(self.n_clients):
+                # half of the clients are retries sharing the same Idempotency-Key
+                requests.append((url, body, "key-%s-%d" % (label, i % (self.n_clients // 2))))
+        with Pool(self.n_clients) as pool:
+            statuses = pool.map(_put, requests)
+
+        # a retry arriving while the original request is still being processed gets a 409
+        self.assertTrue(set(statuses).issubset({OK, CREATED, CONFLICT}), statuses)
+        self.assertEqual(statuses.count(CREATED), 2, statuses)
+        for label in ("contested", "contested2"):
+            self.assertEqual(Record.objects.filter(project="TestProject", label=label).count(), 1)
+            revisions = RecordRevision.objects.filter(project="TestProject", label=label)
+            self.assertEqual(list(revisions.values_list("action", flat=True)), ["create"])
+        # shared objects were not duplicated
+        self.assertEqual(Executable.objects.filter(version="9.9.9").count(), 1)
+        self.assertEqual(Repository.objects.filter(url="/path/to/new/repository").count(), 1)
+
+
+class BlobTest(BaseTestCase):
+    content = b"0123456789" * 1000
+
+    def setUp(self):
+        super(BlobTest, self).setUp()
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.settings_override = override_settings(SUMATRA_BLOB_ROOT=self.root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.digest = hashlib.sha1(self.content).hexdigest()
+        DataKey.objects.create(
+            path="results/output.dat",
+            digest=self.digest,
+            metadata="{}",
+            output_from_record=Record.objects.get(label="haggling"),
+        )
+        self.uri = reverse("sumatra-blob", kwargs={"project": "TestProject", "digest": self.digest})
+
+    def put(self, data, uri=None, **headers):
+        headers.update(self.extra)
+        return self.client.put(
+            uri or self.uri, data=data, content_type="application/octet-stream", **headers
+        )
+
+    def test_upload_and_download(self):
+        self.assertEqual(self.client.get(self.uri, **self.extra).status_code, NOT_FOUND)
+        self.assertEqual(self.put(self.content).status_code, CREATED)
+        path = os.path.join(self.root, self.digest[:2], self.digest[2:4], self.digest)
+        self.assertTrue(os.path.exists(path))
+        # the same content is only stored once
+        self.assertEqual(self.put(self.content).status_code, OK)
+        response = self.client.get(self.uri, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertIn("output.dat", response["Content-Disposition"])
+
+    def test_range(self):
+        self.put(self.content)
+        response = self.client.get(self.uri, HTTP_RANGE="bytes=5-14", **self.extra)
+        self.assertEqual(response.status_code, PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"5678901234")
+        self.assertEqual(response["Content-Range"], "bytes 5-14/10000")
+        response = self.client.get(self.uri, HTTP_RANGE="bytes=-3", **self.extra)
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+        response = self.client.get(self.uri, HTTP_RANGE="bytes=20000-", **self.extra)
+        self.assertEqual(response.status_code, RANGE_NOT_SATISFIABLE)
+
+    def test_wrong_content(self):
+        self.assertEqual(self.put(b"something else").status_code, BAD_REQUEST)
+        self.assertEqual(self.client.get(self.uri, **self.extra).status_code, NOT_FOUND)
+
+    def test_resumable_upload(self):
+        response = self.put(self.content[:4000], HTTP_CONTENT_RANGE="bytes 0-3999/10000")
+        self.assertEqual(response.status_code, PERMANENT_REDIRECT)
+        self.assertEqual(response["Range"], "bytes=0-3999")
+        # a part which does not follow on from those already received
+        response = self.put(self.content[5000:], HTTP_CONTENT_RANGE="bytes 5000-9999/10000")
+        self.assertEqual(response.status_code, CONFLICT)
+        # after an interruption, the client asks how much was received
+        response = self.put(b"", HTTP_CONTENT_RANGE="bytes */10000")
+        self.assertEqual(response["Range"], "bytes=0-3999")
+        response = self.put(self.content[4000:], HTTP_CONTENT_RANGE="bytes 4000-9999/10000")
+        self.assertEqual(response.status_code, CREATED)
+        response = self.client.get(self.uri, **self.extra)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_part_longer_than_range(self):
+        self.put(self.content[:4000], HTTP_CONTENT_RANGE="bytes 0-3999/10000")
+        response = self.put(self.content[4000:], HTTP_CONTENT_RANGE="bytes 4000-4999/10000")
+        self.assertEqual(response.status_code, BAD_REQUEST)
+        # the part is discarded, so the upload can be completed
+        self.assertEqual(response["Range"], "bytes=0-3999")
+        response = self.put(self.content[4000:], HTTP_CONTENT_RANGE="bytes 4000-10000/10000")
+        self.assertEqual(response.status_code, BAD_REQUEST)
+        response = self.put(self.content[4000:], HTTP_CONTENT_RANGE="bytes 4000-9999/10000")
+        self.assertEqual(response.status_code, CREATED)
+
+    def test_archived_record(self):
+        self.put(self.content)
+        archive_record(Record.objects.get(label="haggling"))
+        response = self.client.get(self.uri, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertIn("output.dat", response["Content-Disposition"])
+
+    def test_unknown_digest(self):
+        uri = reverse("sumatra-blob", kwargs={"project": "TestProject", "digest": "a" * 40})
+        self.assertEqual(self.put(b"abc", uri=uri).status_code, NOT_FOUND)
+
+    def test_disabled(self):
+        with override_settings(SUMATRA_BLOB_ROOT=None):
+            self.assertEqual(self.put(self.content).status_code, NOT_FOUND)
+
+
+class ThrottlingTest(BaseTestCase):
+    def setUp(self):
+        super(ThrottlingTest, self).setUp()
+        cache.clear()
+
+    def put(self, label="haggling"):
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": label})
+        data = {"reason": "", "outcome": "", "tags": []}
+        return self.client.put(
+            rec_uri, data=json.dumps(data), content_type="application/json", **self.extra
+        )
+
+    def test_unlimited_by_default(self):
+        for i in range(10):
+            self.assertEqual(self.put().status_code, OK)
+
+    @override_settings(SUMATRA_USER_RATE_LIMIT=(0.1, 2))
+    def test_user_rate_limit(self):
+        self.assertEqual(self.put().status_code, OK)
+        self.assertEqual(self.put("haggling_repeat").status_code, OK)
+        response = self.put()
+        self.assertEqual(response.status_code, TOO_MANY_REQUESTS)
+        self.assertTrue(1 <= int(response["Retry-After"]) <= 10)
+        counters = throttle_counters()
+        self.assertEqual(counters["allowed"], 2)
+        self.assertEqual(counters["throttled_user"], 1)
+
+    @override_settings(SUMATRA_PROJECT_RATE_LIMIT=(0.1, 1))
+    def test_project_rate_limit(self):
+        self.assertEqual(self.put().status_code, OK)
+        self.assertEqual(self.put().status_code, TOO_MANY_REQUESTS)
+        self.assertEqual(throttle_counters()["throttled_project"], 1)
+
+    @override_settings(SUMATRA_MAX_CONCURRENT_WRITES=2)
+    def test_concurrency_cap(self):
+        cache.set("sumatra-throttle-writes", 2)  # as if two writes were in progress
+        response = self.put()
+        self.assertEqual(response.status_code, SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "1")
+        cache.decr("sumatra-throttle-writes")
+        self.assertEqual(self.put().status_code, OK)
+        self.assertEqual(cache.get("sumatra-throttle-writes"), 1)
+
+    @override_settings(SUMATRA_MAX_CONCURRENT_WRITES=1)
+    def test_concurrency_count_kept_while_writes_start(self):
+        start = time.time()
+        with mock.patch("time.time") as clock:
+            clock.return_value = start
+            acquire_write_slot("testuser", "TestProject")  # a long write
+            for t in (200, 400):
+                clock.return_value = start + t
+                self.assertRaises(Throttled, acquire_write_slot, "testuser", "TestProject")
+            release_write_slot()
+            # a write which started before the count was last forgotten
+            release_write_slot()
+            self.assertEqual(cache.get("sumatra-throttle-writes"), 0)
+            acquire_write_slot("testuser", "TestProject")
+            self.assertEqual(cache.get("sumatra-throttle-writes"), 1)
+
+    def test_command(self):
+        self.put()
+        out = StringIO()
+        call_command("throttle_stats", stdout=out)
+        self.assertIn("allowed: 1", out.getvalue())
+
+
+class ProjectCacheTest(BaseTestCase):
+    def test_permission_check_cached(self):
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        self.client.get(prj_uri, **self.extra)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(prj_uri, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        self.assertFalse(
+            any("projectpermission" in query["sql"] for query in context.captured_queries)
+        )
+
+    def test_invalidated_by_permission_change(self):
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        other = User.objects.create_user("otheruser", password="def456")
+        extra = {"HTTP_AUTHORIZATION": "Basic %s" % b64encode(b"otheruser:def456").decode("ascii")}
+        self.assertEqual(self.client.get(prj_uri, **extra).status_code, 403)
+        permission = Project.objects.get(id="TestProject").projectpermission_set.create(user=other)
+        self.assertEqual(self.client.get(prj_uri, **extra).status_code, OK)
+        permission.delete()
+        self.assertEqual(self.client.get(prj_uri, **extra).status_code, 403)
+
+    def test_stale_metadata_not_cached(self):
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        other = User.objects.create_user("otheruser", password="def456")
+        extra = {"HTTP_AUTHORIZATION": "Basic %s" % b64encode(b"otheruser:def456").decode("ascii")}
+        permission = Project.objects.get(id="TestProject").projectpermission_set.create(user=other)
+        # a request reads the metadata, then a permission is revoked before it stores it
+        key = "%s-%s" % (projectcache.cache_key, projectcache._generation())
+        projects = projectcache.load_projects()
+        permission.delete()
+        cache.set(key, projects)
+        projectcache._local.clear()
+        self.assertEqual(self.client.get(prj_uri, **extra).status_code, 403)
+
+    def test_timeout(self):
+        # the local-memory cache of the test settings is not shared between processes
+        with override_settings(SUMATRA_PROJECT_CACHE_LOCAL_TIMEOUT=7):
+            self.assertEqual(projectcache.cache_timeout(), 7)
+            # any other backend is taken to be shared
+            shared = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+            with override_settings(CACHES=shared, SUMATRA_PROJECT_CACHE_TIMEOUT=600):
+                self.assertEqual(projectcache.cache_timeout(), 600)
+
+    def test_invalidated_by_username_change(self):
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        self.assertEqual(self.client.get(prj_uri, **self.extra).status_code, OK)
+        user = User.objects.get(username="testuser")
+        user.username = "renameduser"
+        user.save()
+        extra = {"HTTP_AUTHORIZATION": "Basic %s" % b64encode(b"renameduser:abc123").decode("ascii")}
+        self.assertEqual(self.client.get(prj_uri, **extra).status_code, OK)
+
+    def test_invalidated_by_project_PUT(self):
+        prj_uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        self.client.get(prj_uri, **self.extra)
+        response = self.client.put(
+            prj_uri,
+            data=json.dumps({"name": "Renamed"}),
+            content_type="application/json",
+            **self.extra
+        )
+        self.assertEqual(response.status_code, OK)
+        data = json.loads(self.client.get(prj_uri, **self.extra).content)
+        self.assertEqual(data["name"], "Renamed")
+
+
+class QueryCountTest(BaseTestCase):
+    """
+    Each endpoint should run a fixed number of SQL queries, however many
+    projects, records or users are in the database.
+    """
+
+    def count_queries(self, uri, params=None):
+        self.client.get(uri, params or {}, **self.extra)  # fill the project cache
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(uri, params or {}, **self.extra)
+        self.assertEqual(response.status_code, OK)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, uri, max_queries, params=None, grow=None):
+        before = self.count_queries(uri, params)
+        self.assertLessEqual(before, max_queries)
+        grow()
+        after = self.count_queries(uri, params)
+        self.assertEqual(before, after)
+
+    def add_projects(self, n=5):
+        user = User.objects.get(username="testuser")
+        template = Record.objects.get(label="haggling")
+        for i in range(n):
+            project = Project.objects.create(id="QueryCountProject%d" % i)
+            project.projectpermission_set.create(user=user)
+            record = Record.objects.get(pk=template.pk)
+            record.pk = None
+            record.project = project
+            record.save()
+
+    def add_records(self, n=5):
+        template = Record.objects.get(label="haggling")
+        for i in range(n):
+            record = Record.objects.get(pk=template.pk)
+            record.pk = None
+            record.label = "query-count-%d" % i
+            record.save()
+            record.dependencies.set(template.dependencies.all())
+            record.platforms.set(template.platforms.all())
+
+    def add_users(self, n=5):
+        project = Project.objects.get(id="TestProject")
+        for i in range(n):
+            user = User.objects.create(username="querycount%d" % i)
+            project.projectpermission_set.create(user=user)
+
+    def test_project_list(self):
+        uri = reverse("sumatra-project-list")
+        self.assertConstantQueries(uri, 2, grow=self.add_projects)
+
+    def test_project(self):
+        uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        self.assertConstantQueries(uri, 2, grow=lambda: (self.add_records(), self.add_users()))
+
+    def test_permission_list(self):
+        uri = reverse("sumatra-project-permissions", kwargs={"project": "TestProject"})
+        self.assertConstantQueries(uri, 1, grow=self.add_users)
+
+    def test_record(self):
+        uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        self.assertConstantQueries(uri, 7, grow=self.add_records)
+
+    def test_project_facets(self):
+        uri = reverse("sumatra-project", kwargs={"project": "TestProject"})
+        self.assertConstantQueries(
+            uri,
+            3,
+            {"facets": ""},
+            grow=lambda: (self.add_records(), rebuild_facets("TestProject")),
+        )
+
+
+class StartupTest(BaseTestCase):
+    def test_record_without_version_control(self):
+        # serializing a record should not run the version control tool
+        rec_uri = reverse("sumatra-record", kwargs={"project": "TestProject", "label": "haggling"})
+        with mock.patch.object(Repository, "to_sumatra", side_effect=AssertionError):
+            response = self.client.get(rec_uri, **self.extra)
+            self.assertEqual(response.status_code, OK)
+            html_response = self.client.get(rec_uri, {"format": "html"}, **self.extra)
+            self.assertEqual(html_response.status_code, OK)
+        repository = Record.objects.get(label="haggling").repository
+        self.assertEqual(
+            json.loads(response.content)["repository"],
+            {"type": repository.type, "url": repository.url, "upstream": repository.upstream},
+        )
+
+    def test_warm_up(self):
+        warm_up()
+
+    def test_parse_importtime(self):
+        lines = [
+            marker + "django.setup()",
+            "import time: self [us] | cumulative | imported package",
+            "import time:       150 |        150 |     json.decoder",
+            "import time:       200 |        350 |   json",
+            marker + "URLconf",
+            "import time:      1000 |       1000 | sumatra_server.views",
+        ]
+        self.assertEqual(
+            parse_importtime(lines),
+            [
+                ("json.decoder", 0.00015, 0.00015, "django.setup()"),
+                ("json", 0.0002, 0.00035, "django.setup()"),
+                ("sumatra_server.views", 0.001, 0.001, "URLconf"),
+            ],
+        )
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("startup_benchmark", "--json", "--top=5", stdout=out)
+        results = json.loads(out.getvalue())
+        phases = [phase["phase"] for phase in results["phases"]]
+        self.assertEqual(phases, ["django.setup()", "URLconf"])
+        self.assertEqual(len(results["modules"]), 5)
+
+
 class UtilityFunctionTest(TestCase):
     def test_parse_accept_header(self):
         example_safari = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
@@ -364,11 +1899,40 @@ class UtilityFunctionTest(TestCase):
         example_chrome = "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9"
         expected = [
             "text/html",
+            "application/xhtml+xml",
             "image/webp",
             "image/apng",
-            "application/xhtml+xml",
-            "application/signed-exchange",
             "application/xml",
+            "application/signed-exchange",
             "*/*",
         ]
         self.assertEqual(parse_accept_header(example_chrome), expected)
+
+        self.assertEqual(parse_accept_header(""), [])
+        self.assertRaises(NegotiationError, parse_accept_header, "text/html;q=high")
+        self.assertRaises(NegotiationError, parse_accept_header, "text/html;q=1.5")
+        self.assertRaises(NegotiationError, parse_accept_header, "*/json")
+
+    def test_negotiate(self):
+        available = ("application/vnd.sumatra.record-v4+json", "application/json", "text/html")
+        self.assertEqual(negotiate("", available), available[0])
+        self.assertEqual(negotiate("*/*", available), available[0])
+        self.assertEqual(negotiate("text/html, application/json", available), "text/html")
+        self.assertEqual(negotiate("application/*", available), available[0])
+        self.assertEqual(
+            negotiate("application/*;q=0.5, application/json", available), "application/json"
+        )
+        self.assertEqual(negotiate("application/*;q=0.5, text/*", available), "text/html")
+        self.assertEqual(negotiate("*/*;q=0.1, application/json;q=0", available), available[0])
+        self.assertEqual(negotiate("text/*;q=0.1, application/*;q=0", available), "text/html")
+        self.assertEqual(
+            negotiate("application/json; charset=utf-8", available), "application/json"
+        )
+        self.assertIsNone(negotiate("image/png", available))
+
+    def test_negotiate_cached(self):
+        available = ("application/json", "text/html")
+        negotiate("text/html;level=1;q=0.7, application/json;q=0.3", available)
+        hits = negotiate.cache_info().hits
+        negotiate("text/html;level=1;q=0.7, application/json;q=0.3", available)
+        self.assertEqual(negotiate.cache_info().hits, hits + 1)
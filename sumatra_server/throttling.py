@@ -0,0 +1,130 @@
+"""
+Admission control for the endpoints which write records: token-bucket rate
+limits for each user and each project, and a cap on the number of writes
+in progress at once.
+
+The state of the limiters is kept in the Django cache, so that the limits
+apply across all server processes when a shared cache backend is used.
+Reading and updating a bucket is not atomic, so under heavy contention a
+few more requests than the limit may be let through.
+
+Limits are set with the following settings, all of which are disabled by
+default:
+
+``SUMATRA_USER_RATE_LIMIT``, ``SUMATRA_PROJECT_RATE_LIMIT``
+    a (rate, burst) tuple: requests are allowed at an average of `rate` per
+    second, with up to `burst` requests at once.
+``SUMATRA_MAX_CONCURRENT_WRITES``
+    the largest number of writes which may be in progress at once.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import math
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+
+counter_names = ("allowed", "throttled_user", "throttled_project", "rejected_concurrency")
+# the count of writes in progress is forgotten if no write starts for this long, in case
+# a process died without releasing its slot
+slot_timeout = 300
+
+
+class Throttled(Exception):
+    """Raised when a request is not admitted, with the time to wait before retrying."""
+
+    def __init__(self, message, retry_after, status=429):
+        super(Throttled, self).__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.status = status
+
+
+class TokenBucket(object):
+    """A bucket holding up to `burst` tokens, refilled at `rate` tokens per second."""
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = float(rate)
+        self.burst = burst
+
+    def consume(self, now=None):
+        """
+        Take a token from the bucket. Returns 0 if one was available,
+        otherwise the number of seconds until the next token.
+        """
+        if now is None:
+            now = time.time()
+        tokens, last = cache.get(self.key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / self.rate
+        # once full, a bucket can be forgotten
+        cache.set(self.key, (tokens, now), int(math.ceil(self.burst / self.rate)) + 1)
+        return wait
+
+
+def _count(name):
+    key = "sumatra-throttle-count:%s" % name
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted in the meantime
+        cache.set(key, 1, None)
+
+
+def throttle_counters():
+    """The number of write requests admitted and refused, for monitoring."""
+    keys = dict(("sumatra-throttle-count:%s" % name, name) for name in counter_names)
+    values = cache.get_many(list(keys))
+    return dict((name, values.get(key, 0)) for key, name in keys.items())
+
+
+def _check_rate(kind, name):
+    limit = getattr(settings, "SUMATRA_%s_RATE_LIMIT" % kind.upper(), None)
+    if limit:
+        rate, burst = limit
+        wait = TokenBucket("sumatra-throttle:%s:%s" % (kind, name), rate, burst).consume()
+        if wait:
+            _count("throttled_%s" % kind)
+            raise Throttled("Too many requests for this %s" % kind, wait)
+
+
+def acquire_write_slot(username, project_id):
+    """
+    Admit a write request, or raise Throttled. Every call which does not
+    raise must be followed by a call to release_write_slot().
+    """
+    _check_rate("user", username)
+    _check_rate("project", project_id)
+    max_writes = getattr(settings, "SUMATRA_MAX_CONCURRENT_WRITES", None)
+    if max_writes:
+        cache.add("sumatra-throttle-writes", 0, slot_timeout)
+        try:
+            in_progress = cache.incr("sumatra-throttle-writes")
+        except ValueError:
+            cache.set("sumatra-throttle-writes", 1, slot_timeout)
+            in_progress = 1
+        else:
+            cache.touch("sumatra-throttle-writes", slot_timeout)
+        if in_progress > max_writes:
+            release_write_slot()
+            _count("rejected_concurrency")
+            raise Throttled("Too many writes in progress", 1, status=503)
+    _count("allowed")
+
+
+def release_write_slot():
+    if getattr(settings, "SUMATRA_MAX_CONCURRENT_WRITES", None):
+        try:
+            in_progress = cache.decr("sumatra-throttle-writes")
+        except ValueError:
+            return
+        if in_progress < 0:
+            # the count was forgotten while this write was in progress
+            cache.set("sumatra-throttle-writes", 0, slot_timeout)
@@ -11,6 +11,11 @@ from sumatra_server.views import (
     ProjectResource,
     ProjectListResource,
     PermissionListResource,
+    RevisionListResource,
+    RecordBatchResource,
+    ProjectStatsResource,
+    RecordComparisonResource,
+    BlobResource,
 )
 
 urlpatterns = [
@@ -21,6 +26,36 @@ urlpatterns = [
         PermissionListResource.as_view(),
         name="sumatra-project-permissions",
     ),
+    url(
+        r"^(?P<project>[^/]+)/changes/$",
+        RevisionListResource.as_view(),
+        name="sumatra-project-changes",
+    ),
+    url(
+        r"^(?P<project>[^/]+)/stats/$",
+        ProjectStatsResource.as_view(),
+        name="sumatra-project-stats",
+    ),
+    url(
+        r"^(?P<project>[^/]+)/compare/$",
+        RecordComparisonResource.as_view(),
+        name="sumatra-record-comparison",
+    ),
+    url(
+        r"^(?P<project>[^/]+)/batch/$",
+        RecordBatchResource.as_view(),
+        name="sumatra-record-batch",
+    ),
+    url(
+        r"^(?P<project>[^/]+)/blobs/(?P<digest>[0-9a-f]{40})/$",
+        BlobResource.as_view(),
+        name="sumatra-blob",
+    ),
+    url(
+        r"^(?P<project>[^/]+)/(?P<label>\w+[\w|\-\.]*)/history/$",
+        RevisionListResource.as_view(),
+        name="sumatra-record-history",
+    ),
     url(
         r"^(?P<project>[^/]+)/(?P<label>\w+[\w|\-\.]*)/$",
         RecordResource.as_view(),
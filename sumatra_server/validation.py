@@ -0,0 +1,194 @@
+"""
+Decoding and validation of the record documents sent with PUT requests.
+
+Documents are checked against the fields of the django_store models before
+anything is written to the database, so that a malformed record is rejected
+as a whole, with a list of the problems found, rather than failing part way
+through being stored.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from sumatra.recordstore.django_store.models import Record, DataKey
+from tagging import settings as tagging_settings
+from .ingest import updatable_fields
+
+
+max_errors = 20  # stop checking a document after this many problems
+# labels which are the names of project resources (see urls.py), so that the
+# record URL for them would give the resource instead
+reserved_labels = ("permissions", "changes", "stats", "compare", "batch")
+
+
+class RecordValidationError(ValueError):
+    """
+    Raised for a request body which cannot be stored as a record. `errors`
+    is a list of dicts giving the path to each invalid value and a message.
+    """
+
+    def __init__(self, errors, status=400):
+        super(RecordValidationError, self).__init__("; ".join(e["message"] for e in errors))
+        self.errors = errors
+        self.status = status
+
+
+def max_record_size():
+    """The largest request body accepted, in bytes, or None for no limit."""
+    return getattr(settings, "SUMATRA_MAX_RECORD_SIZE", settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+
+
+def check_body_size(request):
+    """
+    Reject a request whose Content-Length is over the limit, before its body
+    is read.
+    """
+    limit = max_record_size()
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if limit is not None and length > limit:
+        raise RecordValidationError(
+            [{"field": None, "message": "Request body is larger than %d bytes" % limit}],
+            status=413,
+        )
+
+
+def decode_body(request):
+    """Decode the JSON body of a request, which must be an object."""
+    check_body_size(request)
+    try:
+        attrs = json.loads(request.body)
+    except ValueError as err:
+        raise RecordValidationError([{"field": None, "message": "Invalid JSON: %s" % err}])
+    if not isinstance(attrs, dict):
+        raise RecordValidationError([{"field": None, "message": "Expected a JSON object"}])
+    return attrs
+
+
+class _Validator(object):
+    def __init__(self):
+        self.errors = []
+
+    def error(self, path, message):
+        self.errors.append({"field": path, "message": message})
+        if len(self.errors) >= max_errors:
+            raise RecordValidationError(self.errors)
+
+    def check_value(self, field, value, path):
+        if value is None:
+            if not field.null:
+                self.error(path, "May not be null")
+            return
+        if not isinstance(field, (models.CharField, models.TextField)):
+            # text fields accept any value, and store its string representation
+            try:
+                value = field.to_python(value)
+            except ValidationError as err:
+                self.error(path, " ".join(err.messages))
+                return
+        if field.max_length and len(str(value)) > field.max_length:
+            self.error(path, "Longer than %d characters" % field.max_length)
+
+    def check_object(self, model, value, path):
+        """
+        Check a JSON object giving the attributes of an instance of `model`,
+        which must include every field which may be neither null nor blank,
+        and has no default.
+        """
+        if not isinstance(value, dict):
+            self.error(path, "Expected an object")
+            return
+        if not value:
+            self.error(path, "May not be empty")
+            return
+        fields = dict(
+            (field.name, field)
+            for field in model._meta.fields
+            if not (field.primary_key or field.is_relation)
+        )
+        for name, item in value.items():
+            if name in fields:
+                self.check_value(fields[name], item, "%s.%s" % (path, name))
+            else:
+                self.error("%s.%s" % (path, name), "Unknown field")
+        for name, field in fields.items():
+            if not (field.null or field.blank or field.has_default()) and name not in value:
+                self.error("%s.%s" % (path, name), "This field is required")
+
+    def check_list(self, model, value, path):
+        if not isinstance(value, list):
+            self.error(path, "Expected a list")
+            return
+        for i, item in enumerate(value):
+            self.check_object(model, item, "%s[%d]" % (path, i))
+
+    def check_tags(self, value, path="tags"):
+        if not isinstance(value, list) or not all(isinstance(tag, str) for tag in value):
+            self.error(path, "Expected a list of strings")
+            return
+        for i, tag in enumerate(value):
+            if len(tag) > tagging_settings.MAX_TAG_LENGTH:
+                self.error(
+                    "%s[%d]" % (path, i),
+                    "Longer than %d characters" % tagging_settings.MAX_TAG_LENGTH,
+                )
+        # the tags are stored in one column, separated by commas
+        max_length = Record._meta.get_field("tags").max_length
+        if len(",".join(value)) > max_length:
+            self.error(path, "Longer than %d characters in total" % max_length)
+
+    def required(self, attrs, name):
+        if name not in attrs:
+            self.error(name, "This field is required")
+            return False
+        return True
+
+
+def validate_record(attrs, label):
+    """
+    Check that `attrs` contains everything needed to create the record with
+    the given `label`. Raises RecordValidationError listing any problems.
+    """
+    validator = _Validator()
+    if attrs.get("label") != label:
+        validator.error("label", "Does not match the label in the URL ('%s')" % label)
+    elif label in reserved_labels:
+        validator.error("label", "'%s' is reserved, and may not be used as a label" % label)
+    else:
+        validator.check_value(Record._meta.get_field("label"), label, "label")
+    for field in Record._meta.fields:
+        if field.name in ("project", "label", "db_id", "tags"):
+            continue
+        if validator.required(attrs, field.name):
+            if isinstance(field, models.ForeignKey):
+                validator.check_object(field.remote_field.model, attrs[field.name], field.name)
+            else:
+                validator.check_value(field, attrs[field.name], field.name)
+    for field in Record._meta.many_to_many:
+        if validator.required(attrs, field.name):
+            validator.check_list(field.remote_field.model, attrs[field.name], field.name)
+    if validator.required(attrs, "output_data"):
+        validator.check_list(DataKey, attrs["output_data"], "output_data")
+    if validator.required(attrs, "tags"):
+        validator.check_tags(attrs["tags"])
+    if validator.errors:
+        raise RecordValidationError(validator.errors)
+
+
+def validate_update(attrs):
+    """Check that `attrs` contains the fields which may be changed in an existing record."""
+    validator = _Validator()
+    for name in updatable_fields:
+        if validator.required(attrs, name):
+            validator.check_value(Record._meta.get_field(name), attrs[name], name)
+    if validator.required(attrs, "tags"):
+        validator.check_tags(attrs["tags"])
+    if validator.errors:
+        raise RecordValidationError(validator.errors)
@@ -6,10 +6,18 @@ Sumatra Server
 """
 
 
+import hashlib
 import json
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+from django.conf import settings
 from django.http import (
     HttpResponse,
     JsonResponse,
+    FileResponse,
+    StreamingHttpResponse,
     HttpResponseBadRequest,  # 400
     HttpResponseForbidden,  # 403
     HttpResponseNotFound,  # 404
@@ -18,216 +26,384 @@ from django.http import (
     HttpResponseRedirect,
 )  # 302
 from django.views.generic import View
-from django.db.models import ForeignKey
+from django.db import transaction, IntegrityError
+from django.db.models import Max, Q
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
-from sumatra.recordstore.django_store.models import Project, Record
+from sumatra.recordstore.django_store.models import Project, Record, DataKey
 from .serializers import (
     RecordSerializer,
     ProjectSerializer,
     ProjectListSerializer,
     PermissionListSerializer,
+    RevisionListSerializer,
+    RecordBatchSerializer,
+    ProjectStatsSerializer,
+    RecordComparisonSerializer,
+    with_related,
 )
 from .authentication import AuthenticationDispatcher
+from .negotiation import (
+    NegotiationError,
+    media_type_abbreviations,
+    negotiate,
+)
 from .forms import PermissionsForm
+from .models import (
+    RecordRevision,
+    RevisionCounter,
+    IdempotencyKey,
+    ArchivedRecord,
+    ArchivedDataKey,
+)
+from .ingest import create_record, update_record, delete_record
+from .archive import restore_if_archived
+from .stats import cached_project_statistics, default_bins, max_bins
+from .compare import compare_records
+from .projectcache import get_project, project_index
+from .fieldsets import FieldsetError, parse_fields, record_summaries, document_summary
+from .blobs import BlobError, get_blob_store
+from .permissions import AccessChangeError, change_access
+from .facets import FacetError, parse_facets, project_facets
+from .throttling import Throttled, acquire_write_slot, release_write_slot
+from .validation import (
+    RecordValidationError,
+    check_body_size,
+    decode_body,
+    validate_record,
+    validate_update,
+)
 
 
 class HttpResponseNotAcceptable(HttpResponse):
     status_code = 406
 
 
-media_type_abbreviations = {
-    "html": "text/html",
-    "json": "application/json",
-    "record-v3+json": "application/vnd.sumatra.record-v3+json",
-    "project-v3+json": "application/vnd.sumatra.project-v3+json",
-    "project-list-v3+json": "application/vnd.sumatra.project-list-v3+json",
-    "record-v4+json": "application/vnd.sumatra.record-v4+json",
-    "project-v4+json": "application/vnd.sumatra.project-v4+json",
-    "project-list-v4+json": "application/vnd.sumatra.project-list-v4+json",
-}
+def filter_records(records, params):
+    """Apply the filters given in the query string to a queryset of records."""
+    tags = params.get("tags", None)
+    if tags:
+        records = records.filter(tags__contains=tags)
+    return records
+
+
+def requested_labels(params):
+    """The record labels given as a comma-separated list in the query string."""
+    return [label for label in params.get("labels", "").split(",") if label]
+
+
+def requested_fields(params):
+    """The sparse fieldset given in the query string, or None for full records."""
+    if "fields" not in params:
+        return None
+    return parse_fields(params["fields"])
 
 
-def keys2str(D):
-    """Keywords cannot be unicode."""  # unnecessary for Python 3?
-    E = {}
-    for k, v in D.items():
-        E[str(k)] = v
-    return E
+def record_etag(project, label, representation=None):
+    """
+    The entity tag of a record: its latest revision, followed, if given, by a
+    hash of the `representation` (media type and fieldset) being returned,
+    since each has different content. None for a record stored before
+    revisions were kept.
+    """
+    revision = RecordRevision.objects.latest_for_record(project, label)
+    if revision is None:
+        return None
+    if representation is None:
+        return '"%d"' % revision
+    digest = hashlib.sha1(representation.encode("utf-8")).hexdigest()[:8]
+    return '"%d-%s"' % (revision, digest)
+
+
+def etag_matches(header, etag):
+    """
+    Check an If-Match or If-None-Match header against an entity tag, which
+    is None for a record stored before revisions were kept, matching only "*".
+    """
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or (etag is not None and (etag in tags or "W/" + etag in tags))
+
+
+def revision_matches(header, etag):
+    """
+    Check an If-Match header against the entity tag of a record, ignoring the
+    representation, so that the tag returned by any GET of the record matches.
+    """
+    if not header:
+        return False
+    tags = [tag.strip().replace("W/", "").strip('"') for tag in header.split(",")]
+    revisions = [tag.split("-")[0] for tag in tags]
+    return "*" in revisions or (etag is not None and etag.strip('"') in revisions)
 
 
 def flatten_dict(dct):
     return dict([(str(k), dct.get(k)) for k in dct.keys()])
 
 
-def check_permissions(func):
+def check_permissions(func, allow_public=True):
     def wrapper(self, request, *args, **kwargs):
         # if the resource is public (accessible to anonymous), continue
-        try:
-            project = Project.objects.get(id=kwargs["project"])
-        except Project.DoesNotExist:
+        project = get_project(kwargs["project"])
+        if project is None:
             return HttpResponseNotFound()
         auth = AuthenticationDispatcher()
         authenticated = auth.is_authenticated(request)
         if not request.user.username:
             request.user.username = "anonymous"
-        if project.projectpermission_set.filter(user__username="anonymous").count() == 0:
+        if not (allow_public and project.public):
             # if the user is not authenticated, redirect to authentication
             if not authenticated:
                 return auth.challenge()
             # check if the user is authorized
-            if (
-                request.user.projectpermission_set.filter(project__id=kwargs["project"]).count()
-                == 0
-            ):
+            if request.user.username not in project.access:
                 return HttpResponseForbidden()
         return func(self, request, *args, **kwargs)
 
     return wrapper
 
 
-def parse_accept_header(accept):
-    accepted_media_types = []
-    if accept:
-        qualities = []
-        for mtwq in accept.split(","):
-            if ";" in mtwq:
-                parts = mtwq.split(";")
-                if len(parts) == 2:
-                    mt, q = parts
-                else:
-                    mt = parts[0]
-                    for part in parts[1:]:
-                        if "q" in part:
-                            q = part
-                            break
-                    q = "q=1"
-            else:
-                mt, q = mtwq, "q=1"
-            accepted_media_types.append(mt.strip())
-            qualities.append(float(q.split("=")[1]))
-        accepted_media_types = [
-            mt for q, mt in sorted(zip(qualities, accepted_media_types), reverse=True)
-        ]
-    return accepted_media_types
+def check_access(func):
+    """
+    As check_permissions(), but requiring an authenticated user with access
+    even to a public project, e.g. to change who has access to it.
+    """
+    return check_permissions(func, allow_public=False)
 
 
-def get_accepted_media_types(request):
-    if "format" in request.GET:
-        # 'format' in the URL over-rides the Accept header
-        abbrev = request.GET["format"]
-        accepted_media_types = [media_type_abbreviations[abbrev]]
-    else:
-        # get mimetype from Accept header
-        if "HTTP_ACCEPT" in request.META:
-            accept = request.META["HTTP_ACCEPT"]
-        elif "Accept" in request.META:
-            accept = request.META["Accept"]
+def limit_body_size(func):
+    """Reject requests with an over-large body before the body is read."""
+
+    def wrapper(self, request, *args, **kwargs):
+        check_body_size(request)
+        return func(self, request, *args, **kwargs)
+
+    return wrapper
+
+
+def throttled(func):
+    """
+    Apply the rate limits and the cap on concurrent writes, responding with
+    429 or 503 and a Retry-After header if the request is not admitted.
+    """
+
+    def wrapper(self, request, *args, **kwargs):
+        try:
+            acquire_write_slot(request.user.username, kwargs["project"])
+        except Throttled as err:
+            response = HttpResponse(str(err), status=err.status)
+            response["Retry-After"] = "%d" % err.retry_after
+            return response
+        try:
+            return func(self, request, *args, **kwargs)
+        finally:
+            release_write_slot()
+
+    return wrapper
+
+
+def idempotent(func):
+    """
+    Support for the Idempotency-Key request header: the response to the first
+    request with a given key is stored, and returned again if the client
+    retries with the same key, without repeating the operation. Expired keys
+    are replaced (see IdempotencyKeyManager.expired()).
+    """
+
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+        if not key:
+            return func(self, request, *args, **kwargs)
+        fingerprint = hashlib.sha1(
+            request.method.encode("utf-8") + request.path.encode("utf-8") + request.body
+        ).hexdigest()
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.expired().filter(
+                    key=key, username=request.user.username
+                ).delete()
+                entry = IdempotencyKey.objects.create(
+                    key=key, username=request.user.username, fingerprint=fingerprint
+                )
+        except IntegrityError:
+            entry = IdempotencyKey.objects.get(key=key, username=request.user.username)
+            if entry.fingerprint != fingerprint:
+                return HttpResponse(
+                    "Idempotency-Key has already been used for a different request", status=422
+                )
+            if entry.status is None:
+                return HttpResponse(
+                    "A request with this Idempotency-Key is in progress", status=409
+                )
+            response = HttpResponse(bytes(entry.content), status=entry.status)
+            response["Idempotent-Replayed"] = "true"
+            return response
+        try:
+            response = func(self, request, *args, **kwargs)
+        except Exception:
+            entry.delete()
+            raise
+        if response.status_code >= 500:
+            entry.delete()  # let the client retry
         else:
-            accept = ""
-        accepted_media_types = parse_accept_header(accept)
-    return accepted_media_types
+            # an update rather than save(), since the entry may have expired and
+            # been replaced by a retry if this request took too long
+            IdempotencyKey.objects.filter(pk=entry.pk).update(
+                status=response.status_code, content=response.content
+            )
+        return response
+
+    return wrapper
 
 
 class ResourceView(View):
     """
     View subclass which determines the best media type to send.
+
+    Subclasses list the media types they can produce in `media_types`,
+    most preferred first. Sparse fieldsets and archived records are only
+    available in JSON.
     """
 
-    def determine_media_type(self, request):
-        # todo: handle partial wildcards in accepted media types
-        accepted_media_types = get_accepted_media_types(request)
-        if accepted_media_types:
-            possible_media_types = [self.preferred_media_type, "application/json", "text/html"]
-            for mt in accepted_media_types:
-                if mt in possible_media_types:
-                    return mt
-            if "*/*" in accepted_media_types:
-                return self.preferred_media_type
-            else:
-                return None
+    media_types = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(ResourceView, self).dispatch(request, *args, **kwargs)
+        except (NegotiationError, FieldsetError, FacetError) as err:
+            return HttpResponseBadRequest(str(err))
+        except (RecordValidationError, AccessChangeError) as err:
+            return JsonResponse({"errors": err.errors}, status=err.status)
+
+    def determine_media_type(self, request, json_only=False):
+        media_types = self.media_types
+        if json_only:
+            media_types = tuple(m for m in media_types if m.endswith("json"))
+        if "format" in request.GET:
+            # 'format' in the URL over-rides the Accept header
+            abbrev = request.GET["format"]
+            try:
+                accept = media_type_abbreviations[abbrev]
+            except KeyError:
+                raise NegotiationError("Unknown format '%s'" % abbrev)
+        elif "HTTP_ACCEPT" in request.META:
+            accept = request.META["HTTP_ACCEPT"]
         else:
-            # RFC 2616 Section 14: If no Accept header field is present, then it is assumed that the client accepts all media types.
-            return self.preferred_media_type
+            accept = request.META.get("Accept", "")
+        return negotiate(accept, media_types)
 
 
 class RecordResource(ResourceView):
-    preferred_media_type = "application/vnd.sumatra.record-v4+json"
+    media_types = (
+        "application/vnd.sumatra.record-v4+json",
+        "application/vnd.sumatra.record-v3+json",
+        "application/json",
+        "text/html",
+    )
     serializer = RecordSerializer
 
     @check_permissions
     def get(self, request, *args, **kwargs):
         filter = {"project": kwargs["project"], "label": kwargs["label"]}
-        try:
-            record = Record.objects.get(**filter)
-        except Record.DoesNotExist:
-            return HttpResponseNotFound()
-
-        media_type = self.determine_media_type(request)
+        fields = requested_fields(request.GET)
+        if fields:
+            # a sparse fieldset is read without loading the full record
+            summaries = record_summaries(Record.objects.filter(**filter), fields)
+            record = summaries and summaries[0] or None
+        else:
+            record = with_related(Record.objects).filter(**filter).first()
+        archived = None
+        if record is None:
+            archived = ArchivedRecord.objects.filter(**filter).first()
+            if archived is None:
+                return HttpResponseNotFound()
+
+        media_type = self.determine_media_type(
+            request, json_only=bool(fields) or archived is not None
+        )
         if media_type is None:
             return HttpResponseNotAcceptable()
-        content = self.serializer(media_type).encode(record, kwargs["project"], request)
-        return HttpResponse(
-            content, content_type="{}; charset=utf-8".format(media_type), status=200
-        )
+        representation = "%s;fields=%s" % (media_type, request.GET.get("fields", ""))
+        etag = record_etag(kwargs["project"], kwargs["label"], representation)
+        if etag and etag_matches(request.META.get("HTTP_IF_NONE_MATCH"), etag):
+            response = HttpResponseNotModified()
+        else:
+            serializer = self.serializer(media_type)
+            if archived is not None:
+                document = archived.to_dict()
+                if fields:
+                    content = serializer.encode_summary(
+                        document_summary(document, fields), kwargs["project"]
+                    )
+                else:
+                    content = serializer.encode_document(document)
+            elif fields:
+                content = serializer.encode_summary(record, kwargs["project"])
+            else:
+                content = serializer.encode(record, kwargs["project"], request)
+            response = HttpResponse(
+                content, content_type="{}; charset=utf-8".format(media_type), status=200
+            )
+        if etag:
+            response["ETag"] = etag
+        return response
 
     @csrf_exempt
     @check_permissions
+    @limit_body_size
+    @throttled
+    @idempotent
     def put(self, request, *args, **kwargs):
         # this performs update if the record already exists, and create otherwise
         filter = {"project": kwargs["project"], "label": kwargs["label"]}
-        attrs = json.loads(request.body)
-        try:
-            # need to check consistency between URL project, group, timestamp
-            # and the same information in request.data
-            # we should also limit the fields that can be updated
-            updatable_fields = ("reason", "outcome")
-            inst = Record.objects.get(**filter)
-            for field_name in updatable_fields:
-                setattr(inst, field_name, attrs[field_name])
-            inst.tags = ",".join(attrs["tags"])
-            inst.save()
-            return HttpResponse("", status=200)
-        except Record.DoesNotExist:
-            # check consistency between URL project, label
-            # and the same information in attrs. Remove those items from attrs
-            assert kwargs["label"] == attrs["label"]
-            project, created = Project.objects.get_or_create(id=filter["project"])
-            if created:
-                project.projectpermission_set.create(user=request.user)
-            inst = Record(project=project, label=kwargs["label"])
-            fields = [
-                field
-                for field in Record._meta.fields
-                if field.name not in ("project", "label", "db_id", "tags")
-            ]
-            for field in fields:
-                if isinstance(field, ForeignKey):
-                    fk_model = field.remote_field.model
-                    obj_attrs = keys2str(attrs[field.name])
-                    fk_inst, created = fk_model.objects.get_or_create(**obj_attrs)
-                    setattr(inst, field.name, fk_inst)
-                else:
-                    setattr(inst, field.name, attrs[field.name])
-            inst.tags = ",".join(attrs["tags"])
-            inst.save()
-            for field in Record._meta.many_to_many:
-                for obj_attrs in attrs[field.name]:
-                    getattr(inst, field.name).get_or_create(**keys2str(obj_attrs))
-            for obj_attrs in attrs["output_data"]:
-                inst.output_data.get_or_create(**keys2str(obj_attrs))
-            inst.save()
-            return HttpResponse("Created", status=201)
-        except Record.MultipleObjectsReturned:  # this should never happen
-            return HttpResponse("Conflict/Duplicate", status=409)
+        attrs = decode_body(request)
+        # the document is validated in full before anything is written
+        if not (
+            Record.objects.filter(**filter).exists()
+            or ArchivedRecord.objects.filter(**filter).exists()
+        ):
+            if "HTTP_IF_MATCH" in request.META:
+                # the client expected the record to exist already
+                return HttpResponse("Precondition Failed", status=412)
+            validate_record(attrs, kwargs["label"])
+            try:
+                with transaction.atomic():
+                    project, created = Project.objects.get_or_create(id=filter["project"])
+                    if created:
+                        project.projectpermission_set.create(user=request.user)
+                    create_record(project, kwargs["label"], attrs)
+                return HttpResponse("Created", status=201)
+            except IntegrityError:
+                # another request created the same record in the meantime,
+                # in which case this request becomes an update
+                if not Record.objects.filter(**filter).exists():
+                    raise
+        validate_update(attrs)
+        with transaction.atomic():
+            # archived records are restored before being modified
+            restore_if_archived(kwargs["project"], kwargs["label"])
+            # lock the row, so that concurrent updates are applied one at a time
+            inst = Record.objects.select_for_update().get(**filter)
+            if "HTTP_IF_MATCH" in request.META and not revision_matches(
+                request.META["HTTP_IF_MATCH"], record_etag(inst.project_id, inst.label)
+            ):
+                transaction.set_rollback(True)  # leaving an archived record in the archive
+                return HttpResponse("Precondition Failed", status=412)
+            update_record(inst, attrs)
+        return HttpResponse("", status=200)
 
     @check_permissions
+    @throttled
+    @idempotent
     def delete(self, request, *args, **kwargs):
         filter = {"project": kwargs["project"], "label": kwargs["label"]}
         try:
-            record = Record.objects.get(**filter)
-            record.delete()
+            with transaction.atomic():
+                restore_if_archived(kwargs["project"], kwargs["label"])
+                record = Record.objects.get(**filter)
+                delete_record(record)
             return HttpResponse("", status=204)
         except Record.MultipleObjectsReturned:
             return HttpResponse("Conflict/Duplicate", status=409)
@@ -236,25 +412,38 @@ class RecordResource(ResourceView):
 
 
 class ProjectResource(ResourceView):
-    preferred_media_type = "application/vnd.sumatra.project-v4+json"
+    media_types = (
+        "application/vnd.sumatra.project-v4+json",
+        "application/vnd.sumatra.project-v3+json",
+        "application/json",
+        "text/html",
+    )
     serializer = ProjectSerializer
 
     @check_permissions
     def get(self, request, *args, **kwargs):
-        media_type = self.determine_media_type(request)
+        fields = requested_fields(request.GET)
+        media_type = self.determine_media_type(request, json_only=bool(fields))
         if media_type is None:
             return HttpResponseNotAcceptable()
 
-        try:
-            project = Project.objects.get(id=kwargs["project"])
-        except Project.DoesNotExist:
+        project = get_project(kwargs["project"])
+        if project is None:
             return HttpResponseNotFound()
-        records = project.record_set.all()
+        records = filter_records(Record.objects.filter(project=project.id), request.GET)
         tags = request.GET.get("tags", None)
-        if tags:
-            records = records.filter(tags__contains=tags)
+        facets = None
+        if "facets" in request.GET:
+            facets = project_facets(project.id, parse_facets(request.GET["facets"]))
+        archived = None
+        if request.GET.get("archived"):
+            archived = ArchivedRecord.objects.filter(project=project.id).values_list(
+                "label", flat=True
+            )
 
-        content = self.serializer(media_type).encode(project, records, tags, request)
+        content = self.serializer(media_type).encode(
+            project, records, tags, request, fields, facets, archived
+        )
         return HttpResponse(
             content, content_type="{}; charset=utf-8".format(media_type), status=200
         )
@@ -270,7 +459,7 @@ class ProjectResource(ResourceView):
         data = json.loads(request.body)
         for attr in ("name", "description"):
             if attr in data:
-                setattr(project, attr, request.data[attr])
+                setattr(project, attr, data[attr])
                 changed = True
         if changed:
             project.save()
@@ -282,7 +471,12 @@ class ProjectResource(ResourceView):
 
 
 class ProjectListResource(ResourceView):
-    preferred_media_type = "application/vnd.sumatra.project-list-v4+json"
+    media_types = (
+        "application/vnd.sumatra.project-list-v4+json",
+        "application/vnd.sumatra.project-list-v3+json",
+        "application/json",
+        "text/html",
+    )
     serializer = ProjectListSerializer
 
     def get(self, request, *args, **kwargs):
@@ -294,22 +488,34 @@ class ProjectListResource(ResourceView):
         auth = AuthenticationDispatcher()
         auth.is_authenticated(request)
 
-        projects = reversed(
-            sorted(
-                Project.objects.filter(
-                    projectpermission__user__username__in=(request.user.username, "anonymous")
-                ).distinct(),
-                key=lambda project: project.last_updated(),
-            )
+        projects = [
+            project
+            for project in sorted(project_index().values(), key=lambda p: p.id)
+            if project.public or request.user.username in project.access
+        ]
+        last_updated = dict(
+            Record.objects.filter(project__in=[project.id for project in projects])
+            .order_by()
+            .values("project")
+            .annotate(timestamp=Max("timestamp"))
+            .values_list("project", "timestamp")
         )
-        content = self.serializer(media_type).encode(projects, request)
+        # most recently updated first, projects without records last
+        projects.sort(key=lambda p: last_updated.get(p.id) or datetime.min, reverse=True)
+        content = self.serializer(media_type).encode(projects, last_updated, request)
         return HttpResponse(
             content, content_type="{}; charset=utf-8".format(media_type), status=200
         )
 
 
 class PermissionListResource(ResourceView):
-    preferred_media_type = "application/json"
+    """
+    The users and groups with access to a project. A POST with a JSON body
+    grants and revokes access for several users and groups at once (see
+    permissions.change_access()); a form POST grants access to one user.
+    """
+
+    media_types = ("application/json", "text/html")
     serializer = PermissionListSerializer
 
     @check_permissions
@@ -317,9 +523,8 @@ class PermissionListResource(ResourceView):
         media_type = self.determine_media_type(request)
         if media_type is None:
             return HttpResponseNotAcceptable()
-        try:
-            project = Project.objects.get(id=kwargs["project"])
-        except Project.DoesNotExist:
+        project = get_project(kwargs["project"])
+        if project is None:
             return HttpResponseNotFound()
         content = self.serializer(media_type).encode(project, request)
         return HttpResponse(
@@ -327,15 +532,323 @@ class PermissionListResource(ResourceView):
         )
 
     @csrf_exempt  # should not be exempt when requesting text/html
-    @check_permissions
+    @check_access
     def post(self, request, *args, **kwargs):
         try:
             project = Project.objects.get(id=kwargs["project"])
         except Project.DoesNotExist:
             return HttpResponseNotFound()
+        if request.content_type == "application/json":
+            change_access(project, decode_body(request))
+            content = self.serializer("application/json").encode(get_project(project.id), request)
+            return HttpResponse(content, content_type="application/json; charset=utf-8")
         form = PermissionsForm(request.POST)
         if form.is_valid():
             project.projectpermission_set.create(user=form.cleaned_data["user"])
             return HttpResponseRedirect(reverse("sumatra-project", args=[project.id]))
         else:
             return HttpResponseBadRequest(form.errors)
+
+
+class RevisionListResource(ResourceView):
+    """
+    The changes made to the records of a project, in order of revision.
+
+    Without a label, lists changes to all records with a revision greater
+    than the ``since`` query parameter, so that a client can bring a copy
+    of the project up to date. With a label, lists the full history of
+    that record.
+    """
+
+    media_types = ("application/json",)
+    serializer = RevisionListSerializer
+    max_changes = 1000
+
+    @check_permissions
+    def get(self, request, *args, **kwargs):
+        media_type = self.determine_media_type(request)
+        if media_type is None:
+            return HttpResponseNotAcceptable()
+        try:
+            since = int(request.GET.get("since", 0))
+            limit = int(request.GET.get("limit", self.max_changes))
+        except ValueError:
+            return HttpResponseBadRequest("'since' and 'limit' must be integers")
+        limit = max(0, min(limit, self.max_changes))
+        # read the current revision first, so that a client using it as its
+        # next 'since' value cannot miss changes made during this request
+        current = RevisionCounter.current_revision(kwargs["project"])
+        revisions = RecordRevision.objects.filter(
+            project=kwargs["project"], revision__gt=since, revision__lte=current
+        )
+        if "label" in kwargs:
+            revisions = revisions.filter(label=kwargs["label"])
+        revisions = list(revisions[: limit + 1])
+        more = len(revisions) > limit
+        revisions = revisions[:limit]
+        latest = current
+        if more:
+            current = revisions[-1].revision if revisions else since
+        content = self.serializer(media_type).encode(
+            kwargs["project"], current, latest, revisions, more, request
+        )
+        return HttpResponse(
+            content, content_type="{}; charset=utf-8".format(media_type), status=200
+        )
+
+
+class RecordBatchResource(ResourceView):
+    """
+    Several records of a project, fetched in a single request by giving a
+    comma-separated list of labels in the ``labels`` query parameter, or a
+    list of labels in a JSON request body, ``{"labels": [...]}``, sent with
+    POST. A sparse fieldset may be requested with the ``fields`` parameter.
+    Archived records are included.
+    """
+
+    media_types = (
+        "application/vnd.sumatra.record-batch-v4+json",
+        "application/vnd.sumatra.record-batch-v3+json",
+        "application/json",
+    )
+    serializer = RecordBatchSerializer
+
+    @property
+    def max_records(self):
+        return getattr(settings, "SUMATRA_MAX_BATCH_SIZE", 100)
+
+    @check_permissions
+    def get(self, request, *args, **kwargs):
+        return self.fetch(request, requested_labels(request.GET), kwargs["project"])
+
+    @csrf_exempt
+    @check_permissions
+    @limit_body_size
+    def post(self, request, *args, **kwargs):
+        try:
+            labels = json.loads(request.body)["labels"]
+        except (ValueError, TypeError, KeyError):
+            return HttpResponseBadRequest('Expected a JSON object, {"labels": [...]}')
+        if not (isinstance(labels, list) and all(isinstance(label, str) for label in labels)):
+            return HttpResponseBadRequest("'labels' must be a list of strings")
+        return self.fetch(request, labels, kwargs["project"])
+
+    def fetch(self, request, labels, project_id):
+        media_type = self.determine_media_type(request)
+        if media_type is None:
+            return HttpResponseNotAcceptable()
+        labels = list(OrderedDict.fromkeys(labels))  # without duplicates
+        if len(labels) > self.max_records:
+            return HttpResponseBadRequest(
+                "At most %d records may be requested at once" % self.max_records
+            )
+        fields = requested_fields(request.GET)
+        records = Record.objects.filter(project=project_id, label__in=labels)
+        if fields:
+            summaries = record_summaries(records, fields)
+            records = dict((summary["label"], summary) for summary in summaries)
+        else:
+            records = dict((record.label, record) for record in with_related(records))
+        missing = [label for label in labels if label not in records]
+        if missing:
+            archived = ArchivedRecord.objects.filter(project=project_id, label__in=missing)
+            for entry in archived:
+                document = entry.to_dict()
+                records[entry.label] = fields and document_summary(document, fields) or document
+            missing = [label for label in missing if label not in records]
+        content = self.serializer(media_type).encode(
+            [records[label] for label in labels if label in records],
+            missing,
+            project_id,
+            request,
+            sparse=bool(fields),
+        )
+        return HttpResponse(
+            content, content_type="{}; charset=utf-8".format(media_type), status=200
+        )
+
+
+class ProjectStatsResource(ResourceView):
+    """
+    Summary statistics for the records of a project, optionally filtered in
+    the same way as the record list. The number of bins in the histogram of
+    durations can be set with the ``bins`` query parameter.
+    """
+
+    media_types = ("application/json",)
+    serializer = ProjectStatsSerializer
+    filters = ("tags",)
+
+    @check_permissions
+    def get(self, request, *args, **kwargs):
+        media_type = self.determine_media_type(request)
+        if media_type is None:
+            return HttpResponseNotAcceptable()
+        try:
+            bins = int(request.GET.get("bins", default_bins))
+        except ValueError:
+            return HttpResponseBadRequest("'bins' must be an integer")
+        if not 1 <= bins <= max_bins:
+            return HttpResponseBadRequest("'bins' must be between 1 and %d" % max_bins)
+        records = filter_records(Record.objects.filter(project=kwargs["project"]), request.GET)
+        filters = dict((name, request.GET[name]) for name in self.filters if name in request.GET)
+        data = cached_project_statistics(kwargs["project"], records, filters, bins)
+        content = self.serializer(media_type).encode(kwargs["project"], data, filters, request)
+        return HttpResponse(
+            content, content_type="{}; charset=utf-8".format(media_type), status=200
+        )
+
+
+class RecordComparisonResource(ResourceView):
+    """
+    The differences between two or more records of a project, given as a
+    comma-separated list of labels in the ``labels`` query parameter.
+    """
+
+    media_types = ("application/json",)
+    serializer = RecordComparisonSerializer
+    max_records = 20
+
+    @check_permissions
+    def get(self, request, *args, **kwargs):
+        media_type = self.determine_media_type(request)
+        if media_type is None:
+            return HttpResponseNotAcceptable()
+        labels = requested_labels(request.GET)
+        if not 2 <= len(labels) <= self.max_records:
+            return HttpResponseBadRequest(
+                "Between 2 and %d labels must be given" % self.max_records
+            )
+        records = with_related(Record.objects).filter(project=kwargs["project"], label__in=labels)
+        records = dict((record.label, record) for record in records)
+        missing = [label for label in labels if label not in records]
+        comparison = compare_records([records[label] for label in labels if label in records])
+        content = self.serializer(media_type).encode(
+            kwargs["project"], comparison, missing, request
+        )
+        return HttpResponse(
+            content, content_type="{}; charset=utf-8".format(media_type), status=200
+        )
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header requesting a single range of bytes. Returns None to
+    send the whole content, or a (start, end) tuple, with end inclusive.
+    Raises ValueError if the range cannot be satisfied.
+    """
+    match = re.match(r"^bytes=(\d*)-(\d*)$", header or "")
+    if not match or match.groups() == ("", ""):
+        return None  # ignored, as are multiple ranges
+    start, end = match.groups()
+    if start:
+        start, end = int(start), min(int(end or size - 1), size - 1)
+    else:
+        # the last N bytes
+        start, end = max(0, size - int(end)), size - 1
+    if start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class BlobResource(View):
+    """
+    The content of a data file produced or used by a record in the project,
+    identified by its SHA-1 digest. Available if SUMATRA_BLOB_ROOT is set.
+
+    A file may be uploaded with a single PUT request, or in several parts,
+    each sent with a ``Content-Range: bytes <start>-<end>/<total>`` header.
+    Until the last part, the response has status 308 and a Range header
+    giving the bytes received so far. ``Content-Range: bytes */<total>``,
+    with an empty body, asks how much has been received, so that an
+    interrupted upload can be resumed.
+    """
+
+    content_range_pattern = re.compile(r"^bytes (?:(\d+)-(\d+)|\*)/(\d+)$")
+
+    def get_data_key(self, store, project, digest):
+        """A data key with this digest belonging to the project, or None."""
+        if store is None:
+            return None
+        key = (
+            DataKey.objects.filter(digest=digest)
+            .filter(Q(output_from_record__project=project) | Q(input_to_records__project=project))
+            .first()
+        )
+        if key is None:
+            key = ArchivedDataKey.objects.filter(digest=digest, record__project=project).first()
+        return key
+
+    @check_permissions
+    def get(self, request, *args, **kwargs):
+        store = get_blob_store()
+        digest = kwargs["digest"]
+        key = self.get_data_key(store, kwargs["project"], digest)
+        if key is None or not store.exists(digest):
+            return HttpResponseNotFound()
+        size = store.size(digest)
+        try:
+            byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%d" % size
+            return response
+        if byte_range is None:
+            # served with the server's file wrapper (e.g. sendfile) where available
+            response = FileResponse(
+                store.open(digest),
+                as_attachment=True,
+                filename=os.path.basename(key.path),
+                content_type="application/octet-stream",
+            )
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                store.iter_range(digest, start, end),
+                status=206,
+                content_type="application/octet-stream",
+            )
+            response["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+            response["Content-Length"] = end - start + 1
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = '"%s"' % digest
+        return response
+
+    @csrf_exempt
+    @check_permissions
+    @throttled
+    def put(self, request, *args, **kwargs):
+        store = get_blob_store()
+        digest = kwargs["digest"]
+        if self.get_data_key(store, kwargs["project"], digest) is None:
+            return HttpResponseNotFound()
+        if store.exists(digest):
+            return HttpResponse("", status=200)  # already stored, perhaps for another record
+        content_range = request.META.get("HTTP_CONTENT_RANGE")
+        try:
+            if not content_range:
+                store.write(digest, request)
+                return HttpResponse("Created", status=201)
+            match = self.content_range_pattern.match(content_range)
+            if not match:
+                return HttpResponseBadRequest("Invalid Content-Range header")
+            start, end, total = match.groups()
+            if start is None:
+                received = store.received(digest)
+            elif int(start) > int(end) or int(end) >= int(total):
+                return HttpResponseBadRequest("Invalid Content-Range header")
+            else:
+                received = store.append(digest, request, int(start), int(end))
+            if received == int(total):
+                store.complete(digest)
+                return HttpResponse("Created", status=201)
+        except BlobError as err:
+            if err.received is None:
+                return HttpResponseBadRequest(str(err))
+            response = HttpResponse(str(err), status=err.status)
+            received = err.received
+        else:
+            response = HttpResponse("", status=308)
+        if received:
+            response["Range"] = "bytes=0-%d" % (received - 1)
+        return response
@@ -0,0 +1,35 @@
+"""
+Work which a server process would otherwise do while answering its first
+requests: importing the views and the modules they load on demand, and
+compiling the templates.
+
+If the ``SUMATRA_WARM_UP`` setting is True, this is done when Django starts,
+so that with a server which loads the application before starting its
+worker processes (e.g. ``gunicorn --preload``) it is done only once, and new
+workers answer their first requests as quickly as later ones.
+
+:copyright: Copyright 2010-2020 Andrew Davison
+:license: BSD 2-clause, see COPYING for details.
+"""
+
+from django.template import Context, Template
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+
+templates = (
+    "project_list.html",
+    "project_detail.html",
+    "project_permissions.html",
+    "record_detail.html",
+)
+
+
+def warm_up():
+    get_resolver().url_patterns  # imports the URLconf and the views
+    for name in templates:
+        # with the cached template loader (the default when DEBUG is False),
+        # compiled templates are kept for the lifetime of the process
+        get_template(name)
+    # the "restructuredtext" filter imports docutils when first used
+    Template("{% load filters %}{{ text|restructuredtext }}").render(Context({"text": "*"}))